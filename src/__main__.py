@@ -5,9 +5,7 @@ __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
 
 import os, sys, time
-from sos.utils import env, get_traceback
 from .version import __version__
-from .syntax import DSC_CACHE
 
 
 class Timer(object):
@@ -23,6 +21,7 @@ class Timer(object):
         self.secs = self.end - self.start
         self.msecs = self.secs * 1000  # millisecs
         if self.verbose:
+            from sos.utils import env
             env.logger.info('Elapsed time ``%.03f`` seconds.' % self.secs)
 
     def disable(self):
@@ -30,6 +29,7 @@ class Timer(object):
 
 
 def remove(workflows, groups, modules, db, purge=False):
+    from sos.utils import env
     from .dsc_database import remove_unwanted_output, remove_obsolete_output
     if purge and modules:
         remove_unwanted_output(workflows, groups, modules, db, zap=False)
@@ -69,7 +69,105 @@ def plain_remove(outdir):
             os.remove(item)
 
 
+def fmt_time(secs):
+    if secs is None:
+        return 'NA'
+    for unit, size in [('d', 86400), ('h', 3600), ('m', 60)]:
+        if secs >= size:
+            return f'{secs / size:.1f}{unit}'
+    return f'{secs:.1f}s'
+
+
+def print_table(rows):
+    widths = [max([len(x[i]) for x in rows]) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join([x.ljust(w) if i == 0 else x.rjust(w) for i, (x, w) in enumerate(zip(row, widths))]))
+
+
+def print_plan(plan, n_jobs, host_conf=None):
+    from sos.utils import env
+
+    def fmt_size(size):
+        if size is None:
+            return 'NA'
+        for unit in ['B', 'K', 'M', 'G']:
+            if size < 1024:
+                return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+            size /= 1024
+        return f'{size:.1f}T'
+
+    rows = [['module', 'instances', 'cached', 'to run', 'time per job', 'time to run', 'output size', 'new output']]
+    for module, item in plan.items():
+        rows.append([
+            module,
+            str(item.instances),
+            str(item.cached),
+            str(item.to_run),
+            fmt_time(item.mean_time),
+            fmt_time(item.time) if item.to_run else fmt_time(0),
+            fmt_size(item.size),
+            fmt_size(item.new_size) if item.to_run else fmt_size(0)
+        ])
+    print_table(rows)
+    if host_conf:
+        # packing of module instances into jobs on remote queues
+        rows = [['module', 'queue', 'instances per job', 'walltime per instance', 'memory per instance', 'jobs']]
+        for module, item in plan.items():
+            conf = host_conf[module] if module in host_conf else host_conf['default']
+            if 'trunk_size' not in conf:
+                rows.append([module, conf['queue'], '-', '-', '-', 'local'])
+                continue
+            rows.append([
+                module, conf['queue'],
+                str(conf['trunk_size']),
+                str(conf['walltime']),
+                str(conf['mem']),
+                str(-(-item.to_run // conf['trunk_size']))
+            ])
+        print()
+        print_table(rows)
+    to_run = sum([x.to_run for x in plan.values()])
+    total = sum([x.time for x in plan.values() if x.to_run and x.time is not None])
+    unknown = [k for k, x in plan.items() if x.to_run and x.time is None]
+    env.logger.info(f"``{to_run}`` out of ``{sum([x.instances for x in plan.values()])}`` module instances to run, "\
+                    f"estimated to take ``{fmt_time(total)}`` in total or ``{fmt_time(total / max(n_jobs, 1))}`` on ``{n_jobs}`` threads.")
+    if unknown:
+        env.logger.warning(f"No runtime from previous runs is available for module ``{', '.join(unknown)}``, "\
+                           "which is not included in time estimate.")
+
+
+def set_memory_limit(limit, workflows, learned, leases):
+    '''
+    Pass memory budget of local jobs, and memory required by modules as
+    declared via `@CONF: memory` or else learned from previous runs,
+    to module scripts. See `dsc_io.acquire_memory`.
+    '''
+    import json
+    from sos.utils import env, expand_size
+    try:
+        limit = expand_size(limit)
+    except Exception:
+        raise ValueError(f'Invalid memory size ``{limit}`` for ``--mem-limit``, eg "16G" is expected.')
+    required = dict(learned)
+    for workflow in workflows:
+        for module in workflow.values():
+            if module.memory is not None:
+                required[module.name] = module.memory
+    too_large = [k for k, v in required.items() if v > limit]
+    if too_large:
+        env.logger.warning(f"Module ``{', '.join(too_large)}`` requires more memory than ``--mem-limit`` "\
+                           "and will only run when no other job is running.")
+    os.environ['DSC_MEM_LIMIT'] = str(limit)
+    os.environ['DSC_MEM_REQUIRED'] = json.dumps(required)
+    os.environ['DSC_MEM_LEASES'] = os.path.abspath(leases)
+
+
 def execute(args, unknown_args):
+    from sos.utils import env
+    from .syntax import DSC_CACHE
+    if args.__status__:
+        print_status(args.__status__)
+        return
     if args.to_remove:
         if args.target is None and args.to_remove not in ('obsolete', 'all'):
             raise ValueError("``-d`` must be specified with ``--target``.")
@@ -81,20 +179,25 @@ def execute(args, unknown_args):
     # Import packages
     from .utils import workflow2html, transcript2html
     from sos import execute_workflow
-    from .dsc_parser import DSC_Script, DSC_Pipeline, remote_config_parser
+    from .dsc_parser import load_dsc_script, remote_config_parser
     from .dsc_translator import DSC_Translator
-    # Parse DSC script
-    script = DSC_Script(args.dsc_file,
-                        output=args.output,
-                        sequence=args.target,
-                        global_params=unknown_args,
-                        truncate=args.truncate,
-                        replicate=1 if args.truncate else args.replicate,
-                        host=args.host,
-                        debug = args.debug)
+    from .utils import profiler
+    # Parse DSC script, or load it from cache if nothing has changed
+    profiler.start('parse')
+    script, pipeline_obj = load_dsc_script(
+        args.dsc_file,
+        cache=not args.__refresh_R__,
+        output=args.output,
+        sequence=args.target,
+        global_params=unknown_args,
+        truncate=args.truncate,
+        replicate=1 if args.truncate else args.replicate,
+        host=args.host,
+        debug=args.debug)
     script.init_dsc(env)
-    pipeline_obj = DSC_Pipeline(script).pipelines
     db = os.path.basename(script.runtime.output)
+    runtime_db = f'{DSC_CACHE}/{db}.runtime.pkl'
+    profiler.prefix = f'{DSC_CACHE}/{db}'
     # Apply clean-up
     if args.to_remove:
         if args.to_remove == 'all':
@@ -113,17 +216,39 @@ def execute(args, unknown_args):
                       list(script.dump().values()))
     # Generate remote job configuration settings
     if args.host:
-        conf = remote_config_parser(args.host)
+        from .dsc_database import load_runtime_history, get_module_runtime, get_module_memory
+        history = load_runtime_history(runtime_db)
+        conf = remote_config_parser(args.host, get_module_runtime(history),
+                                    get_module_memory(history))
         conf_tpl = {'localhost': 'localhost', 'hosts': conf['DSC']}
     else:
         conf = conf_tpl = dict()
+    if args.__global_cache_limit__:
+        from sos.utils import expand_size
+        try:
+            cache_limit = expand_size(args.__global_cache_limit__)
+        except Exception:
+            raise ValueError(f'Invalid size ``{args.__global_cache_limit__}`` for ``--global-cache-limit``, eg "100G" is expected.')
+    if args.__global_cache_age__:
+        from sos.utils import expand_time
+        try:
+            cache_age = expand_time(args.__global_cache_age__)
+        except Exception:
+            raise ValueError(f'Invalid time ``{args.__global_cache_age__}`` for ``--global-cache-age``, eg "30d" is expected.')
+    if args.__mem_limit__:
+        from .dsc_database import load_runtime_history, get_module_memory
+        set_memory_limit(args.__mem_limit__, pipeline_obj,
+                         get_module_memory(load_runtime_history(runtime_db)),
+                         f'{DSC_CACHE}/{db}.memory')
     # Obtain pipeline scripts
+    profiler.start('translation')
     pipeline = DSC_Translator(
         pipeline_obj, script.runtime, args.__construct__ == "none",
         args.__max_jobs__, False, None
         if len(conf) == 0 else {k: v
                                 for k, v in conf.items() if k != 'DSC'},
-        args.debug and args.verbosity == 0)
+        args.debug and args.verbosity == 0,
+        args.__global_cache__ if args.__construct__ != "none" else None)
     # Generate DSC meta databases
     env.logger.info(f"Constructing DSC from ``{args.dsc_file}`` ...")
     script_prepare = pipeline.get_pipeline("prepare", args.debug)
@@ -137,24 +262,50 @@ def execute(args, unknown_args):
         settings['sig_mode'] = "force"
     # Get mapped IO database
     settings['verbosity'] = args.verbosity if args.debug else 1
+    profiler.start('deploy')
     status = execute_workflow(script_prepare,
                               workflow='deploy',
                               options=settings)
     env.verbosity = args.verbosity
+    if args.__plan__:
+        profiler.start('plan')
+        from .dsc_io import load_io_db
+        from .dsc_database import plan_benchmark
+        print_plan(
+            plan_benchmark(load_io_db(f'{DSC_CACHE}/{db}.io.pkl'),
+                           pipeline.module_ids, runtime_db), args.__max_jobs__,
+            conf)
+        return
     if args.__construct__ == "existing":
         settings['sig_mode'] = "build"
     if args.__construct__ == "lenient":
         settings['sig_mode'] = "skip"
     # Get DSC meta database
     env.logger.info("Building DSC database ...")
+    profiler.start('build')
     status = execute_workflow(script_prepare,
                               workflow='build',
                               options=settings)
     if args.__construct__ == "all":
         return
-    # Get the executed pipeline
-    pipeline.filter_execution(args.debug)
-    script_run = pipeline.get_pipeline("run", args.debug)
+    # Get the executed pipeline, with steps ordered by predicted runtime
+    profiler.start('schedule')
+    from .dsc_io import load_io_db
+    from .dsc_database import get_module_output, update_runtime_history, predict_runtime, \
+        check_signature_index, update_signature_index
+    io_db = load_io_db(f'{DSC_CACHE}/{db}.io.pkl')
+    module_output = get_module_output(io_db)
+    # steps downstream of outdated output are to run, and cost as much
+    runtime = predict_runtime(update_runtime_history(runtime_db, module_output),
+                              module_output, pipeline.module_ids, io_db)
+    # With "strict", SoS checks signatures of all output files even if nothing has changed,
+    # which takes long for large benchmarks; it is not run if the signature index says so
+    signature_db = f'{DSC_CACHE}/{db}.signatures.pkl'
+    up_to_date = args.__construct__ == 'strict' and not (args.debug or args.__dag__) and \
+        check_signature_index(signature_db, module_output, pipeline.module_ids)
+    if not up_to_date:
+        pipeline.filter_execution(args.debug, runtime)
+        script_run = pipeline.get_pipeline("run", args.debug)
     if args.debug:
         if args.host:
             import yaml
@@ -165,19 +316,34 @@ def execute(args, unknown_args):
     env.logger.debug(f"Running command ``{' '.join(sys.argv)}``")
     if os.path.isfile(f'{env.exec_dir}/transcript.txt'):
         os.remove(f'{env.exec_dir}/transcript.txt')
-    env.logger.info(f"Building execution graph & running DSC ...")
+    env.verbosity = args.verbosity
+    if up_to_date:
+        env.logger.info("All module instances are up-to-date.")
+    else:
+        env.logger.info(f"Building execution graph & running DSC ...")
     # making verbosity level consistent with before SoS version 0.21.2
     verbosity_map = {0:1,1:0,2:2 if args.host else 0,3:3,4:4}
+    from .dsc_io import log_event
+    event_log = f'{DSC_CACHE}/{db}.events.jsonl'
+    log_event(event_log, 'run_started', output = script.runtime.output, jobs = args.__max_jobs__,
+              to_run = dict([(k, len([x for x in v if runtime[x] != 0])) for k, v in module_output.items()]))
+    run_status = 'failed'
     try:
         if not args.error_mode == 'ignore-safe':
             settings['error_mode'] = args.error_mode
         settings['verbosity'] = verbosity_map[args.verbosity]
         settings['output_dag'] = f'{db}.dot' if args.__dag__ else None
-        status = execute_workflow(script_run,
-                                  workflow='DSC',
-                                  options=settings,
-                                  config=conf_tpl)
+        profiler.start('run')
+        if not up_to_date:
+            status = execute_workflow(script_run,
+                                      workflow='DSC',
+                                      options=settings,
+                                      config=conf_tpl)
         env.verbosity = args.verbosity
+        run_status = 'completed'
+    except KeyboardInterrupt:
+        run_status = 'interrupted'
+        raise
     except Exception as e:
         if args.host is None:
             transcript2html(f'{env.exec_dir}/transcript.txt',
@@ -187,6 +353,20 @@ def execute(args, unknown_args):
                                "the errors;\nadditional scripts upstream of the error can be found in " \
                                f"``{db}.scripts.html``.\n" + '=' * 75)
         raise Exception(e)
+    finally:
+        close_event_log(event_log, run_status)
+    # Record runtime of module instances completed in this run
+    profiler.start('history')
+    update_runtime_history(runtime_db, module_output)
+    # "lenient" skips outdated output so the index is not updated
+    if not up_to_date and args.__construct__ != 'lenient':
+        update_signature_index(signature_db, module_output, pipeline.module_ids)
+    if args.__global_cache_limit__ or args.__global_cache_age__:
+        from .dsc_io import evict_cache
+        from .syntax import DSC_GLOBAL_CACHE
+        evict_cache(args.__global_cache__ or os.path.expanduser(DSC_GLOBAL_CACHE),
+                    cache_limit if args.__global_cache_limit__ else None,
+                    cache_age if args.__global_cache_age__ else None)
     # Plot DAG
     if args.__dag__:
         from sos.utils import dot_to_gif
@@ -205,6 +385,51 @@ def execute(args, unknown_args):
     env.logger.info("DSC complete!")
 
 
+def close_event_log(event_log, status):
+    '''
+    Mark module instances of the current run that started but did not
+    finish as failed, then mark the end of the run in execution log
+    '''
+    from .dsc_io import load_events, log_event
+    started = dict()
+    for item in load_events(event_log):
+        if item['event'] == 'started':
+            started[item['output']] = item['module']
+        elif item['event'] in ('finished', 'failed'):
+            started.pop(item['output'], None)
+    for output, module in started.items():
+        log_event(event_log, 'failed', module = module, output = output)
+    log_event(event_log, 'run_finished', status = status)
+
+
+def print_status(output):
+    from datetime import datetime
+    from .dsc_io import load_events
+    from .dsc_database import summarize_events
+    from .syntax import DSC_CACHE
+    event_log = f'{DSC_CACHE}/{os.path.basename(os.path.normpath(output))}.events.jsonl'
+    res = summarize_events(load_events(event_log))
+    if res is None:
+        raise ValueError(f'No execution log ``{event_log}`` is found for benchmark ``{output}``.')
+
+    print(f"Run on {res.host} started at {datetime.fromtimestamp(res.started).strftime('%Y-%m-%d %H:%M:%S')}, "\
+          f"{res.state} after {fmt_time(res.elapsed)}")
+    rows = [['module', 'to run', 'finished', 'cached', 'failed', 'running', 'queued']]
+    for module, item in res.modules.items():
+        rows.append([module] + [str(item[x]) for x in ['to_run', 'finished', 'cached', 'failed', 'running', 'queued']])
+    print()
+    print_table(rows)
+    if res.slowest:
+        rows = [['slowest instances', 'module', 'host', 'time']]
+        for secs, module, fn, host in res.slowest:
+            rows.append([fn, module, host, fmt_time(secs)])
+        print()
+        print_table(rows)
+    print()
+    print(f"Throughput: {res.rate * 60:.1f} module instances per minute" + \
+          (f", estimated time to completion: {fmt_time(res.eta)}" if res.state == 'running' else ''))
+
+
 def main():
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, SUPPRESS
 
@@ -262,6 +487,8 @@ def main():
                     default="strict",
                     help='''How DSC skips or overwrites existing results.
                    "strict": skips jobs whose input, output and code have not been changed since previous execution.
+                   If no job has changed since the last complete run, as recorded in an index of output file
+                   signatures, no job is checked.
                    "lenient": skips jobs whose output timestamp are newer than their input.
                    It can be used to avoid re-run when nuisent changes are made to module scripts that should not impact results.
                    "existing": skips jobs whose output exists, and mark existing output as "up-to-date" for future re-runs.
@@ -270,6 +497,27 @@ def main():
                    "all": skips all modules and only build meta-database required to run `dsc-query` command.
                    It can be used for salvaging a partially completed benchmark making it possible to query from it.
                    "none": force executes DSC from scratch.''')
+    mt.add_argument('--refresh-R',
+                    action='store_true',
+                    dest='__refresh_R__',
+                    help='''Evaluate again `R()` expressions in DSC file, whose values are otherwise
+                   cached in ".dsc/R_eval.pkl" by R version and expression text.
+                   It should be used when values depend on files, packages or random numbers that
+                   have changed since the previous run. Only modules with changed parameter values are re-run.''')
+    mt.add_argument('--plan',
+                    action='store_true',
+                    dest='__plan__',
+                    help='''Plan the benchmark without running it.
+                   Reports for each module the number of instances to run and of those with
+                   up-to-date output from previous runs, along with estimated runtime and output size
+                   based on existing output.''')
+    mt.add_argument('--status',
+                    metavar='output',
+                    dest='__status__',
+                    help='''Summarize progress of the latest run of benchmark with given output folder,
+                   including while it is still running: module instances finished, failed and running
+                   per module, throughput, estimated time to completion and slowest instances.
+                   It does not need a DSC script, ie, "dsc --status <output>" can be used.''')
     mt.add_argument('--touch',
                     action='store_true',
                     dest='__recover__',
@@ -308,6 +556,52 @@ def main():
         help=
         '''Maximum number of CPU threads for local runs, or job managing sockets for remote execution.'''
     )
+    ro.add_argument(
+        '--mem-limit',
+        metavar='size',
+        dest='__mem_limit__',
+        help=
+        '''Memory budget for module instances running at the same time on the local computer, eg "16G".
+                   Memory required by a module is set by "@CONF: memory = ..." in DSC file, or otherwise learned from
+                   peak memory of its instances in previous runs.'''
+    )
+    ro.add_argument(
+        '--global-cache',
+        metavar='dir',
+        dest='__global_cache__',
+        default=os.environ.get('DSC_GLOBAL_CACHE'),
+        help='''Folder of output of module instances shared by all benchmarks, defaults to environment variable
+                   "DSC_GLOBAL_CACHE". Module instances whose code, parameters and upstream modules are the same as
+                   those already in it, from this or any other benchmark, are linked into the output folder
+                   instead of being run. Modules with "$file" output are not cached. Modules with "cache = true"
+                   in @CONF are always cached, in "~/.cache/dsc" unless this option is set, by their code,
+                   parameters and seed only, so that they are shared by benchmarks with different
+                   parameter values.'''
+    )
+    ro.add_argument(
+        '--global-cache-limit',
+        metavar='size',
+        dest='__global_cache_limit__',
+        help='''Size of global cache, eg "100G". Least recently used files are removed after
+                   a run when it is exceeded.'''
+    )
+    ro.add_argument(
+        '--global-cache-age',
+        metavar='time',
+        dest='__global_cache_age__',
+        help='''Files in global cache not used for this long, eg "30d", are removed after a run.'''
+    )
+    ro.add_argument(
+        '--profile',
+        nargs='?',
+        const='time',
+        choices=['time', 'cprofile'],
+        dest='__profile__',
+        help='''Record wall time and memory of each phase of DSC (parse, pipeline, translation, deploy,
+                   build, schedule, run, history) to ".dsc/<output>.profile.json".
+                   Use "--profile cprofile" to also save "cProfile" statistics of each phase to
+                   ".dsc/<output>.<phase>.prof", to be loaded by "pstats".'''
+    )
     ro.add_argument(
         '-v',
         '--verbosity',
@@ -335,26 +629,33 @@ def main():
     p.set_defaults(func=execute)
     if len(sys.argv) > 2 and '-h' in sys.argv:
         try:
-            from .dsc_parser import DSC_Script
-            script = DSC_Script(sys.argv[1])
+            from .dsc_parser import load_dsc_script
+            script = load_dsc_script(sys.argv[1], pipeline=False)[0]
             script.print_help(print_version='-v' in sys.argv)
             sys.exit(0)
         except Exception as e:
             if '--debug' in sys.argv:
                 raise
             else:
+                from sos.utils import env
                 env.logger.error(
                     f'No help information is available for script {sys.argv[1]}: ``{e}``'
                 )
                 sys.exit(1)
+    if any(x == '--status' or x.startswith('--status=') for x in sys.argv[1:]) and \
+       not (len(sys.argv) > 1 and os.path.isfile(sys.argv[1])):
+        # no DSC script is needed
+        sys.argv.insert(1, '')
     try:
         args, unknown_args = p.parse_known_args()
     except Exception as e:
+        from sos.utils import env
         env.logger.error(e)
         env.logger.info("Please type ``{} -h`` to view available options".\
                         format(os.path.basename(sys.argv[0])))
         sys.exit(1)
     #
+    from sos.utils import env, get_traceback
     env.verbosity = args.verbosity
     # keep `args.__recover__` to maintain backwards compatibility for `--touch` option.
     if args.__recover__:
@@ -362,6 +663,9 @@ def main():
             f'Option ``--touch`` is deprecated. Please use ``-s existing`` next time.'
         )
         args.__construct__ = 'existing'
+    from .utils import profiler
+    if args.__profile__:
+        profiler.enable(args.__profile__ == 'cprofile')
     with Timer(verbose=True if (args.verbosity > 0) else False) as t:
         try:
             args.func(args, unknown_args)
@@ -376,6 +680,8 @@ def main():
             t.disable()
             env.logger.error(e)
             sys.exit(1)
+        finally:
+            profiler.save()
 
 
 if __name__ == '__main__':
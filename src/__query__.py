@@ -5,13 +5,12 @@ __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
 
 import os, sys
-import pandas as pd
 from .utils import logger
 from .version import __version__
 
 
 def preview(fn, output, am):
-    if fn.endswith('.pkl') or fn.endswith('.rds'):
+    if fn.endswith('.pkl') or fn.endswith('.rds') or fn.endswith('.h5'):
         from .dsc_io import load_dsc
         data = load_dsc(fn)
         debug = data.pop('DSC_DEBUG')
@@ -42,7 +41,8 @@ def query(args):
     # from sos_notebook.converter import notebook_to_html
     from .query_jupyter import get_database_notebook, get_query_notebook
     from .query_engine import Query_Processor
-    from .utils import uniq_list
+    from .utils import uniq_list, profiler
+    from .syntax import DSC_CACHE
     am = AnswerMachine(always_yes=args.force)
     if os.path.isfile(args.dsc_output):
         if args.dsc_output.endswith('.db'):
@@ -54,6 +54,9 @@ def query(args):
     db = os.path.join(
         args.dsc_output,
         os.path.basename(os.path.normpath(args.dsc_output)) + '.db')
+    if profiler.enabled:
+        os.makedirs(DSC_CACHE, exist_ok=True)
+        profiler.prefix = f'{DSC_CACHE}/{os.path.basename(os.path.normpath(args.dsc_output))}.query'
     if args.target is None:
         if not args.output.endswith('.ipynb'):
             fnb = args.output + '.ipynb'
@@ -70,6 +73,7 @@ def query(args):
         qp = Query_Processor(db, args.target, args.condition, args.groups)
         for query in qp.get_queries():
             logger.debug(query)
+        profiler.start('query_output')
         # convert output database
         if args.rds is not None:
             fns = sum([
@@ -131,6 +135,7 @@ def query(args):
                 fcsv) and not am.get(f"Overwrite existing file \"{fcsv}\"?"):
             sys.exit("Aborted!")
         if fxlsx is not None:
+            import pandas as pd
             writer = pd.ExcelWriter(fxlsx)
             qp.output_table.to_excel(writer, 'Sheet1', index=False)
             if len(qp.output_tables) > 1:
@@ -247,6 +252,14 @@ def main():
                    action='store_true',
                    dest='force',
                    help='Force overwrite existing query result files')
+    p.add_argument(
+        '--profile',
+        nargs='?',
+        const='time',
+        choices=['time', 'cprofile'],
+        help='''Record wall time and memory of each step of the query to
+                   ".dsc/<DSC output>.query.profile.json". Use "--profile cprofile" to also save
+                   "cProfile" statistics of each step to ".dsc/<DSC output>.query.<step>.prof".''')
     p.add_argument(
         '-v',
         '--verbosity',
@@ -264,12 +277,17 @@ def main():
                         format(os.path.basename(sys.argv[0])))
         logger.error(e)
     #
+    from .utils import profiler
+    if args.profile:
+        profiler.enable(args.profile == 'cprofile')
     try:
         args.func(args)
     except Exception as e:
         if args.debug:
             raise
         logger.error(e)
+    finally:
+        profiler.save()
 
 
 if __name__ == '__main__':
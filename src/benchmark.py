@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Time DSC's own hot paths on synthetic benchmarks.
+
+Builds a synthetic DSC script, in the style of `vignettes/one_sample_location`,
+then times each stage DSC runs before, around and after module execution:
+parsing the script, configuring the IO database (`prepare_io`),
+`build_config_db`, `ResultDB.Build`, `Query_Processor` and
+`remove_obsolete_output`. Module instances are not run; their output files
+are written directly. Results are saved as JSON, and compared to those of a
+previous run if given.
+
+Usage: python -m dsc.benchmark [-h] [--stages N] [--modules N] [--params N]
+                               [--replicates N] [--repeat N] [-o results.json]
+                               [--compare previous.json]
+"""
+
+import os
+import sys
+import json
+import pickle
+import shutil
+import tempfile
+import time
+import platform
+from collections import OrderedDict
+from contextlib import redirect_stdout
+
+STAGES = ['parse', 'prepare_io', 'build_config_db', 'ResultDB.Build',
+          'Query_Processor', 'remove_obsolete_output']
+
+
+def make_script(n_stages=3, n_modules=3, n_params=3, n_replicates=2):
+    '''
+    A DSC script with `n_stages` stages of `n_modules` alternative modules.
+    Each module takes output of the previous stage and has a parameter of
+    `n_params` values. Pipelines are all combinations of modules across
+    stages, ie `n_modules ** n_stages` pipelines, run on `n_replicates`
+    replicates.
+    '''
+    lines = []
+    for i in range(1, n_stages + 1):
+        for j in range(1, n_modules + 1):
+            if i == 1:
+                lines.append(f's{i}_m{j}: Python(x = numpy.random.normal(p, 1, 10))')
+            else:
+                lines.extend([f's{i}_m{j}: Python(x = x + p)', '  x: $x'])
+            lines.append(f"  p: {', '.join([str(k) for k in range(n_params)])}")
+            lines.extend(['  $x: x', ''])
+    lines.extend(['DSC:', '  define:'])
+    for i in range(1, n_stages + 1):
+        lines.append(f"    stage{i}: {', '.join([f's{i}_m{j}' for j in range(1, n_modules + 1)])}")
+    lines.extend([f"  run: {' * '.join([f'stage{i}' for i in range(1, n_stages + 1)])}",
+                  f'  replicate: {n_replicates}', '  output: bench'])
+    return '\n'.join(lines) + '\n'
+
+
+def write_output(io_db):
+    '''Write output of all module instances in place of running them'''
+    from .dsc_database import get_module_output
+    res = 0
+    for module, files in get_module_output(io_db).items():
+        for fn in files:
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            pickle.dump({'x': float(res), 'DSC_DEBUG': {'time': 0, 'replicate': 0, 'seed': 0, 'script': ''}},
+                        open(fn, 'wb'))
+            res += 1
+    return res
+
+
+def run_once(text, jobs=2):
+    '''Time every stage on script `text`, in current directory'''
+    from sos.utils import env
+    from .dsc_parser import load_dsc_script
+    from .dsc_translator import DSC_Translator
+    from .dsc_database import build_config_db, ResultDB, remove_obsolete_output
+    from .dsc_io import load_io_db
+    from .query_engine import Query_Processor
+    from .syntax import DSC_CACHE
+    with open('bench.dsc', 'w') as f:
+        f.write(text)
+    res = OrderedDict()
+    tic = time.perf_counter()
+    script, pipelines = load_dsc_script('bench.dsc', cache=False)
+    res['parse'] = time.perf_counter() - tic
+    script.init_dsc(env)
+    script.to_html()
+    output = script.runtime.output
+    db = os.path.basename(output)
+    os.makedirs(output, exist_ok=True)
+    pipeline = DSC_Translator(pipelines, script.runtime, True, jobs, False, None, True)
+    pipeline.get_pipeline('prepare')
+    tic = time.perf_counter()
+    exec(compile(pipeline.conf_str_py, 'prepare_io', 'exec'), {'__name__': '__main__'})
+    res['prepare_io'] = time.perf_counter() - tic
+    tic = time.perf_counter()
+    build_config_db(f'{DSC_CACHE}/{db}.cfg.pkl', f'{output}/{db}.map.mpk',
+                    f'{DSC_CACHE}/{db}.io.pkl', vanilla=True, jobs=jobs)
+    res['build_config_db'] = time.perf_counter() - tic
+    tic = time.perf_counter()
+    ResultDB(f'{output}/{db}').Build(script=open(f'{output}.html').read(),
+                                     groups=script.runtime.groups,
+                                     depends=pipeline.get_dependency(),
+                                     pipelines=script.runtime.sequence)
+    res['ResultDB.Build'] = time.perf_counter() - tic
+    n_files = write_output(load_io_db(f'{DSC_CACHE}/{db}.io.pkl'))
+    groups = sorted(script.runtime.groups)
+    tic = time.perf_counter()
+    Query_Processor(f'{output}/{db}.db', [f'{groups[0]}.p', f'{groups[-1]}.x'],
+                    [f'{groups[-1]}.p > 0'])
+    res['Query_Processor'] = time.perf_counter() - tic
+    # files from a previous version of the benchmark, one tenth of output
+    for i in range(max(n_files // 10, 1)):
+        open(f'{output}/{groups[0]}_stale_{i}.pkl', 'w').close()
+    tic = time.perf_counter()
+    with open(os.devnull, 'w') as f, redirect_stdout(f):
+        remove_obsolete_output(output)
+    res['remove_obsolete_output'] = time.perf_counter() - tic
+    return res, {'pipelines': len(script.runtime.sequence), 'instances': n_files}
+
+
+def benchmark(n_stages=3, n_modules=3, n_params=3, n_replicates=2, repeat=3, jobs=2):
+    '''Best time of each stage out of `repeat` runs, each in a new directory'''
+    from sos.utils import env
+    text = make_script(n_stages, n_modules, n_params, n_replicates)
+    times = OrderedDict([(x, []) for x in STAGES])
+    cwd = os.getcwd()
+    verbosity = env.verbosity
+    env.verbosity = 0
+    try:
+        for i in range(repeat):
+            dirname = tempfile.mkdtemp()
+            os.chdir(dirname)
+            try:
+                res, sizes = run_once(text, jobs)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(dirname, ignore_errors=True)
+            for k, v in res.items():
+                times[k].append(v)
+    finally:
+        env.verbosity = verbosity
+    from .version import __version__
+    return OrderedDict([
+        ('dsc', __version__), ('python', platform.python_version()),
+        ('params', OrderedDict([('stages', n_stages), ('modules', n_modules), ('params', n_params),
+                                ('replicates', n_replicates), ('repeat', repeat), ('jobs', jobs)])),
+        ('sizes', sizes),
+        ('times', OrderedDict([(k, min(v)) for k, v in times.items()]))
+    ])
+
+
+def compare(res, previous):
+    '''Ratio of time of each stage to that of a previous run'''
+    if previous['params'] != res['params']:
+        sys.stderr.write('WARNING: benchmarks were run with different parameters\n')
+    return OrderedDict([(k, v / previous['times'][k]) for k, v in res['times'].items()
+                        if previous['times'].get(k)])
+
+
+def main():
+    from argparse import ArgumentParser
+    p = ArgumentParser(description='Time DSC hot paths on a synthetic benchmark.')
+    p.add_argument('--stages', type=int, default=3, help='Number of modules per pipeline.')
+    p.add_argument('--modules', type=int, default=3, help='Number of alternative modules per stage.')
+    p.add_argument('--params', type=int, default=3, help='Number of values of the parameter of each module.')
+    p.add_argument('--replicates', type=int, default=2, help='Number of replicates.')
+    p.add_argument('--repeat', type=int, default=3, help='Number of runs to take the best time from.')
+    p.add_argument('-c', type=int, default=2, dest='jobs', help='Number of processes.')
+    p.add_argument('-o', metavar='file', dest='output', help='Save results to JSON file.')
+    p.add_argument('--compare', metavar='file', help='JSON file of previous results to compare to.')
+    args = p.parse_args()
+    res = benchmark(args.stages, args.modules, args.params, args.replicates, args.repeat, args.jobs)
+    ratio = compare(res, json.load(open(args.compare))) if args.compare else dict()
+    print(f"{res['sizes']['pipelines']} pipelines, {res['sizes']['instances']} module instances")
+    for k, v in res['times'].items():
+        print(f'{k}: {v:.4f} seconds' + (f' ({ratio[k]:.2f}x previous)' if k in ratio else ''))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,13 +4,14 @@ __copyright__ = "Copyright 2016, Stephens lab"
 __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
 import os, msgpack, glob, pickle, copy, shutil
-import pandas as pd
 from collections import OrderedDict
 from .utils import uniq_list, flatten_list, chunks, remove_multiple_strings, extend_dict, \
-    remove_quotes, DBError
+    remove_quotes, DBError, LazyImport
 from .addict import Dict as dotdict
 from .syntax import DSC_CACHE
 
+pd = LazyImport('pandas')
+
 
 def remove_obsolete_output(output, additional_files=None, rerun=False):
     from sos.__main__ import cmd_remove
@@ -135,12 +136,330 @@ def remove_unwanted_output(workflows, groups, modules, db, zap=False):
         print("Nothing found to remove!")
 
 
-def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4):
+def get_runtime(debug):
+    '''Elapsed time in seconds from `DSC_DEBUG` of a module output'''
+    value = debug.get('time') if isinstance(debug, dict) else None
+    if isinstance(value, dict):
+        # R outputs keep `proc.time()` entries
+        value = value.get('elapsed')
+    if isinstance(value, (list, tuple)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def get_script_uuid(debug):
+    '''Step ID in the header of the script saved in `DSC_DEBUG`, if any'''
+    script = debug.get('script') if isinstance(debug, dict) else None
+    if isinstance(script, (list, tuple)):
+        script = '\n'.join(script)
+    if isinstance(script, str) and 'script UUID:' in script:
+        return script.split('\n', 1)[0].rsplit(':', 1)[-1].strip()
+    return None
+
+
+def get_module_output(io_db):
+    '''Output files of each module from IO database'''
+    res = OrderedDict()
+    for pipeline in io_db.values():
+        for module, item in pipeline.items():
+            if isinstance(item, tuple):
+                # step shared with another pipeline
+                continue
+            if module not in res:
+                res[module] = set()
+            res[module].update(item['output'])
+    return OrderedDict([(k, sorted(v)) for k, v in res.items()])
+
+
+def load_runtime_history(history_db):
+    try:
+        return pickle.load(open(history_db, 'rb'))
+    except Exception:
+        return dict()
+
+
+def get_module_runtime(history):
+    '''Runtime of module instances in history, as {module: [time]}'''
+    return dict([(k, [x[1] for x in v.values() if x[1] is not None])
+                 for k, v in history.items()])
+
+
+def get_module_memory(history):
+    '''Largest peak memory in bytes of module instances in history'''
+    res = dict()
+    for k, v in history.items():
+        memory = [x[3] for x in v.values() if x[3] is not None]
+        if len(memory):
+            res[k] = max(memory)
+    return res
+
+
+def update_runtime_history(history_db, outputs, n_samples=20):
+    '''
+    Runtime history is a dictionary of {module: {output file: (mtime, time, uuid, memory)}}
+    with `time`, step ID `uuid` and peak `memory` of module instances from their `DSC_DEBUG`.
+    Output files not yet in the history, or modified since, are read for at most
+    `n_samples` files per module, most recent first.
+    - outputs: output files of each module, see `get_module_output`
+    '''
+    from .dsc_io import load_dsc
+    history = load_runtime_history(history_db)
+    for module, files in outputs.items():
+        if module not in history:
+            history[module] = dict()
+        item = history[module]
+        for fn in [x for x in item if not os.path.isfile(x)]:
+            del item[fn]
+        updated = sorted([(os.path.getmtime(x), x) for x in files
+                          if os.path.isfile(x)],
+                         reverse=True)
+        updated = [
+            x for x in updated if x[1] not in item or item[x[1]][0] != x[0]
+        ]
+        for mtime, fn in updated[:n_samples]:
+            try:
+                debug = load_dsc(fn, variables=[])['DSC_DEBUG']
+            except Exception:
+                continue
+            memory = debug.get('peak_memory') if isinstance(debug, dict) else None
+            item[fn] = (mtime, get_runtime(debug), get_script_uuid(debug),
+                        None if memory is None else int(memory))
+    os.makedirs(os.path.dirname(history_db) or '.', exist_ok=True)
+    pickle.dump(history, open(history_db, 'wb'))
+    return history
+
+
+def get_step_inputs(item):
+    '''
+    Input files of each output file of a step in IO database. Inputs are in
+    groups of one file per module the step depends on, and outputs go through
+    these groups once per parameter combination, see `DSC_Translator`.
+    '''
+    n_depends = len(item['depends'])
+    if n_depends == 0 or len(item['input']) == 0:
+        return [[] for x in item['output']]
+    groups = [item['input'][i:i + n_depends] for i in range(0, len(item['input']), n_depends)]
+    if len(item['output']) % len(groups):
+        # should not happen; be conservative and depend on all input
+        return [item['input'] for x in item['output']]
+    return [groups[i % len(groups)] for i in range(len(item['output']))]
+
+
+def predict_runtime(history, outputs, module_ids, io_db=None):
+    '''
+    Predicted runtime of each output file: zero for up-to-date output, its own
+    runtime in history when available, otherwise mean runtime of the module,
+    or None for modules without history. Existing output are outdated if their
+    module has another step ID than `module_ids`, ie, they will be re-run.
+    With `io_db`, output of module instances taking input from outdated
+    output are outdated too.
+    '''
+    res = dict()
+    estimates = dict()
+    for module, files in outputs.items():
+        item = history.get(module, dict())
+        times = [x[1] for x in item.values() if x[1] is not None]
+        mean_time = sum(times) / len(times) if len(times) else None
+        outdated = any([
+            x[2] is not None and x[2] != str(module_ids.get(module))
+            for x in item.values()
+        ])
+        for fn in files:
+            if fn in item and item[fn][1] is not None:
+                estimates[fn] = item[fn][1]
+            else:
+                estimates[fn] = mean_time
+            if estimates[fn] == 0:
+                # zero is for up-to-date output
+                estimates[fn] = 1E-3
+            if not outdated and (os.path.isfile(fn)
+                                 or os.path.isfile(fn + '.zapped')):
+                res[fn] = 0
+            else:
+                res[fn] = estimates[fn]
+    if io_db is not None:
+        # steps are in topological order
+        for pipeline in io_db.values():
+            for module, item in pipeline.items():
+                if isinstance(item, tuple):
+                    continue
+                for fn, inputs in zip(item['output'], get_step_inputs(item)):
+                    if res.get(fn) == 0 and any([res.get(x, 0) != 0 for x in inputs]):
+                        res[fn] = estimates[fn]
+    return res
+
+
+def _file_signature(fn):
+    '''Modification time in nanoseconds and size of output file `fn`, or of its zapped version'''
+    for x in [fn, fn + '.zapped']:
+        try:
+            stat = os.stat(x)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            pass
+    return None
+
+
+def update_signature_index(index_db, outputs, module_ids):
+    '''
+    Signature index is a dictionary of {module: (uuid, {output file: (mtime, size)})}
+    with step ID `uuid` of modules, written after a complete run. The name of an
+    output file encodes parameters of its module instance and of modules upstream,
+    whose output are also in the index, so that with the step ID it is enough to
+    tell whether an output is up-to-date without checking its input.
+    - outputs: output files of each module, see `get_module_output`
+    '''
+    index = dict()
+    for module, files in outputs.items():
+        index[module] = (str(module_ids.get(module)),
+                         dict([(fn, _file_signature(fn)) for fn in files]))
+    os.makedirs(os.path.dirname(index_db) or '.', exist_ok=True)
+    pickle.dump(index, open(index_db, 'wb'))
+    return index
+
+
+def check_signature_index(index_db, outputs, module_ids):
+    '''
+    Whether all output files of all modules are up-to-date according to signature
+    index `index_db`: they have the same step ID, modification time and size as
+    when the index was written, see `update_signature_index`.
+    '''
+    try:
+        index = pickle.load(open(index_db, 'rb'))
+    except Exception:
+        return False
+    for module, files in outputs.items():
+        if module not in index or index[module][0] != str(module_ids.get(module)):
+            return False
+        item = index[module][1]
+        for fn in files:
+            signature = item.get(fn)
+            if signature is None or signature != _file_signature(fn):
+                return False
+    return True
+
+
+def plan_benchmark(io_db, module_ids, history_db):
+    '''
+    For each module, count instances to run and instances whose output from
+    previous runs are up-to-date, and estimate output size and runtime from
+    runtime history and existing output.
+    - io_db: IO database as written by `build_config_db`
+    - module_ids: step ID of modules, which is the UUID in the header of scripts
+    saved in `DSC_DEBUG`; output are outdated if the module has another ID
+    '''
+    outputs = get_module_output(io_db)
+    history = update_runtime_history(history_db, outputs)
+    runtime = predict_runtime(history, outputs, module_ids, io_db)
+    res = OrderedDict()
+    for module, files in outputs.items():
+        existing = [x for x in files if os.path.isfile(x)]
+        to_run = [x for x in files if runtime[x] != 0]
+        times = [x[1] for x in history[module].values() if x[1] is not None]
+        size = sum([os.path.getsize(x) for x in existing])
+        mean_size = size / len(existing) if len(existing) else None
+        res[module] = dotdict({
+            'instances': len(files),
+            'cached': len(files) - len(to_run),
+            'to_run': len(to_run),
+            'mean_time': sum(times) / len(times) if len(times) else None,
+            'time': None if any([runtime[x] is None for x in to_run]) else sum([runtime[x] for x in to_run]),
+            'size': size,
+            'new_size': None if mean_size is None else mean_size * (len(files) - len(existing))
+        })
+    return res
+
+
+def summarize_events(events, now=None, n_slowest=5):
+    '''
+    Summarize progress of a run from its execution log, see `dsc_io.log_event`:
+    state of the run, number of module instances to run, finished, linked from
+    the global cache, failed and running per module, throughput, estimated time to completion and the
+    slowest instances. Instances started but not finished are running, unless
+    the run is over in which case they have failed.
+    - events: events of the run as loaded by `dsc_io.load_events`
+    '''
+    import time, socket
+    if len(events) == 0 or events[0]['event'] != 'run_started':
+        return None
+    run = events[0]
+    end = [x for x in events if x['event'] == 'run_finished']
+    if now is None:
+        now = end[-1]['time'] if len(end) else time.time()
+    state = end[-1]['status'] if len(end) else 'running'
+    if state == 'running' and run['host'] == socket.gethostname():
+        try:
+            os.kill(run['pid'], 0)
+        except ProcessLookupError:
+            state = 'interrupted'
+        except PermissionError:
+            pass
+    instances = OrderedDict()
+    for item in events[1:]:
+        if 'output' not in item:
+            continue
+        if item['output'] not in instances:
+            instances[item['output']] = dotdict({'module': item['module'], 'host': item['host']})
+        instances[item['output']][item['event']] = item['time']
+        instances[item['output']].host = item['host']
+    modules = OrderedDict([(k, dotdict({'to_run': v, 'finished': 0, 'cached': 0, 'failed': 0, 'running': 0, 'queued': 0}))
+                           for k, v in run['to_run'].items()])
+    durations = []
+    for fn, item in instances.items():
+        if item.module not in modules:
+            modules[item.module] = dotdict({'to_run': 0, 'finished': 0, 'cached': 0, 'failed': 0, 'running': 0, 'queued': 0})
+        if 'cached' in item:
+            modules[item.module].cached += 1
+        elif 'failed' in item:
+            modules[item.module].failed += 1
+        elif 'finished' in item:
+            modules[item.module].finished += 1
+            if 'started' in item:
+                durations.append((item.finished - item.started, item.module, fn, item.host))
+        elif 'started' in item:
+            modules[item.module]['failed' if state != 'running' else 'running'] += 1
+        else:
+            modules[item.module].queued += 1
+    elapsed = now - run['time']
+    done = sum([x.finished + x.cached + x.failed for x in modules.values()])
+    remaining = max(sum([x.to_run for x in modules.values()]) - done, 0)
+    rate = done / elapsed if elapsed > 0 else 0
+    return dotdict({
+        'state': state,
+        'host': run['host'],
+        'started': run['time'],
+        'elapsed': elapsed,
+        'modules': modules,
+        'rate': rate,
+        'eta': None if state != 'running' or rate == 0 else remaining / rate,
+        'slowest': sorted(durations, reverse=True)[:n_slowest]
+    })
+
+
+def get_cache_key(name, module_ids, ext):
+    '''
+    Content key of a module instance for the global cache, from its name in
+    IO database which has parameters of the module and of its upstream
+    modules, eg 'median:98b37c9a:normal:a9f57519', and step IDs of these
+    modules, which change with their code. It is a SHA-1 digest, rather than
+    the shorter hash used for file names, as the cache is shared by benchmarks
+    '''
+    from hashlib import sha1
+    modules = name.split(':')[::2]
+    return sha1(':'.join([name, ext] + [str(module_ids.get(x)) for x in modules]).encode()).hexdigest()
+
+
+def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4, module_ids=None):
     '''
     - collect all output file names in md5 style
     - check if map file should be loaded, and load it
     - update map file: remove irrelevant entries; add new file name mapping (starting from max index)
     - create conf file based on map file and io file
+    - with step ID of modules `module_ids`, add content keys of output for
+    the global cache, see `get_cache_key`
     '''
     def get_names():
         '''Get map names.'''
@@ -253,6 +572,9 @@ def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4):
                                         for item in data[k]['__input_output___'][0]]
             conf[workflow_id][module]['output'] = [os.path.join(fid, map_data[item]) \
                                          for item in data[k]['__input_output___'][1]]
+            if module_ids is not None:
+                conf[workflow_id][module]['cache'] = [get_cache_key(item, module_ids, data[k]['__ext__']) \
+                                                      for item in data[k]['__input_output___'][1]]
             # eg. ['normal:a9f57519', 'median:98b37c9a:normal:a9f57519']
             depends_steps = uniq_list(
                 [x.split(':')[0] for x in data[k]['__input_output___'][0]])
@@ -192,7 +192,45 @@ def save_rds(data, filename):
     RO.r("saveRDS(res, '%s')" % filename)
 
 
-def load_dsc(infiles):
+def load_h5(infile, variables=None):
+    '''
+    Load DSC output from HDF5 file. When `variables` is given only these
+    entries (plus `DSC_DEBUG`) are read from disk. `variables` can be a list
+    of names, or a dict of {name: selection} where selection is applied to
+    array entries, eg `{'x': hdf5io.aslice[:10]}`.
+    '''
+    from .hdf5io import load as load_h5io, lazy_load
+
+    def as_native(data):
+        # scalars are stored as HDF5 attributes and loaded as numpy types;
+        # DSC_DEBUG entries such as seed have to be Python native
+        if isinstance(data, dict) and isinstance(data.get('DSC_DEBUG'), dict):
+            data['DSC_DEBUG'] = dict([
+                (k, v.item() if hasattr(v, 'item') and getattr(v, 'ndim', None) == 0 else v)
+                for k, v in data['DSC_DEBUG'].items()
+            ])
+        return data
+
+    if variables is None:
+        return as_native(load_h5io(infile))
+    if isinstance(variables, dict):
+        variables = dict(variables)
+    else:
+        variables = dict([(x, None) for x in variables])
+    variables.setdefault('DSC_DEBUG', None)
+    res = dict()
+    with lazy_load(infile, mmap=False) as data:
+        for k, sel in variables.items():
+            if k in data:
+                res[k] = data.load(k, sel)
+    return as_native(res)
+
+
+def load_dsc(infiles, variables=None):
+    '''
+    Load DSC output files. For `.h5` files, `variables` restricts what is
+    read from disk; other formats are always loaded in full.
+    '''
     import pickle, yaml
     if isinstance(infiles, str):
         infiles = [infiles]
@@ -204,6 +242,8 @@ def load_dsc(infiles):
             data = load_rds(infile)
         elif infile.endswith('.yml'):
             data = yaml.safe_load(open(infile).read())
+        elif infile.endswith('.h5'):
+            data = load_h5(infile, variables)
         else:
             raise ValueError(f'``{infile}`` is not supported DSC data format')
         try:
@@ -214,6 +254,115 @@ def load_dsc(infiles):
     return res
 
 
+DSC_OUTPUT_EXT = ['h5', 'pkl', 'rds', 'yml']
+
+# pseudo-variables of module instances, from `DSC_DEBUG` or else output file
+DSC_PROFILE = {
+    'DSC_TIME': 'time',
+    'DSC_CPU_TIME': 'cpu_time',
+    'DSC_PEAK_MEMORY': 'peak_memory',
+    'DSC_READ_BYTES': 'read_bytes',
+    'DSC_WRITE_BYTES': 'write_bytes',
+    'DSC_OUTPUT_SIZE': None
+}
+
+
+def _fetch_variable(args):
+    '''
+    Load one variable from one DSC output file, reading as little as the
+    format allows: only the variable for HDF5, the pickle alone (without
+    merging) for `.pkl`.
+    '''
+    import os, pickle
+    infile, variable = args
+    if not os.path.splitext(infile)[1].lstrip('.') in DSC_OUTPUT_EXT:
+        for ext in DSC_OUTPUT_EXT:
+            if os.path.isfile(f'{infile}.{ext}'):
+                infile = f'{infile}.{ext}'
+                break
+    if not os.path.isfile(infile):
+        raise ValueError(f'Cannot find DSC output file ``{infile}``')
+    if variable in DSC_PROFILE:
+        if DSC_PROFILE[variable] is None:
+            return os.path.getsize(infile)
+        debug = load_h5(infile, []) if infile.endswith('.h5') else load_dsc(infile)
+        value = debug.get('DSC_DEBUG', dict()).get(DSC_PROFILE[variable])
+        # R outputs keep `proc.time()` entries
+        return value['elapsed'] if isinstance(value, dict) and 'elapsed' in value else value
+    if infile.endswith('.h5'):
+        data = load_h5(infile, [variable])
+    elif infile.endswith('.pkl'):
+        data = pickle.load(open(infile, 'rb'))
+    else:
+        data = load_dsc(infile)
+    if not isinstance(data, dict) or variable not in data:
+        raise ValueError(
+            f'Cannot find variable ``{variable}`` in DSC output file ``{infile}``'
+        )
+    return data[variable]
+
+
+def _stack_values(values, index):
+    import numpy as np
+    import pandas as pd
+    if len(values) == 0:
+        return np.array([])
+    if all(isinstance(x, pd.DataFrame) for x in values):
+        return pd.concat(values, keys=index)
+    if all(isinstance(x, (dict, pd.Series)) for x in values):
+        return pd.DataFrame([dict(x) for x in values], index=index)
+    if all(isinstance(x, np.ndarray) for x in values) and \
+       len(set([x.shape for x in values])) == 1:
+        return np.stack(values)
+    if all(np.isscalar(x) for x in values):
+        return np.array(values)
+    res = np.empty(len(values), dtype=object)
+    res[:] = values
+    return res
+
+
+def fetch_dsc(infiles, variable, jobs=2, progress=True):
+    '''
+    Load variable `variable` from many DSC output files and stack them into
+    one object, in the order of `infiles`:
+    - scalars: 1D numpy array
+    - numpy arrays of the same shape: array stacked along a new first axis
+    - dict or pandas Series: data frame with one row per file
+    - pandas data frames: concatenated data frame keyed by file
+    - otherwise: 1D numpy array of objects
+
+    File names can be given without extension, eg as reported by `dsc-query`.
+    Files are loaded by `jobs` processes.
+    '''
+    from multiprocessing import Pool
+    from .utils import logger
+    if isinstance(infiles, str):
+        infiles = [infiles]
+    args = [(x, variable) for x in infiles]
+    values = []
+    if jobs > 1 and len(args) > 1:
+        pool = Pool(min(jobs, len(args)))
+        res = pool.imap(_fetch_variable,
+                        args,
+                        chunksize=max(1, min(100, len(args) // (jobs * 4))))
+    else:
+        pool = None
+        res = map(_fetch_variable, args)
+    try:
+        for i, x in enumerate(res):
+            values.append(x)
+            if progress and ((i + 1) % 100 == 0 or i + 1 == len(args)):
+                logger.info(f'Loaded ``{variable}`` from {i + 1}/{len(args)} files',
+                            flush=True)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if progress and len(args):
+        logger.info()
+    return _stack_values(values, list(infiles))
+
+
 def convert_dsc(pkl_files, jobs=2):
     import pickle
     from multiprocessing import Process
@@ -294,8 +443,235 @@ def load_io_db(fn, sequence_id=None, module=None):
     data = pickle.load(open(fn, 'rb'))
     return data[sequence_id][module] if sequence_id and module else data
 
+def load_conf_cache(fn):
+    '''Cached configuration of steps from previous run, if any'''
+    import pickle
+    try:
+        return pickle.load(open(fn, 'rb'))
+    except Exception:
+        return dict()
+
+def resource_usage():
+    '''
+    Resource usage of current process and its completed child processes:
+    CPU time in seconds, peak resident set size in bytes, and bytes read and
+    written where `/proc` is available (None otherwise)
+    '''
+    import sys, resource
+    usage = [resource.getrusage(x) for x in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    # in kilobytes except on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    res = dict([('cpu_time', sum([x.ru_utime + x.ru_stime for x in usage])),
+                ('peak_memory', max([x.ru_maxrss for x in usage]) * scale),
+                ('read_bytes', None), ('write_bytes', None)])
+    try:
+        io = dict([x.split(':') for x in open('/proc/self/io').read().strip().split('\n')])
+        res['read_bytes'] = int(io['rchar'])
+        res['write_bytes'] = int(io['wchar'])
+    except Exception:
+        pass
+    return res
+
+def acquire_memory(module, pid, interval=1):
+    '''
+    Wait until memory required by `module` fits in the budget of local jobs,
+    then hold it until process `pid` exits. Memory held is recorded as lease
+    files `<pid>_<bytes>` under a lock. A job is always admitted when no other
+    job holds memory. Settings are passed by DSC via environment variables:
+    - DSC_MEM_LIMIT: memory budget in bytes; nothing is done if not set
+    - DSC_MEM_REQUIRED: JSON of memory required in bytes of each module
+    - DSC_MEM_LEASES: directory of lease files
+    '''
+    import os, json, time, fcntl
+    if not os.environ.get('DSC_MEM_LIMIT'):
+        return
+    limit = int(os.environ['DSC_MEM_LIMIT'])
+    required = int(
+        json.loads(os.environ.get('DSC_MEM_REQUIRED', '{}')).get(module, 0))
+    leases = os.environ['DSC_MEM_LEASES']
+    os.makedirs(leases, exist_ok=True)
+    while True:
+        with open(os.path.join(leases, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            used = 0
+            for fn in os.listdir(leases):
+                if fn.startswith('.'):
+                    continue
+                owner, size = fn.split('_')
+                try:
+                    os.kill(int(owner), 0)
+                except ProcessLookupError:
+                    # job has completed
+                    os.remove(os.path.join(leases, fn))
+                    continue
+                except PermissionError:
+                    pass
+                used += int(size)
+            if used == 0 or used + required <= limit:
+                open(os.path.join(leases, f'{pid}_{required}'), 'w').close()
+                return
+        time.sleep(interval)
+
+def log_event(filename, event, **kwargs):
+    '''
+    Append an event, eg a module instance being queued, started, finished
+    or failed, as one line of JSON to execution log `filename`. Each line is
+    written at once in append mode so concurrent jobs do not mix their lines.
+    Logging is best effort: it never fails the module instance being logged.
+    '''
+    import os, json, time, socket
+    item = dict([('time', time.time()), ('event', event),
+                 ('host', socket.gethostname()), ('pid', os.getpid())] + list(kwargs.items()))
+    try:
+        # `filename` is an absolute path on the submitting host, which may not
+        # exist or be writable on remote hosts running the task
+        fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    except OSError:
+        return
+    try:
+        os.write(fd, (json.dumps(item) + '\n').encode())
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def load_events(filename):
+    '''
+    Events of the latest run in execution log `filename`, skipping lines
+    that are incomplete because they are being written
+    '''
+    import json
+    res = []
+    try:
+        lines = open(filename).readlines()
+    except FileNotFoundError:
+        return res
+    for line in lines:
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if item['event'] == 'run_started':
+            res = []
+        res.append(item)
+    return res
+
+def _cache_file(cache_dir, key, output):
+    import os
+    return os.path.join(cache_dir, key[:2], key + os.path.splitext(output)[1])
+
+def _link_file(source, target):
+    '''
+    Reflink `source` to `target` where the file system supports copy on
+    write (btrfs, xfs etc), otherwise hard link it, or copy it across devices
+    '''
+    import os, shutil
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            # FICLONE
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())
+        return
+    except FileNotFoundError:
+        raise
+    except Exception:
+        if os.path.isfile(target):
+            os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def detach_output(output):
+    '''
+    Remove output file of a module instance if it is hard linked, eg to the
+    global cache, so that the module writing it does not modify other links
+    '''
+    import os
+    if os.path.isfile(output) and os.stat(output).st_nlink > 1:
+        os.remove(output)
+
+def fetch_cache(cache_dir, key, output):
+    '''
+    Link output of a module instance with content key `key` from global
+    cache `cache_dir` to `output`, if it is in the cache. Returns True if it
+    is, in which case the module instance does not have to be run.
+    '''
+    import os
+    cached = _cache_file(cache_dir, key, output)
+    if not os.path.isfile(cached):
+        return False
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    tmp = f'{output}.{os.getpid()}.tmp'
+    try:
+        _link_file(cached, tmp)
+    except FileNotFoundError:
+        # evicted meanwhile
+        return False
+    os.replace(tmp, output)
+    # least recently used files are evicted first
+    os.utime(cached)
+    return True
+
+def get_module_cache_key(signature, params, seed, ext):
+    '''
+    Content key in global cache of an instance of a module marked as cached,
+    from signature `signature` of the module, its parameters `params` as
+    a list of (name, value) and its seed. Unlike keys of other modules (see
+    `dsc_database.get_cache_key`) it does not depend on other values of the
+    parameters, so instances are shared by benchmarks with the same seeds.
+    '''
+    from hashlib import sha1
+    return sha1(':'.join([signature, ext, str(seed)] + [f'{k}={v!r}' for k, v in params]).encode()).hexdigest()
+
+def store_cache(cache_dir, key, output):
+    '''Add output of a module instance with content key `key` to global cache `cache_dir`'''
+    import os
+    cached = _cache_file(cache_dir, key, output)
+    if os.path.isfile(cached) or not os.path.isfile(output):
+        return
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    tmp = f'{cached}.{os.getpid()}.tmp'
+    _link_file(output, tmp)
+    os.replace(tmp, cached)
+
+def evict_cache(cache_dir, limit=None, max_age=None):
+    '''
+    Remove files from global cache `cache_dir` not used for `max_age`
+    seconds, then least recently used files until its size is within `limit`
+    bytes
+    '''
+    import os, time
+    if not os.path.isdir(cache_dir):
+        return 0
+    files = []
+    for root, dirs, fns in os.walk(cache_dir):
+        for fn in fns:
+            fn = os.path.join(root, fn)
+            try:
+                stat = os.stat(fn)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, fn))
+    size = sum([x[1] for x in files])
+    now = time.time()
+    for mtime, fsize, fn in sorted(files):
+        if (max_age is None or now - mtime <= max_age) and (limit is None or size <= limit):
+            break
+        try:
+            os.remove(fn)
+            os.rmdir(os.path.dirname(fn))
+        except OSError:
+            # file already removed, or folder not empty
+            pass
+        size -= fsize
+    return size
+
 def main():
     import os, sys, pickle
+    if len(sys.argv) == 4 and sys.argv[1] == '--acquire-memory':
+        acquire_memory(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
     if len(sys.argv) < 3:
         sys.exit(0)
     # Input is pkl, output is rds
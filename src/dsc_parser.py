@@ -7,7 +7,7 @@ __license__ = "MIT"
 This file defines methods to load and preprocess DSC scripts
 '''
 
-import os, re, itertools, copy, glob, yaml, warnings, platform
+import os, re, itertools, copy, glob, yaml, warnings, platform, shutil, pickle
 from collections import OrderedDict, Counter
 try:
     from collections.abc import Mapping
@@ -22,14 +22,14 @@ from sos.targets import fileMD5, executable
 from .utils import FormatError, strip_dict, recursive_items, merge_lists, flatten_list, uniq_list, \
      try_get_value, dict2str, locate_file, filter_sublist, cartesian_list, \
      parens_aware_split, remove_parens, remove_quotes, rmd_to_r, update_gitconf, install_package_interactive, \
-     dsc2html
+     dsc2html, filter_mask, profiler
 from .syntax import *
 from .line import OperationParser, Str2List, EntryFormatter, parse_filter, parse_exe
 from .plugin import Plugin
 from .version import __version__
 from .parser import parse_dsc_string
 
-__all__ = ['DSC_Script', 'DSC_Pipeline', 'remote_config_parser']
+__all__ = ['DSC_Script', 'DSC_Pipeline', 'load_dsc_script', 'remote_config_parser']
 
 
 class DSC_Script:
@@ -44,7 +44,8 @@ class DSC_Script:
                  truncate=False,
                  replicate=None,
                  host=None,
-                 debug=False):
+                 debug=False,
+                 r_cache=True):
         self.content = dict()
         if os.path.isfile(content):
             script_name = os.path.split(os.path.splitext(content)[0])[-1]
@@ -52,7 +53,9 @@ class DSC_Script:
         else:
             script_name = 'DSCStringIO'
             script_path = None
-        self.transcript = self.load_dsc(content)
+        # files the parsed result depends on, for validating cached parses
+        self.source_files = [content] if os.path.isfile(content) else []
+        self.transcript = self.load_dsc(content, self.source_files)
         res = []
         exe = ''
         headline = False
@@ -102,7 +105,10 @@ class DSC_Script:
                 self.content['DSC'] = dict()
         self.get_global_params(global_params)
         global_vars = try_get_value(self.content, ('DSC', 'global'))
-        self.content = EntryFormatter()(self.content, global_vars)
+        formatter = EntryFormatter(r_cache)
+        self.content = formatter(self.content, global_vars)
+        # values of Python() and Shell() entries are not cached, see `load_dsc_script`
+        self.volatile = formatter.volatile
         derived, sorted_blocks = self.get_derived_blocks()
         for block in sorted_blocks:
             if block == 'DSC':
@@ -147,14 +153,9 @@ class DSC_Script:
                                          self.runtime.options, script_path,
                                          truncate))
                              for x in self.runtime.sequence_ordering.keys()])
-        script_types = [m.exe['type'] for m in self.modules.values()]
-        if 'R' in script_types and not debug:
-            install_package_interactive(
-                f'dscrutils@stephenslab/dsc/dscrutils>={__version__}',
-                'R_library')
-        if 'R' in script_types and 'PY' in script_types and not debug:
-            install_package_interactive('reticulate', 'R_library')
-            install_package_interactive('rpy2>=3.0.1', 'Python_Module')
+        self.source_files = uniq_list(self.source_files + flatten_list(
+            [m.source_files for m in self.modules.values()]))
+        self.check_requirements(debug)
         if not debug:
             self.runtime.rlib.extend(
                 flatten_list([x.rlib for x in self.modules.values() if x.rlib]))
@@ -167,8 +168,29 @@ class DSC_Script:
         # FIXME: maybe this should be allowed in the future
         self.runtime.check_looped_computation()
 
+    def check_requirements(self, debug=False):
+        '''
+        Check programs and packages required to run the modules. These checks
+        are repeated when the parsed script is loaded from cache, see
+        `load_dsc_script`.
+        '''
+        for module in self.modules.values():
+            module.check_requirements()
+        script_types = [m.exe['type'] for m in self.modules.values()]
+        if 'R' in script_types and not debug:
+            install_package_interactive(
+                f'dscrutils@stephenslab/dsc/dscrutils>={__version__}',
+                'R_library')
+        if 'R' in script_types and 'PY' in script_types and not debug:
+            install_package_interactive('reticulate', 'R_library')
+            install_package_interactive('rpy2>=3.0.1', 'Python_Module')
+
     @staticmethod
-    def load_dsc(fn):
+    def load_dsc(fn, included=None):
+        '''
+        Load script lines with `%include` expanded. Included files, and
+        glob patterns used to include files, are appended to `included`.
+        '''
         if os.path.isfile(fn):
             content = [x.rstrip() for x in open(fn).readlines() if x.strip()]
         else:
@@ -189,11 +211,18 @@ class DSC_Script:
                     raise FormatError(
                         f'Invalid %include statement ``{" ".join(line)}``. Should be ``%include filename.dsc``'
                     )
+                if '*' in line[1] and included is not None:
+                    included.append(line[1])
                 for f in glob.glob(line[1]) if '*' in line[1] else [line[1]]:
                     if not os.path.isfile(f) and os.path.isfile(f + '.dsc'):
-                        new_content.extend(DSC_Script.load_dsc(f + '.dsc'))
+                        if included is not None:
+                            included.append(f + '.dsc')
+                        new_content.extend(
+                            DSC_Script.load_dsc(f + '.dsc', included))
                     elif os.path.isfile(f):
-                        new_content.extend(DSC_Script.load_dsc(f))
+                        if included is not None:
+                            included.append(f)
+                        new_content.extend(DSC_Script.load_dsc(f, included))
                     else:
                         raise FormatError(
                             f'Cannot find file ``{f}`` to include.')
@@ -685,6 +714,15 @@ class DSC_Module:
         self.pymodule = None
         self.container = None
         self.container_engine = None
+        self.output_format = None
+        # memory required in bytes to run an instance of this module
+        self.memory = None
+        # whether output is shared with other benchmarks via global cache
+        self.cache = False
+        # compiled parameter filter
+        self.filter_conditions = None
+        # script and library files loaded by this module
+        self.source_files = []
         # dependencies
         self.depends = []
         # check if it runs in shell
@@ -695,6 +733,10 @@ class DSC_Module:
         self.set_input(try_get_value(content, 'input'),
                        try_get_value(content, ('meta', 'alias')))
         self.set_output(content['output'])
+        if self.cache and (len(self.rf) or len(self.rv) == 0):
+            raise FormatError(
+                f'Module ``{self.name}`` cannot be cached across benchmarks (``cache = true`` in @CONF) because it does not have output variables, or has ``$file`` output.'
+            )
         self.apply_input_operator()
         if lite:
             self.chop_input()
@@ -702,6 +744,36 @@ class DSC_Module:
         self.ft = self.apply_input_filter(
             try_get_value(content, ('meta', 'filter')))
 
+    def pipeline_copy(self):
+        '''
+        Copy of module to be configured for one pipeline. Only parameters,
+        dependencies and the script plugin are updated per pipeline so only
+        they are copied; the rest, eg executable contents, remain shared
+        with this module and should not be modified.
+        '''
+        res = copy.copy(self)
+        res.p = OrderedDict([(k, copy.copy(v)) for k, v in self.p.items()])
+        res.depends = list(self.depends)
+        res.plugin = copy.deepcopy(self.plugin)
+        return res
+
+    def check_requirements(self):
+        '''
+        Check programs and packages required to run this module, which may
+        change without changes to the DSC script
+        '''
+        if self.exe['type'] == 'R' and self.exe['interpreter'] is None \
+           and not executable('Rscript').target_exists():
+            raise ValueError(
+                f'Executable ``Rscript`` is required to run module ``"{self.name}"`` yet is not available from command-line console.'
+            )
+        if self.plugin.output_ext == 'h5':
+            from importlib.util import find_spec
+            if find_spec('tables') is None:
+                raise ValueError(
+                    f'Python package ``tables`` (PyTables) is required for ``output_format = h5`` of module ``{self.name}`` yet is not installed.'
+                )
+
     @staticmethod
     def pop_lib(vec, lib):
         '''
@@ -771,11 +843,14 @@ class DSC_Module:
                             f"Cannot find executable ``{item[0]}`` in DSC \"exec_path\" or system \"PATH\"."
                         )
                     self.exe['path'].append(item[0])
+                    if shutil.which(item[0]):
+                        self.source_files.append(shutil.which(item[0]))
                     if etype in ['PY', 'R']:
                         env.logger.warning(
                             f'Cannot find script ``{item[0]}`` in path ``{self.path}``. DSC will treat it a command line executable.'
                         )
                 else:
+                    self.source_files.append(fpath)
                     # try determine self.exe['type']
                     if etype == '':
                         etype = 'unknown'
@@ -806,12 +881,6 @@ class DSC_Module:
         if len(self.exe['path']) == 0 and len(self.exe['content']) == 0:
             raise FormatError(f"Contents in ``{self.exe['file']}`` is empty!")
         if self.exe['type'] == 'R':
-            # check if Rscript command exists
-            if self.exe['interpreter'] is None and not executable(
-                    'Rscript').target_exists():
-                raise ValueError(
-                    f'Executable ``Rscript`` is required to run module ``"{self.name}"`` yet is not available from command-line console.'
-                )
             # auto-import R libraries (but not Python!)
             self.exe['header'], self.exe['content'] = self.pop_lib(
                 self.exe['content'], DSC_RLIB)
@@ -826,19 +895,17 @@ class DSC_Module:
         ])
         # scan for library signatures
         if self.libpath_tracked is not None:
-            libs = [
-                glob.glob(
-                    os.path.join(os.path.expanduser(x),
-                                 f'*.{self.exe["type"]}'))
+            lib_patterns = [
+                os.path.join(os.path.expanduser(x), f'*.{self.exe["type"]}')
                 for x in self.libpath_tracked
-            ]
-            libs.extend([
-                glob.glob(
-                    os.path.join(os.path.expanduser(x),
-                                 f'*.{self.exe["type"].lower()}'))
+            ] + [
+                os.path.join(os.path.expanduser(x),
+                             f'*.{self.exe["type"].lower()}')
                 for x in self.libpath_tracked
-            ])
+            ]
+            libs = [glob.glob(x) for x in lib_patterns]
             lib_signature = ' '.join([fileMD5(x) for x in flatten_list(libs)])
+            self.source_files.extend(lib_patterns + flatten_list(libs))
         else:
             lib_signature = ''
         self.exe['signature'] = xxh(
@@ -849,6 +916,22 @@ class DSC_Module:
             (' '.join(self.exe['args']) if self.exe['args'] else '') +
             lib_signature).hexdigest()
         self.plugin = Plugin(self.exe['type'], self.exe['signature'])
+        self.set_output_format()
+
+    def set_output_format(self):
+        '''
+        Module output defaults to the native format of the plugin, ie `rds` for R
+        and `pkl` for Python. Python modules can alternatively write to HDF5
+        via `@CONF: output_format = h5` so downstream modules and queries can
+        load only the variables they need.
+        '''
+        if self.output_format is None or self.output_format == self.plugin.output_ext:
+            return
+        if self.output_format != 'h5' or self.plugin.name != 'python':
+            raise FormatError(
+                f"Output format ``{self.output_format}`` is not supported for module ``{self.name}``. Only Python modules can be set to ``output_format = h5``."
+            )
+        self.plugin.output_ext = self.output_format
 
     def set_output(self, return_var):
         '''
@@ -948,6 +1031,24 @@ class DSC_Module:
         self.container_engine = container_engine2[0] if container_engine2 is not None else container_engine1
         self.rlib = try_get_value(spec_option, 'R_libs', [])
         self.pymodule = try_get_value(spec_option, 'python_modules', [])
+        output_format = try_get_value(spec_option, 'output_format')
+        self.output_format = output_format[0] if output_format is not None else None
+        memory = try_get_value(spec_option, 'memory')
+        if memory is not None:
+            from sos.utils import expand_size
+            try:
+                self.memory = expand_size(str(memory[0]))
+            except Exception:
+                raise FormatError(
+                    f'Invalid memory size ``{memory[0]}`` in @CONF of module ``{self.name}``, eg "memory = 4G" is expected.'
+                )
+        cache = try_get_value(spec_option, 'cache')
+        if cache is not None:
+            if str(cache[0]).lower() not in ['true', 'false', 't', 'f']:
+                raise FormatError(
+                    f'Invalid value ``{cache[0]}`` for option ``cache`` in @CONF of module ``{self.name}``, eg "cache = true" is expected.'
+                )
+            self.cache = str(cache[0]).lower() in ['true', 't']
         if not self.container is None and (self.rlib or self.pymodule):
             raise FormatError(f'Options ``R_libs`` and ``python_modules`` cannot be used for module ``{self.name}`` when option ``container`` is specified.')
         self.libpath_tracked = libpath2
@@ -1027,6 +1128,19 @@ class DSC_Module:
                 f'Invalid @ALIAS for module ``{self.name}``:\n``{dict2str(alias)}``'
             )
 
+    @staticmethod
+    def compile_filter(ft):
+        '''
+        Compile @FILTER to OR-ed lists of AND-ed conditions
+        (negate, lhs, operator, rhs, rhs_is_parameter),
+        to be evaluated on parameter grid by `utils.filter_mask`
+        '''
+        ft = parse_filter(ft, dotted=False)[0]
+        variables = uniq_list(
+            flatten_list([[ii[1][1] for ii in i] for i in ft]))
+        return [[(ii[0] == 'not', ii[1][1], ii[2], ii[3], ii[3] in variables)
+                 for ii in i] for i in ft]
+
     @staticmethod
     def make_filter_statement(ft):
         ft = parse_filter(ft, dotted=False)[0]
@@ -1086,18 +1200,15 @@ class DSC_Module:
         # in case people use parentheses
         ft = flatten_list(ft)
         raw_rule = ft
+        self.filter_conditions = self.compile_filter(ft)
         ft = self.make_filter_statement(ft)
         # Verify it
-        statement = '\n'.join([f"{k} = {str(self.p[k])}" for k in self.p])
-        value_str = ','.join([f'_{x}' for x in self.p.keys()])
-        loop_str = ' '.join([f"for _{x} in {x}" for x in self.p])
-        statement += f'\nret = len([({value_str}) {loop_str} if {ft}])'
-        exec_env = dict()
         try:
-            exec(statement, exec_env)
+            ret = filter_mask(list(self.p.items()),
+                              self.filter_conditions).sum()
         except Exception:
             raise FormatError(f"Invalid @FILTER: ``{raw_rule}``!")
-        if exec_env['ret'] == 0:
+        if ret == 0:
             raise FormatError(
                 f"No parameter combination satisfies @FILTER ``{' AND '.join(raw_rule)}``!"
             )
@@ -1191,7 +1302,8 @@ class DSC_Module:
              dict([('exec_path', self.path), ('workdir', self.workdir),
                    ('library_path', self.libpath), 
                    ('container', self.container),
-                   ('container_engine', self.container_engine)]))
+                   ('container_engine', self.container_engine),
+                   ('memory', self.memory), ('cache', self.cache)]))
         ]),
                           mapping=dict,
                           skip_keys=['input'])
@@ -1271,8 +1383,18 @@ class DSC_Section:
         # remove slicing
         sequences = [[y.split('[')[0] for y in x] for x in input_sequences]
         values = sequences[0]
+        position = None
         for idx in range(len(sequences) - 1):
+            if position is None:
+                position = dict([(x, i) for i, x in enumerate(values)])
+            if len(position) == len(values) and all(
+                    x in position for x in sequences[idx + 1]) and all(
+                        position[x] < position[y] for x, y in zip(
+                            sequences[idx + 1], sequences[idx + 1][1:])):
+                # already in order of existing values: merging adds nothing
+                continue
             values = merge_lists(values, sequences[idx + 1])
+            position = None
         values = OrderedDict([(x, [-9]) for x in values])
         return values
 
@@ -1381,7 +1503,8 @@ class DSC_Pipeline:
         * output (output data prefix)
         Because different combinations of modules will lead to different
         I/O settings particularly with plugin status, here for each
-        sequence, fresh deep copies of modules will be made from input modules
+        sequence, fresh copies of module parameters, dependencies and plugins
+        are made from input modules (see `DSC_Module.pipeline_copy`)
 
         Every module in a pipeline is a plugin, whether it be Python, R or Shell.
         When output contain variables the default output file format and method to save variables are
@@ -1390,6 +1513,9 @@ class DSC_Pipeline:
         This class provides a member called `pipelines` which contains multiple pipelines
         '''
         self.pipelines = []
+        # modules configured for a pipeline depend only on modules before
+        # them, so pipelines with a common prefix share these module objects
+        self.shared_steps = dict()
         for sequence in script_data.runtime.sequence:
             self.add_pipeline(
                 sequence, script_data.modules,
@@ -1397,8 +1523,12 @@ class DSC_Pipeline:
 
     def add_pipeline(self, sequence, data, ordering):
         pipeline = OrderedDict()
-        for name in sequence:
-            module = copy.deepcopy(data[name])
+        for idx, name in enumerate(sequence):
+            prefix = tuple(sequence[:idx + 1])
+            if prefix in self.shared_steps:
+                pipeline[name] = self.shared_steps[prefix]
+                continue
+            module = data[name].pipeline_copy()
             file_dependencies = []
             for k, p in list(module.p.items()):
                 for p1_idx, p1 in enumerate(p):
@@ -1410,7 +1540,7 @@ class DSC_Pipeline:
                             if id_dependent[1] not in module.depends:
                                 module.depends.append(id_dependent[1])
                             if id_dependent[1][2] is None or id_dependent[1][
-                                    2].split('.')[-1] in ['rds', 'pkl', 'yml']:
+                                    2].split('.')[-1] in ['rds', 'pkl', 'yml', 'h5']:
                                 module.plugin.add_input(k, p1)
                             else:
                                 # FIXME: for multiple output should figure out the index of previous output
@@ -1423,11 +1553,16 @@ class DSC_Pipeline:
                 if len(module.p[k]) == 0:
                     del module.p[k]
             module.depends.sort(key=lambda x: ordering.index(x[0]))
+            if module.cache and module.depends:
+                raise FormatError(
+                    f'Module ``{module.name}`` cannot be cached across benchmarks (``cache = true`` in @CONF) because it takes input from module ``{module.depends[0][0]}``.'
+                )
             if len(file_dependencies):
                 module.plugin.add_input(
                     file_dependencies, '$[_input:r]'
                     if module.plugin.name == 'bash' else '${_input:r}')
             pipeline[module.name] = module
+            self.shared_steps[prefix] = module
         # FIXME: ensure this does not happen
         # Otherwise will have to bring this back
         # self.check_duplicate_step(pipeline)
@@ -1474,6 +1609,74 @@ class DSC_Pipeline:
         return res
 
 
+def source_signature(fn):
+    '''
+    Content signature of a file the parsed script depends on. For glob patterns
+    the signature is taken on the list of matching files.
+    '''
+    if '*' in fn:
+        return xxh(' '.join(sorted(glob.glob(fn)))).hexdigest()
+    if not os.path.isfile(fn):
+        return None
+    with open(fn, 'rb') as f:
+        return xxh(f.read()).hexdigest()
+
+
+def load_dsc_script(content, pipeline=True, cache=True, **kwargs):
+    '''
+    Parse DSC script into `DSC_Script` and `DSC_Pipeline` objects, reusing
+    the result of a previous parse saved in `DSC_CACHE` when the script,
+    included files, module sources and the command options are unchanged.
+    Returns the script object and a list of pipelines (`None` when
+    `pipeline=False` and the pipelines are not cached).
+    With `cache=False` the script is parsed again, and its `R()` expressions
+    evaluated again, to refresh the cache. Programs and packages required by
+    modules are checked again for cached scripts, see
+    `DSC_Script.check_requirements`; cached parses of the script with other
+    options are removed. Scripts with `Python()` or `Shell()` entries are
+    not cached since their values may depend on files or the environment.
+    '''
+    if not os.path.isfile(content):
+        script = DSC_Script(content, r_cache=cache, **kwargs)
+        return script, DSC_Pipeline(script).pipelines if pipeline else None
+    key = xxh(
+        repr((__version__, os.getcwd(), os.path.abspath(content),
+              sorted(kwargs.items())))).hexdigest()
+    name = os.path.split(os.path.splitext(content)[0])[-1]
+    cache_file = f'{DSC_CACHE}/{name}.{key}.script.pkl'
+    script = pipelines = None
+    if cache and os.path.isfile(cache_file):
+        try:
+            signatures, script, pipelines = pickle.load(
+                open(cache_file, 'rb'))
+            if any(source_signature(k) != v for k, v in signatures.items()):
+                script = pipelines = None
+        except Exception:
+            script = pipelines = None
+    if script is not None and (pipelines is not None or not pipeline):
+        env.logger.debug(f'Load parsed DSC script from ``{cache_file}``')
+        script.check_requirements(kwargs.get('debug', False))
+        return script, pipelines
+    if script is None:
+        script = DSC_Script(content, r_cache=cache, **kwargs)
+    if pipeline:
+        profiler.start('pipeline')
+        pipelines = DSC_Pipeline(script).pipelines
+    signatures = dict([(k, source_signature(k)) for k in script.source_files])
+    try:
+        os.makedirs(DSC_CACHE, exist_ok=True)
+        for fn in glob.glob(f'{DSC_CACHE}/{glob.escape(name)}.*.script.pkl'):
+            # the key is a hash, which does not contain '.'
+            if (fn != cache_file or script.volatile) and \
+               '.' not in fn[len(f'{DSC_CACHE}/{name}.'):-len('.script.pkl')]:
+                os.remove(fn)
+        if not script.volatile:
+            pickle.dump((signatures, script, pipelines), open(cache_file, 'wb'))
+    except Exception as e:
+        env.logger.debug(f'Failed to save parsed DSC script: {e}')
+    return script, pipelines
+
+
 def process_based_on(cfg, item):
     if 'based_on' in item:
         if not isinstance(item['based_on'],
@@ -1513,7 +1716,19 @@ def process_based_on(cfg, item):
         return item
 
 
-def remote_config_parser(host):
+def remote_config_parser(host, runtime=None, memory=None):
+    '''
+    Parse remote host configuration. `instances_per_job` and `time_per_instance`
+    can be set to `auto`, in which case they are sized from `runtime`, previously
+    measured runtime in seconds of module instances as a dict of {module: [time]},
+    to hit the target duration of a job `time_per_job`. `mem_per_instance` can
+    also be set to `auto` to size it from `memory`, largest peak memory in bytes
+    of module instances as a dict of {module: memory}.
+    '''
+    import math
+    from sos.utils import expand_time, format_HHMMSS
+    runtime = runtime or dict()
+    memory = memory or dict()
     conf = None
     for h in [host, f'{host}.yml', f'{host}.yaml']:
         if os.path.isfile(h):
@@ -1532,7 +1747,9 @@ def remote_config_parser(host):
     default = dict([('queue', list(conf['DSC'].keys())[0]),
                     ('instances_per_job', 2), ('nodes_per_job', 1),
                     ('instances_per_node', 1), ('cpus_per_instance', 1),
-                    ('mem_per_instance', '2G'), ('time_per_instance', '5m')])
+                    ('mem_per_instance', '2G'), ('time_per_instance', '5m'),
+                    ('time_per_job', '1h')])
+    fallback = copy.deepcopy(default)
 
     def check_valid_conf(key):
         for kk in conf[key]:
@@ -1545,6 +1762,14 @@ def remote_config_parser(host):
         check_valid_conf('default')
         default.update(conf['default'])
     conf['default'] = default
+    if 'auto' in (default['instances_per_job'], default['time_per_instance'],
+                  default['mem_per_instance']):
+        # modules following default configuration are sized on their own history
+        configured = [k.strip() for key in conf for k in key.split(',')]
+        for module in list(runtime) + list(memory):
+            if module not in configured:
+                conf[module] = dict()
+                configured.append(module)
     queues = set()
     local_queues = set()
     for key in list(conf.keys()):
@@ -1553,6 +1778,26 @@ def remote_config_parser(host):
         check_valid_conf(key)
         tmp = copy.deepcopy(default)
         tmp.update(conf[key])
+        times = flatten_list(
+            [runtime.get(k.strip(), []) for k in key.split(',')])
+        if tmp['time_per_instance'] == 'auto':
+            # allow for 50% more time than the slowest instance seen
+            tmp['time_per_instance'] = format_HHMMSS(
+                max(int(max(times) * 1.5), 60)
+            ) if times else fallback['time_per_instance']
+        if tmp['mem_per_instance'] == 'auto':
+            # allow for 50% more memory than the largest peak seen
+            peaks = [memory[k.strip()] for k in key.split(',') if k.strip() in memory]
+            tmp['mem_per_instance'] = f'{math.ceil(max(peaks) * 1.5 / 1E6)}M' \
+                if peaks else fallback['mem_per_instance']
+        workers = tmp['instances_per_node'] * tmp['nodes_per_job']
+        time_per_job = expand_time(tmp.pop('time_per_job'))
+        if tmp['instances_per_job'] == 'auto':
+            # SoS runs instances of a job in batches of `workers`, each batch
+            # taking at most `time_per_instance`
+            tmp['instances_per_job'] = max(
+                time_per_job // expand_time(tmp['time_per_instance']),
+                1) * workers
         tmp['walltime'] = tmp.pop('time_per_instance')
         tmp['mem'] = tmp.pop('mem_per_instance')
         tmp['cores'] = tmp.pop('cpus_per_instance')
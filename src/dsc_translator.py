@@ -16,7 +16,8 @@ from sos.targets import path
 from sos import execute_workflow
 from .utils import uniq_list, dict2str, n2a, install_package
 from .dsc_io import load_io_db
-from .syntax import DSC_CACHE
+from .version import __version__
+from .syntax import DSC_CACHE, DSC_GLOBAL_CACHE
 __all__ = ['DSC_Translator']
 
 class DSC_Translator:
@@ -32,37 +33,62 @@ class DSC_Translator:
                  n_cpu=4,
                  try_catch=False,
                  host_conf=None,
-                 debug=False):
+                 debug=False,
+                 cache=None):
         # FIXME: to be replaced by the R utils package
         self.output = runtime.output
         self.db = os.path.basename(runtime.output)
+        self.conf_cache = f'{DSC_CACHE}/{self.db}.cfg.cache.pkl'
         if host_conf is not None:
             for k in list(host_conf.keys()):
                 if k in runtime.groups:
                     for kk in runtime.groups[k]:
                         host_conf[kk] = host_conf[k]
                     del host_conf[k]
+        # modules marked as cached use global cache even if it is not set
+        module_cache = not rerun and any([step.cache for workflow in workflows for step in workflow.values()])
+        cache_all = cache is not None
+        if cache is None and module_cache:
+            cache = os.path.expanduser(DSC_GLOBAL_CACHE)
         conf_header = 'import os\nfrom dsc.dsc_database import build_config_db, ResultDB\n'
-        job_header = f"[global]\nimport os\n\nIO_DB = '{DSC_CACHE}/{self.db}.io.pkl'\n\n"\
+        job_header = f"[global]\nimport os\nfrom dsc.utils import sos_filter_product\nfrom dsc.dsc_io import log_event, detach_output\n"\
+                     + ("from dsc.dsc_io import fetch_cache, store_cache\n" if cache else '') + \
+                     ("from dsc.dsc_io import get_module_cache_key\n" if module_cache else '') + \
+                     f"\nIO_DB = '{DSC_CACHE}/{self.db}.io.pkl'\nEVENT_LOG = os.path.abspath('{DSC_CACHE}/{self.db}.events.jsonl')\n"\
+                     + (f"GLOBAL_CACHE = {repr(os.path.abspath(cache))}\n" if cache else '') + \
+                     "\n"\
                      f"{inspect.getsource(load_io_db)}"
         processed_steps = dict()
         self.depends = dict()
         conf_dict = dict()
+        # steps whose output a configured step depends on
+        conf_depends = dict()
+        # cache keys of configured steps, see `get_cached_conf`
+        conf_keys = dict()
         conf_str = []
         job_str = []
         module_signatures = dict()
+        # step ID of each module, as found in the header of its scripts
+        self.module_ids = dict()
+        # modules whose output are shared via global cache
+        self.cached_modules = set()
         # name map for steps, very important
         # to be used to expand IO_DB after load
         self.step_map = dict()
         self.exe_check = []
+        # modules whose core (job) step has been translated
+        processed_modules = set()
         # Get workflow steps
+        # Pipelines sharing a prefix share steps: a step is identified by
+        # its module, the modules before it (flow) and its dependencies, so
+        # steps are translated once per node of the DAG of pipelines
         for workflow_id, workflow in enumerate(workflows):
             self.step_map[workflow_id + 1] = dict()
-            keys = list(workflow.keys())
+            # names of modules before current step, joined by '_'
+            prefix = None
             for step in workflow.values():
-                flow = "_".join(
-                    ['_'.join(keys[:keys.index(step.name)]),
-                     step.name]).strip('_')
+                flow = f"{prefix or ''}_{step.name}".strip('_')
+                prefix = step.name if prefix is None else f'{prefix}_{step.name}'
                 depend = '_'.join(uniq_list([i[0] for i in step.depends]))
                 # beginning of pipeline := module that does not have any dependency
                 if len(step.depends) == 0:
@@ -72,15 +98,20 @@ class DSC_Translator:
                     name = (step.name, workflow_id + 1)
                     self.step_map[workflow_id + 1][step.name] = name
                     # Has the core been processed?
-                    if len([
-                            x for x in [k[0] for k in processed_steps.keys()]
-                            if x == step.name
-                    ]) == 0:
+                    if step.name not in processed_modules:
+                        processed_modules.add(step.name)
                         job_translator = self.Step_Translator(
-                            step, self.db, None, try_catch, host_conf, debug)
+                            step, self.db, None, try_catch, host_conf, debug,
+                            cache_all, module_cache)
+                        if job_translator.cache:
+                            self.cached_modules.add(step.name)
                         job_str.append(job_translator.dump())
                         module_signatures[
                             step.name] = job_translator.module_signature
+                        self.module_ids[step.name] = sum([
+                            abs(int(x, 16)) % (10**8)
+                            for x in module_signatures[step.name]
+                        ])
                         self.exe_check.extend(job_translator.exe_check)
                     processed_steps[(step.name, flow, depend)] = name
                     if step.name not in self.depends:
@@ -92,6 +123,10 @@ class DSC_Translator:
                         step, self.db, self.step_map[workflow_id + 1],
                         try_catch, None)
                     conf_dict[name] = conf_translator.dump()
+                    conf_depends[name] = [
+                        self.step_map[workflow_id + 1][x]
+                        for x in conf_translator.current_depends
+                    ]
                 else:
                     self.step_map[workflow_id +
                                   1][step.name] = processed_steps[(step.name,
@@ -106,22 +141,31 @@ class DSC_Translator:
         configured_steps = set()
         for workflow_id, sequence in enumerate(runtime.sequence):
             sqn = [self.step_map[workflow_id + 1][x] for x in sequence]
-            new_steps = [
-                conf_dict[x] for x in sqn if x not in configured_steps
-            ]
+            pipeline_header = f"__pipeline_id__ = {workflow_id + 1}\n"\
+                              f'''__pipeline_name__ = '{"+".join([n2a(x[1]).lower()+"_"+x[0] for x in sqn])}'\n'''
+            new_steps = []
+            for x in sqn:
+                if x in configured_steps:
+                    continue
+                conf_keys[x] = xxh(pipeline_header + conf_dict[x] + ''.join(
+                    [conf_keys[y] for y in conf_depends[x]])).hexdigest()
+                new_steps.append(
+                    self.get_cached_conf(x, conf_dict[x], conf_keys[x]))
             configured_steps.update(sqn)
             # Configuration
             if len(new_steps):
                 conf_str.append(f"###\n# [{n2a(workflow_id + 1)}]\n###\n" \
-                                f"__pipeline_id__ = {workflow_id + 1}\n"\
-                                f'''__pipeline_name__ = '{"+".join([n2a(x[1]).lower()+"_"+x[0] for x in sqn])}'\n''' \
+                                f"{pipeline_header}" \
                                 f"# output: '{DSC_CACHE}/{self.db}_{workflow_id + 1}.pkl'\n")
                 conf_str.extend(new_steps)
                 io_info_files.append(
                     f'{DSC_CACHE}/{self.db}_{workflow_id + 1}.pkl')
-            # Execution pool
+            # Execution pool, only for steps first defined in this pipeline
             ii = 1
             for y in sequence:
+                if self.step_map[workflow_id + 1][y] != (y, workflow_id + 1):
+                    ii += 1
+                    continue
                 tmp_str = [
                     f"\n[{n2a(workflow_id + 1).lower()}_{y} ({y} in pipeline #{workflow_id + 1})]\ndata_io = load_io_db(IO_DB, '{workflow_id + 1}', '{y}')"
                 ]
@@ -131,19 +175,26 @@ class DSC_Translator:
                 tmp_str.append(f"output: data_io['output']")
                 tmp_str.append(f"sos_run('{y}', {y}_output_files = data_io['output'], " + \
                                (f"{y}_input_files = data_io['input'], " if len(self.depends[y]) else "") + \
-                               f"DSC_STEP_ID_ = {sum([abs(int(x, 16)) % (10**8) for x in module_signatures[y]])})")
+                               (f"{y}_cache_keys = data_io['cache'], " if y in self.cached_modules else "") + \
+                               f"DSC_STEP_ID_ = {self.module_ids[y]})")
                 if ii == len(sequence):
                     self.last_steps.append((y, workflow_id + 1))
                 self.job_pool[(y, workflow_id + 1)] = tmp_str
                 ii += 1
         conf_str_py = 'import pickle\nfrom collections import OrderedDict\n' + \
-                      'from dsc.utils import sos_hash_output, sos_group_input, chunks as sos_chunks\n' + \
+                      'from dsc.utils import sos_hash_output, sos_group_input, sos_filter_product, chunks as sos_chunks\n' + \
+                      'from dsc.dsc_io import load_conf_cache\n' + \
                       '\n'.join([f'## {x}' for x in dict2str(self.step_map).split('\n')]) + \
                       '@profile #via "kernprof -l" and "python -m line_profiler"\ndef prepare_io():\n\t'+ \
                       f'\n\t__io_db__ = OrderedDict()\n\t' + \
+                      f'__cache__ = dict() if {rerun} else load_conf_cache({repr(self.conf_cache)})\n\t' + \
+                      '__new_cache__ = dict()\n\t' + \
                       '\n\t'.join('\n'.join(conf_str).split('\n')) + \
-                      f"\n\tpickle.dump(__io_db__, open('{DSC_CACHE}/{self.db}.cfg.pkl', 'wb'))\n\n" + \
+                      f"\n\tpickle.dump(__io_db__, open('{DSC_CACHE}/{self.db}.cfg.pkl', 'wb'))" + \
+                      f"\n\tpickle.dump(__new_cache__, open({repr(self.conf_cache)}, 'wb'))\n\n" + \
                       "if __name__ == '__main__':\n\tprepare_io()"
+        # kept to profile configuration outside of SoS, see `dsc.benchmark`
+        self.conf_str_py = conf_str_py
         self.job_str = job_header + "\n{}".format('\n'.join(job_str))
         self.conf_str_sos = conf_header + \
                             "\n[deploy_1 (Hashing output files)]" + \
@@ -157,7 +208,7 @@ class DSC_Translator:
                             f"output: '{self.output}/{self.db}.map.mpk', "\
                             f"'{DSC_CACHE}/{self.db}.io.pkl'"\
                             "\nbuild_config_db(str(_input[0]), str(_output[0]), "\
-                            f"str(_output[1]), vanilla = vanilla, jobs = {n_cpu})\n"\
+                            f"str(_output[1]), vanilla = vanilla, jobs = {n_cpu}, module_ids = {self.module_ids})\n"\
                             f"if os.path.isfile('{self.output}/{self.db}.db'): os.remove('{self.output}/{self.db}.db')\n"\
                             "\n[build (Build meta-database)]\n"\
                             f"depends: '{DSC_CACHE}/{self.db}.cfg.pkl', '{self.output}/{self.db}.map.mpk'\n"\
@@ -171,6 +222,19 @@ class DSC_Translator:
                           "Python_Module")
             self.pull_images(runtime.container)
 
+    @staticmethod
+    def get_cached_conf(name, conf, key):
+        '''
+        Configure a step only when its code or any of its upstream steps
+        changed since last run; otherwise reuse its output and IO entries
+        from the previous run, keyed by `key`
+        '''
+        output = f'__{n2a(name[1]).lower()}_{name[0]}_output__'
+        io = f"__io_db__[('{name[0]}', __pipeline_id__)]"
+        conf = '\n'.join(['\t' + x for x in conf.strip().split('\n')])
+        return f"if '{key}' in __cache__:\n\t{output}, {io} = __cache__['{key}']\n"\
+               f"else:\n{conf}\n__new_cache__['{key}'] = ({output}, {io})\n"
+
     def get_pipeline(self, task, save=False):
         if task == 'prepare':
             res = self.conf_str_sos
@@ -184,27 +248,58 @@ class DSC_Translator:
                 f.write(res)
         return res
 
-    def filter_execution(self, debug=False):
-        '''Filter steps removing the ones having common input and output'''
+    def filter_execution(self, debug=False, runtime=None):
+        '''
+        Filter steps removing the ones having common input and output.
+        With `runtime`, predicted runtime of output files, steps on the longest
+        chains of remaining work are put first, to be dispatched first.
+        '''
         io_db = load_io_db(f'{DSC_CACHE}/{self.db}.io.pkl')
-        included_steps = []
-        for x in self.job_pool:
-            if self.step_map[x[1]][x[0]] == x:
-                if self.job_pool[x][1] == 'DEPENDS_STR':
-                    depends_str = [
-                        f"sos_step('{n2a(s[1]).lower()}_{s[0]}')"
-                        for s in io_db[str(x[1])][x[0]]['depends']
-                    ]
-                    self.job_pool[x][1] = f'depends: {", ".join(depends_str)}'
-                self.job_str += "\n" + "\n".join(self.job_pool[x])
-                included_steps.append(x)
+        included_steps = [
+            x for x in self.job_pool if self.step_map[x[1]][x[0]] == x
+        ]
+        critical_path = self.get_critical_path(
+            io_db, included_steps, runtime) if runtime is not None else None
+        for x in included_steps:
+            if self.job_pool[x][1] == 'DEPENDS_STR':
+                depends = io_db[str(x[1])][x[0]]['depends']
+                if critical_path is not None:
+                    depends = sorted(depends,
+                                     key=lambda s: -critical_path[s])
+                depends_str = [
+                    f"sos_step('{n2a(s[1]).lower()}_{s[0]}')"
+                    for s in depends
+                ]
+                self.job_pool[x][1] = f'depends: {", ".join(depends_str)}'
+            self.job_str += "\n" + "\n".join(self.job_pool[x])
         #
         self.last_steps = [x for x in self.last_steps if x in included_steps]
+        if critical_path is not None:
+            self.last_steps.sort(key=lambda x: -critical_path[x])
         self.job_str += "\n\n[{}]\ndata_io = load_io_db(IO_DB)\ndepends: {}\noutput: {}".\
                         format('default' if debug else 'DSC (output validation)',
                                ', '.join([f"sos_step('{n2a(x[1]).lower()}_{x[0]}')" for x in self.last_steps]),
                                ', '.join([f"data_io['{x[1]}']['{x[0]}']['output']" for x in self.last_steps]))
 
+    @staticmethod
+    def get_critical_path(io_db, steps, runtime):
+        '''
+        Predicted runtime of the longest chain of steps ending at each step.
+        Output without runtime prediction take the average predicted runtime.
+        '''
+        known = [x for x in runtime.values() if x]
+        default = sum(known) / len(known) if len(known) else 1
+        res = dict()
+        # steps are in topological order
+        for x in steps:
+            cost = sum([
+                default if runtime.get(y) is None else runtime[y]
+                for y in io_db[str(x[1])][x[0]]['output']
+            ])
+            res[x] = cost + max(
+                [res.get(s, 0) for s in io_db[str(x[1])][x[0]]['depends']] or [0])
+        return res
+
     def install_libs(self, libs, lib_type):
         if lib_type not in ["R_library", "Python_Module"]:
             raise ValueError("Invalid library type ``{}``.".format(lib_type))
@@ -262,7 +357,9 @@ class DSC_Translator:
                      step_map,
                      try_catch,
                      host_conf=None,
-                     debug=False):
+                     debug=False,
+                     cache=False,
+                     module_cache=False):
             '''
             prepare step:
              - will produce source to build config and database for
@@ -285,6 +382,13 @@ class DSC_Translator:
             self.db = db
             self.conf = host_conf
             self.debug = debug
+            # output of modules with `$file` output are not cached, as only
+            # the meta-file of their output is tracked
+            self.cache = cache and not self.prepare and len(step.rf) == 0 \
+                and len(step.rv) > 0 and not step.cache
+            # modules marked as cached compute cache keys from their own
+            # parameters and seed, see `get_module_cache_key`
+            self.module_cache = module_cache and not self.prepare and step.cache
             self.input_vars = None
             self.header = ''
             self.loop_string = ['', '']
@@ -302,6 +406,12 @@ class DSC_Translator:
             self.get_step_option()
             self.get_action()
 
+        @property
+        def cache_key(self):
+            if self.module_cache:
+                return f'{self.step.name}_cache_key'
+            return f'{self.step.name}_cache_keys[_index]'
+
         def get_header(self):
             if self.prepare:
                 self.header = f"## Codes for {self.step.name}\n"
@@ -309,6 +419,8 @@ class DSC_Translator:
             else:
                 self.header = f"\n[{self.step.name} (module {self.step.name})]\n"
                 self.header += f"parameter: DSC_STEP_ID_ = None\nparameter: {self.step.name}_output_files = list"
+                if self.cache:
+                    self.header += f"\nparameter: {self.step.name}_cache_keys = list"
 
         def get_parameters(self):
             # Set params, make sure each time the ordering is the same
@@ -319,8 +431,14 @@ class DSC_Translator:
             if self.params:
                 self.loop_string[0] = ' '.join(
                     [f'for _{s} in {s}' for s in reversed(self.params)])
-            if self.step.ft:
-                self.filter_string = ' if ' + self.step.ft
+            if self.step.filter_conditions:
+                # parameter combinations surviving @FILTER are computed at once on the grid
+                self.filter_string = 'sos_filter_product([{}], {})'.\
+                                     format(', '.join([f"('{x}', {x})" for x in self.params]),
+                                            repr(self.step.filter_conditions))
+                self.loop_string[0] = 'for {} in {}'.format(
+                    ', '.join([f'_{s}' for s in self.params]),
+                    self.filter_string)
 
         def get_input(self):
             if self.prepare:
@@ -351,9 +469,8 @@ class DSC_Translator:
                     self.input_string += "input:"
                 if len(self.params):
                     if self.filter_string:
-                        self.input_option.append("for_each = {{'{0}':[({0}) {1}{2}]}}".\
+                        self.input_option.append("for_each = {{'{0}': {1}}}".\
                                                  format(','.join([f'_{x}' for x in self.params]),
-                                                        ' '.join([f'for _{s} in {s}' for s in reversed(self.params)]),
                                                         self.filter_string))
                     else:
                         self.input_option.append(
@@ -371,7 +488,7 @@ class DSC_Translator:
                                                       + self.step.exe['file'] + [f'{k}:{xxh(str(self.step.rv[k])).hexdigest()}' for k in sorted(self.step.rv)] \
                                                       + [f'{k}:{self.step.rf[k]}' for k in sorted(self.step.rf)] \
                                                       + [f'{x}:{{}}' for x in reversed(self.params)]),
-                                             format_string, self.loop_string[0] + self.filter_string, output_lhs)
+                                             format_string, self.loop_string[0], output_lhs)
                 if len(self.current_depends):
                     self.output_string += "\n{0} = ['{1}:{{}}:{{}}'.format(item, {3}) " \
                                           "for item in {0} {2}]".format(output_lhs, self.step.name, self.loop_string[1],
@@ -383,10 +500,24 @@ class DSC_Translator:
                 self.output_string += f"output: {self.step.name}_output_files[_index]"
 
         def get_step_option(self):
+            if self.module_cache:
+                signature = f"{__version__}:{self.step.exe['signature']}:" + \
+                    ':'.join([f'{k}:{xxh(str(self.step.rv[k])).hexdigest()}' for k in sorted(self.step.rv)])
+                ext = self.step.plugin.output_ext if len(self.step.exe['path']) == 0 else 'yml'
+                self.step_option += f"{self.step.name}_cache_key = get_module_cache_key({repr(signature)}, " \
+                                    f"[{', '.join([f'({x!r}, _{x})' for x in self.params])}], " \
+                                    f"{self.step.plugin.get_seed(self.step.seed)}, '{ext}')\n"
+            if self.cache or self.module_cache:
+                # link output computed before, by any benchmark, in place of running
+                self.step_option += f"if fetch_cache(GLOBAL_CACHE, {self.cache_key}, str(_output)):\n" \
+                                    f"    log_event(EVENT_LOG, 'cached', module = '{self.step.name}', output = str(_output))\n" \
+                                    "    done_if(True)\n"
             if not self.prepare:
                 if self.conf is None or (self.step.name in self.conf and self.conf[self.step.name]['queue'] is None) \
                    or (self.step.name not in self.conf and self.conf['default']['queue'] is None):
                     return
+                # submitted to a queue
+                self.step_option += f"log_event(EVENT_LOG, 'queued', module = '{self.step.name}', output = str(_output))\n"
                 self.step_option += f"task: {', '.join([str(k) + ' = ' + (repr(v) if isinstance(v, str) and k != 'trunk_workers' else str(v)) for k, v in self.conf[self.step.name if self.step.name in self.conf else 'default'].items()])}, tags = f'{self.step.name}_{{_output:bn}}'"
                 self.step_option += '\n' if path(self.step.workdir).absolute(
                 ) == path.cwd() else f', workdir = {repr(self.step.workdir)}\n'
@@ -396,7 +527,7 @@ class DSC_Translator:
                 combined_params = '[([{0}], {1}) {2}]'.\
                                   format(', '.join([f"('{x}', _{x})" for x in reversed(self.params)]),
                                          None if self.loop_string[1] == '' else ("f\"{' '.join(__i__)}\"" if len(self.current_depends) > 1 else "f'{__i__}'"),
-                                         ' '.join(self.loop_string) + self.filter_string)
+                                         ' '.join(self.loop_string))
                 input_str = '[]' if self.input_vars is None else '{0} if {0} is not None else []'.format(
                     self.input_vars)
                 output_str = f"__{n2a(int(self.step_map[self.step.name][1])).lower()}_{self.step.name}_output__"
@@ -412,6 +543,8 @@ class DSC_Translator:
                 # FIXME: have not considered multi-action module (or compound module) yet
                 # Create fake loop for now with idx going around
                 signature = []
+                self.action += f"log_event(EVENT_LOG, 'started', module = '{self.step.name}', output = str(_output))\n"
+                self.action += "detach_output(str(_output))\n"
                 for idx, (plugin, cmd) in enumerate(
                         zip([self.step.plugin], [self.step.exe])):
                     sigil = '$[ ]' if plugin.name == 'bash' else '${ }'
@@ -433,7 +566,9 @@ class DSC_Translator:
                         if self.debug:
                             script = plugin.get_return(None)
                         else:
-                            script_begin = plugin.load_env(
+                            script_begin = plugin.get_memory_lease(
+                                self.step.name)
+                            script_begin += '\n' + plugin.load_env(
                                 self.step.depends, idx > 0
                                 and len(self.step.rv))
                             script_begin += '\n' + plugin.get_input(
@@ -463,6 +598,10 @@ class DSC_Translator:
                         self.exe_check.append(
                             f"executable({repr(cmd['path'])})")
                         self.action += f"\t{cmd['path']} {'$*' if cmd['args'] else ''}\n"
+                # not reached if the module fails, see `summarize_events`
+                self.action += f"\nlog_event(EVENT_LOG, 'finished', module = '{self.step.name}', output = str(_output))\n"
+                if self.cache or self.module_cache:
+                    self.action += f"store_cache(GLOBAL_CACHE, {self.cache_key}, str(_output))\n"
                 self.module_signature.extend(signature)
 
 
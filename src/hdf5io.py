@@ -27,13 +27,25 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import numpy as np
 import tables
 from scipy import sparse
 import pandas as pd
 from types import SimpleNamespace
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from .utils import logger
 
+# Aliases kept compatible across numpy / pandas releases
+_NP_UNICODE = getattr(np, 'unicode_', np.str_)
+_NP_STRING = getattr(np, 'string_', np.bytes_)
+_PD_TYPES = tuple(
+    x for x in (pd.DataFrame, pd.Series, getattr(pd, 'Panel', None))
+    if x is not None)
+
 IO_PREFIX = 'DSC_'
 IO_UNPACK = 'DSC_IO_UNPACK'
 IO_ROOT_IS_SNS = 'DSC_ROOT_IS_SNS'
@@ -43,6 +55,13 @@ ATTR_TYPES = (int, float, bool, str, bytes, np.int8, np.int16, np.int32,
               np.int64, np.uint8, np.uint16, np.uint32, np.uint64, np.float16,
               np.float32, np.float64, np.bool_, np.complex64, np.complex128)
 
+# Strings longer than this are not saved as pytables attribute
+MAX_ATTR_LENGTH = 16384
+
+# Default compression level, and target size in bytes of an array chunk
+COMPRESSION_LEVEL = 5
+CHUNK_BYTES = 1 << 20
+
 
 class SliceClass(object):
     def __getitem__(self, index):
@@ -54,6 +73,8 @@ aslice = SliceClass()
 
 class _HDFStoreWithHandle(pd.io.pytables.HDFStore):
     def __init__(self, handle):
+        # make sure pandas has registered its pytables module
+        pd.io.pytables._tables()
         self._path = None
         self._complevel = None
         self._complib = None
@@ -103,7 +124,7 @@ def _dict_native_ok(d):
     return True
 
 
-def _get_compression_filters(compression='blosc'):
+def _get_compression_filters(compression='blosc', level=None):
     if compression is True:
         compression = 'zlib'
 
@@ -113,8 +134,8 @@ def _get_compression_filters(compression='blosc'):
     else:
         if isinstance(compression, (tuple, list)):
             compression, level = compression
-        else:
-            level = 9
+        elif level is None:
+            level = COMPRESSION_LEVEL
 
         try:
             ff = tables.Filters(complevel=level,
@@ -128,18 +149,38 @@ def _get_compression_filters(compression='blosc'):
     return ff
 
 
+def _get_chunkshape(shape, itemsize, chunk_bytes=CHUNK_BYTES):
+    """
+    Chunks span complete trailing dimensions when possible, so that slicing
+    along the first axis (the access pattern of `load` with `sel`) touches as
+    few chunks as possible. The leading dimension is then sized to have
+    chunks of about `chunk_bytes`.
+    """
+    chunk = list(shape)
+    nbytes = itemsize * int(np.prod(shape[1:]))
+    # a single row is too large: split trailing dimensions from the left
+    for i in range(1, len(chunk)):
+        if nbytes <= chunk_bytes:
+            break
+        rest = nbytes // chunk[i]
+        chunk[i] = max(1, min(chunk[i], chunk_bytes // max(rest, 1)))
+        nbytes = rest * chunk[i]
+    chunk[0] = max(1, min(shape[0], chunk_bytes // max(nbytes, 1)))
+    return tuple(int(x) for x in chunk)
+
+
 def _save_ndarray(handler, group, name, x, filters=None):
-    if np.issubdtype(x.dtype, np.unicode_):
+    if np.issubdtype(x.dtype, _NP_UNICODE):
         # Convert unicode strings to pure byte arrays
         strtype = b'unicode'
         itemsize = x.itemsize // 4
         atom = tables.UInt8Atom()
         x = x.view(dtype=np.uint8)
-    elif np.issubdtype(x.dtype, np.string_):
+    elif np.issubdtype(x.dtype, _NP_STRING):
         strtype = b'ascii'
         itemsize = x.itemsize
         atom = tables.StringAtom(itemsize)
-    elif x.dtype == np.object:
+    elif x.dtype == object:
         # Not supported by HDF5, force pickling
         _save_pickled(handler, group, x, name=name)
         return
@@ -171,7 +212,8 @@ def _save_ndarray(handler, group, name, x, filters=None):
                                      name,
                                      atom=atom,
                                      shape=x.shape,
-                                     chunkshape=None,
+                                     chunkshape=_get_chunkshape(
+                                         x.shape, atom.size),
                                      filters=filters)
     else:
         node = handler.create_array(group, name, atom=atom, shape=x.shape)
@@ -186,6 +228,80 @@ def _save_pickled(handler, group, level, name=None):
     node.append(level)
 
 
+def _stack_sequence(level):
+    """
+    Try to stack a long homogeneous sequence for native storage. Returns a
+    tuple ``(kind, data)`` or ``(None, None)`` if entries have to be pickled:
+
+    * ``'scalar'``: Python numbers or strings of the same type, as 1D array
+    * ``'npscalar'``: Numpy scalars of the same type, as 1D array
+    * ``'array'``: numeric arrays of same shape and dtype, stacked
+    * ``'ragged'``: 1D numeric arrays of same dtype but different lengths
+
+    Arrays of 0 dimension are pickled, as they would load as numpy scalars.
+    """
+    first = level[0]
+    if isinstance(first, np.ndarray):
+        if first.ndim == 0 or first.dtype.kind not in 'biufc' or not all(
+                isinstance(x, np.ndarray) and x.dtype == first.dtype
+                for x in level):
+            return None, None
+        if all(x.shape == first.shape for x in level):
+            return 'array', np.stack(level)
+        if all(x.ndim == 1 for x in level):
+            return 'ragged', level
+        return None, None
+    cls = type(first)
+    if cls not in (bool, int, float, complex, str) and not isinstance(
+            first, (np.number, np.bool_)):
+        return None, None
+    if not all(type(x) is cls for x in level):
+        return None, None
+    if cls is str and any(x.endswith('\x00') for x in level):
+        # numpy strips trailing null characters
+        return None, None
+    data = np.asarray(level)
+    if data.dtype.kind not in 'biufcU' or data.ndim != 1:
+        # eg integers too large for int64
+        return None, None
+    return ('scalar' if cls in (bool, int, float, complex, str) else
+            'npscalar'), data
+
+
+def _save_sequence(handler, group, name, level, filters=None):
+    """
+    Save long lists and tuples natively as a single (VL)array if possible.
+    Returns False if the sequence has to be saved otherwise.
+    """
+    kind, data = _stack_sequence(level)
+    if kind is None:
+        return False
+    if kind == 'ragged':
+        node = handler.create_vlarray(group,
+                                      name,
+                                      tables.Atom.from_dtype(data[0].dtype),
+                                      filters=filters)
+        for x in data:
+            node.append(x)
+    else:
+        _save_ndarray(handler, group, name, data, filters=filters)
+        node = getattr(group, name)
+    node._v_attrs.seqtype = type(level).__name__.encode('ascii')
+    node._v_attrs.seqkind = kind.encode('ascii')
+    return True
+
+
+def _load_sequence(level, data):
+    seqkind = level._v_attrs.seqkind
+    if seqkind == b'scalar':
+        data = data.tolist()
+    else:
+        data = list(data)
+    if level._v_attrs.seqtype == b'tuple':
+        data = tuple(data)
+    return data
+
+
 def _is_linkable(level):
     if isinstance(level, ATTR_TYPES):
         return False
@@ -220,6 +336,10 @@ def _save_level(handler, group, level, name=None, filters=None, idtable=None):
     elif isinstance(level, ForcePickle):
         _save_pickled(handler, group, level, name=name)
 
+    elif isinstance(level, (list, tuple)) and len(level) >= 256 and \
+            _save_sequence(handler, group, name, level, filters=filters):
+        pass
+
     elif isinstance(level, dict) and _dict_native_ok(level):
         # First create a new group
         new_group = handler.create_group(group, name,
@@ -279,10 +399,28 @@ def _save_level(handler, group, level, name=None, filters=None, idtable=None):
                         filters=filters,
                         idtable=idtable)
 
+    elif isinstance(level, dict) and len(level) >= 256:
+        # Large dictionaries are saved as an indexed table of keys and
+        # values, each a long sequence stored natively when possible
+        new_group = handler.create_group(group, name,
+                                         "dicttable:{}".format(len(level)))
+        _save_level(handler,
+                    new_group,
+                    list(level.keys()),
+                    name='keys',
+                    filters=filters,
+                    idtable=idtable)
+        _save_level(handler,
+                    new_group,
+                    list(level.values()),
+                    name='values',
+                    filters=filters,
+                    idtable=idtable)
+
     elif isinstance(level, np.ndarray):
         _save_ndarray(handler, group, name, level, filters=filters)
 
-    elif isinstance(level, (pd.DataFrame, pd.Series, pd.Panel)):
+    elif isinstance(level, _PD_TYPES):
         store = _HDFStoreWithHandle(handler)
         store.put(group._v_pathname + '/' + name, level)
 
@@ -334,6 +472,11 @@ def _save_level(handler, group, level, name=None, filters=None, idtable=None):
         new_group._v_attrs.format = level.format
         new_group._v_attrs.maxprint = level.maxprint
 
+    elif isinstance(level, (str, bytes)) and len(level) > MAX_ATTR_LENGTH:
+        # HDF5 attributes are limited to 64KB; store long text (eg scripts
+        # in DSC_DEBUG) as pickled nodes instead
+        _save_pickled(handler, group, level, name=name)
+
     elif isinstance(level, ATTR_TYPES):
         setattr(group._v_attrs, name, level)
 
@@ -361,10 +504,7 @@ def _load_specific_level(handler, grp, path, sel=None, pathtable=None):
         elif hasattr(grp, '_v_attrs') and vv[0] in grp._v_attrs:
             if sel is not None:
                 raise ValueError("Cannot slice this type")
-            v = grp._v_attrs[vv[0]]
-            if isinstance(v, np.string_):
-                v = v.decode('utf-8')
-            return v
+            return _load_attr(grp, vv[0])
         else:
             raise ValueError('Undefined entry "{}"'.format(vv[0]))
     else:
@@ -386,6 +526,13 @@ def _load_specific_level(handler, grp, path, sel=None, pathtable=None):
                 raise ValueError('Undefined group "{}"'.format(level))
 
 
+def _load_attr(grp, name):
+    v = grp._v_attrs[name]
+    if isinstance(v, _NP_STRING):
+        v = v.decode('utf-8')
+    return v
+
+
 def _load_pickled(level):
     if isinstance(level[0], ForcePickle):
         return level[0].obj
@@ -397,6 +544,16 @@ def _load_nonlink_level(handler, level, pathtable, pathname):
     """
     Loads level and builds appropriate type, without handling softlinks
     """
+    if isinstance(level, tables.Group) and level._v_title.startswith(
+            'dicttable:'):
+        val = dict()
+        pathtable[pathname] = val
+        keys = _load_level(handler, level._f_get_child('keys'), pathtable)
+        values = _load_level(handler, level._f_get_child('values'),
+                             pathtable)
+        val.update(zip(keys, values))
+        return val
+
     if isinstance(level, tables.Group):
         if level._v_title.startswith(
                 'SimpleNamespace:') or IO_ROOT_IS_SNS in level._v_attrs:
@@ -480,6 +637,12 @@ def _load_nonlink_level(handler, level, pathtable, pathname):
         else:
             return val
 
+    elif 'seqkind' in level._v_attrs:
+        # long list or tuple stacked as a single array
+        return _load_sequence(level,
+                              level[:] if isinstance(level, tables.VLArray)
+                              else _load_ndarray(level))
+
     elif isinstance(level, tables.VLArray):
         if level.shape == (1, ):
             return _load_pickled(level)
@@ -487,27 +650,31 @@ def _load_nonlink_level(handler, level, pathtable, pathname):
             return level[:]
 
     elif isinstance(level, tables.Array):
-        if 'zeroarray_dtype' in level._v_attrs:
-            # Unpack zero-size arrays (shape is stored in an HDF5 array and
-            # type is stored in the attibute 'zeroarray_dtype')
-            dtype = level._v_attrs.zeroarray_dtype
-            sh = level[:]
-            return np.zeros(tuple(sh), dtype=dtype)
-
-        if 'strtype' in level._v_attrs:
-            strtype = level._v_attrs.strtype
-            itemsize = level._v_attrs.itemsize
-            if strtype == b'unicode':
-                return level[:].view(dtype=(np.unicode_, itemsize))
-            elif strtype == b'ascii':
-                return level[:].view(dtype=(np.string_, itemsize))
-        # This serves two purposes:
-        # (1) unpack big integers: the only time we save arrays like this
-        # (2) unpack non-deepdish "scalars"
-        if level.shape == ():
-            return level[()]
-
-        return level[:]
+        return _load_ndarray(level)
+
+
+def _load_ndarray(level):
+    if 'zeroarray_dtype' in level._v_attrs:
+        # Unpack zero-size arrays (shape is stored in an HDF5 array and
+        # type is stored in the attibute 'zeroarray_dtype')
+        dtype = level._v_attrs.zeroarray_dtype
+        sh = level[:]
+        return np.zeros(tuple(sh), dtype=dtype)
+
+    if 'strtype' in level._v_attrs:
+        strtype = level._v_attrs.strtype
+        itemsize = level._v_attrs.itemsize
+        if strtype == b'unicode':
+            return level[:].view(dtype=(_NP_UNICODE, itemsize))
+        elif strtype == b'ascii':
+            return level[:].view(dtype=(_NP_STRING, itemsize))
+    # This serves two purposes:
+    # (1) unpack big integers: the only time we save arrays like this
+    # (2) unpack non-deepdish "scalars"
+    if level.shape == ():
+        return level[()]
+
+    return level[:]
 
 
 def _load_level(handler, level, pathtable):
@@ -549,7 +716,7 @@ def _load_sliced_level(handler, level, sel):
         raise ValueError('Cannot partially load this data type using `sel`')
 
 
-def save(data, path, compression='blosc'):
+def save(data, path, compression='blosc', nthreads=None, level=None):
     """
     Save any Python structure to an HDF5 file. It is particularly suited for
     Numpy arrays. This function works similar to ``numpy.save``, except if you
@@ -563,6 +730,8 @@ def save(data, path, compression='blosc'):
 
     * Dictionaries
     * Short lists and tuples (<256 in length)
+    * Long lists and tuples of numbers, strings or numeric arrays of the
+      same type
     * Basic data types (including strings and None)
     * Numpy arrays
     * Scipy sparse matrices
@@ -574,10 +743,14 @@ def save(data, path, compression='blosc'):
     reader.
 
     Lists and tuples are supported and can contain heterogeneous types. This is
-    mostly useful and plays well with HDF5 for short lists and tuples. If you
-    have a long list (>256) it will be serialized automatically. However,
-    in such cases it is common for the elements to have the same type, in which
-    case we strongly recommend converting to a Numpy array first.
+    mostly useful and plays well with HDF5 for short lists and tuples. A long
+    list (>=256) is stored as a single array when its elements have the same
+    type: numbers and strings are saved as 1D array, numeric arrays of the
+    same shape are stacked along a new first axis (so they can be sliced with
+    `sel`), and 1D numeric arrays of different lengths are saved as a
+    variable length array. Other long lists are serialized automatically.
+    Large dictionaries (>=256 entries) are saved as a table of keys and
+    values following the same rules.
 
     This function requires the `PyTables <http://www.pytables.org/>`_ module to
     be installed.
@@ -599,16 +772,27 @@ def save(data, path, compression='blosc'):
         tuple (e.g. ``('blosc', 5)``), with the latter value specifying the
         level of compression, choosing from 0 (no compression) to 9 (maximum
         compression).  Set to `None` to turn off compression. The default is
-        `zlib`, since it is highly portable; for much greater speed, try for
-        instance `blosc`.
+        `blosc` at level `COMPRESSION_LEVEL`; for portability with other HDF5
+        readers try for instance `zlib`.
+    nthreads : int
+        Number of threads used by `blosc` compression. Default to the number
+        of CPU cores available.
+    level : int
+        Level of compression, from 0 (no compression) to 9 (maximum
+        compression). Default to `COMPRESSION_LEVEL`, unless given along
+        with the compression method in `compression`.
 
     See also
     --------
     load
     """
-    filters = _get_compression_filters(compression)
+    filters = _get_compression_filters(compression, level)
+    if nthreads is None:
+        nthreads = len(os.sched_getaffinity(0)) if hasattr(
+            os, 'sched_getaffinity') else os.cpu_count()
 
-    with tables.open_file(path, mode='w') as h5file:
+    with tables.open_file(path, mode='w',
+                          max_blosc_threads=max(1, nthreads or 1)) as h5file:
         # If the data is a dictionary, put it flatly in the root
         group = h5file.root
         idtable = dict()  # dict to keep track of objects already saved
@@ -725,3 +909,215 @@ def load(path, group=None, sel=None, unpack=False):
                 data = next(iter(data.values()))
 
     return data
+
+
+def _is_lazy_group(level):
+    """
+    Plain dictionary (or SimpleNamespace) groups can be browsed lazily; other
+    groups encode a single object (list, sparse matrix, data frame ...).
+    """
+    return isinstance(level, tables.Group) and not (
+        level._v_title.startswith(
+            ('list:', 'tuple:', 'nonetype:', 'sparse:', 'dicttable:'))
+        or is_pandas_dataframe(level))
+
+
+def _is_lazy_array(level):
+    """
+    Numeric arrays that can be sliced on disk, as opposed to arrays encoding
+    strings, empty arrays or stacked sequences.
+    """
+    return isinstance(level, tables.Array) and not isinstance(
+        level, tables.VLArray) and level.shape != () and level.atom.kind in (
+            'int', 'uint', 'float', 'complex', 'bool') and not any(
+                x in level._v_attrs
+                for x in ('zeroarray_dtype', 'strtype', 'seqkind'))
+
+
+class LazyArray(object):
+    """
+    Numeric array in an HDF5 file saved with `save`. Only the selection is
+    read from disk when it is sliced, eg ``x[:10]``; ``x[:]`` reads it all.
+    """
+    def __init__(self, lazy_file, node):
+        self._file = lazy_file
+        self._node = node
+
+    @property
+    def shape(self):
+        return self._node.shape
+
+    @property
+    def dtype(self):
+        return self._node.atom.dtype
+
+    @property
+    def ndim(self):
+        return len(self._node.shape)
+
+    def __len__(self):
+        return self._node.shape[0]
+
+    def __getitem__(self, sel):
+        return _load_sliced_level(self._file.handler, self._node, sel)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.load(), dtype=dtype)
+
+    def load(self):
+        return _load_level(self._file.handler, self._node,
+                           self._file.pathtable)
+
+    def __repr__(self):
+        return '<LazyArray {} of shape {} and type {}>'.format(
+            self._node._v_pathname, self.shape, self.dtype)
+
+
+class LazyGroup(Mapping):
+    """
+    Read-only dict-like view of a group in an HDF5 file saved with `save`.
+
+    Sub-groups of plain dictionaries are returned as `LazyGroup` and numeric
+    arrays as `LazyArray`, which are read from disk only as far as they are
+    sliced. Uncompressed and contiguous numeric arrays are memory-mapped
+    instead, if `mmap` is set. Every other entry is loaded when it is
+    accessed. Entries are valid as long as the underlying `LazyFile` is
+    open, except memory-mapped arrays that keep their own handle.
+    """
+    def __init__(self, lazy_file, group):
+        self._file = lazy_file
+        self._group = group
+
+    def _keys(self):
+        attrs = [
+            x for x in self._group._v_attrs._f_list()
+            if not x.startswith(IO_PREFIX)
+        ]
+        return list(self._group._v_children.keys()) + attrs
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __contains__(self, key):
+        return key in self._group._v_children or (
+            key in self._group._v_attrs and not key.startswith(IO_PREFIX))
+
+    def __getitem__(self, key):
+        if key in self._group._v_children:
+            node = self._group._v_children[key]
+            if isinstance(node, tables.link.SoftLink):
+                node = node()
+            if _is_lazy_group(node):
+                return LazyGroup(self._file, node)
+            if self._file.mmap:
+                res = self._file._memmap(node)
+                if res is not None:
+                    return res
+            if _is_lazy_array(node):
+                return LazyArray(self._file, node)
+            return _load_level(self._file.handler, node, self._file.pathtable)
+        if key in self:
+            return _load_attr(self._group, key)
+        raise KeyError(key)
+
+    def load(self, key=None, sel=None):
+        """
+        Fully load an entry, or the entire group if `key` is None. When `sel`
+        is given the entry has to be an array, and only the selection is
+        read.
+        """
+        if key is None:
+            return _load_level(self._file.handler, self._group,
+                               self._file.pathtable)
+        if sel is not None:
+            return _load_specific_level(self._file.handler,
+                                        self._group,
+                                        key,
+                                        sel=sel,
+                                        pathtable=self._file.pathtable)
+        res = self[key]
+        return res.load() if isinstance(res, (LazyGroup, LazyArray)) else res
+
+    def __repr__(self):
+        return '<LazyGroup {} with keys {}>'.format(self._group._v_pathname,
+                                                    self._keys())
+
+
+class LazyFile(LazyGroup):
+    """
+    Lazy view of the root group of an HDF5 file, see `lazy_load`.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        self.handler = tables.open_file(path, mode='r')
+        self.pathtable = dict()
+        self._h5py = None
+        super().__init__(self, self.handler.root)
+
+    def _memmap(self, node):
+        if not (type(node) is tables.Array and node.chunkshape is None
+                and node.filters.complevel == 0 and node.size_in_memory > 0
+                and node.atom.kind in ('int', 'uint', 'float', 'complex',
+                                       'bool')
+                and 'zeroarray_dtype' not in node._v_attrs
+                and 'strtype' not in node._v_attrs
+                and 'seqkind' not in node._v_attrs):
+            return None
+        if self._h5py is None:
+            import h5py
+            self._h5py = h5py.File(self.path, 'r')
+        offset = self._h5py[node._v_pathname].id.get_offset()
+        if offset is None:
+            return None
+        dtype = np.dtype(node.atom.dtype).newbyteorder(
+            '<' if node.byteorder == 'little' else '>')
+        return np.memmap(self.path,
+                         dtype=dtype,
+                         mode='r',
+                         offset=offset,
+                         shape=node.shape)
+
+    def close(self):
+        if self._h5py is not None:
+            self._h5py.close()
+            self._h5py = None
+        self.handler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def lazy_load(path, mmap=True):
+    """
+    Open an HDF5 saved with `save` for lazy access. Nothing is read until an
+    entry is accessed, which makes browsing large files cheap::
+
+        with hdf5io.lazy_load('output.h5') as data:
+            x = data['x'][:10]
+
+    Parameters
+    ----------
+    path : string
+        Filename from which to load the data.
+    mmap : bool
+        Memory-map uncompressed contiguous arrays rather than reading them.
+        These arrays are read-only.
+
+    Returns
+    -------
+    data : LazyFile
+        Dict-like object that can be used as context manager, or otherwise
+        has to be closed with `close()`.
+
+    See also
+    --------
+    load
+    """
+    return LazyFile(path, mmap=mmap)
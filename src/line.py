@@ -17,6 +17,17 @@ try:
 except ImportError:
     from collections import Mapping
 
+R_EVAL_SCRIPT = '''
+if (!requireNamespace("dscrutils", quietly = TRUE)) quit(status = 1)
+for (f in commandArgs(trailingOnly = TRUE)) {
+  x <- paste(readLines(f, warn = FALSE), collapse = "\\n")
+  tryCatch(cat(dscrutils::dscreval(x, envir = new.env()),
+               file = paste0(f, ".out")),
+           error = function (e) cat(conditionMessage(e),
+                                    file = paste0(f, ".err")))
+}
+'''
+
 
 class YLine:
     '''
@@ -141,7 +152,7 @@ class ExpandActions(YLine):
       * file(), temp(), raw()
     because they'll have to be dynamically determined
     '''
-    def __init__(self):
+    def __init__(self, r_values=None):
         YLine.__init__(self)
         self.method = {
             'R': self.__R,
@@ -150,36 +161,44 @@ class ExpandActions(YLine):
             'each': self.__ForEach,
             'pairs': self.__Pairs
         }
+        # pre-evaluated R expressions: code -> output
+        self.r_values = r_values if r_values is not None else dict()
+        # whether Python() or Shell() is evaluated, whose values may
+        # depend on files, environment variables or time
+        self.volatile = False
+
+    @staticmethod
+    def locate(value, name):
+        '''
+        Find action entries eg `R(...)` or `R{...}` in value,
+        returning their contents including the enclosing parentheses
+        '''
+        res = []
+        p_end = 0
+        for p in [m.end() - 1 for m in re.finditer(f'{name}(\(|\{{)', value)]:
+            if p < p_end:
+                # Run into nested pattern, no problem: eg R(some_function_R())
+                continue
+            start, end = ('(', ')') if value[p] == '(' else ('{', '}')
+            try:
+                p_end = p + find_parens(value[p:], start=start, end=end)[0]
+            except IndexError:
+                raise FormatError(
+                    f"Invalid parentheses pattern in ``{value}``")
+            res.append(value[p:p_end + 1])
+        return res
 
     def __call__(self, value):
         if isinstance(value, str):
             for name in list(self.method.keys()):
-                pos = [
-                    m.end() - 1 for m in re.finditer(f'{name}(\(|\{{)', value)
-                ]
-                p_end = 0
                 replacements = []
-                for p in pos:
-                    if value[p] == '(':
-                        shatter = False
-                        start = '('
-                        end = ')'
-                    else:
-                        shatter = True
-                        start = '{'
-                        end = '}'
-                    if p < p_end:
-                        # Run into nested pattern, no problem: eg R(some_function_R())
-                        continue
-                    try:
-                        p_end = find_parens(value[p:], start=start, end=end)[0]
-                    except IndexError:
-                        raise FormatError(
-                            f"Invalid parentheses pattern in ``{value}``")
+                for item in self.locate(value, name):
+                    if name in ['Python', 'Shell']:
+                        self.volatile = True
+                    shatter = item.startswith('{')
                     replacements.append(
-                        (f'{name}{value[p:p_end+p+1]}',
-                         ('(' if not shatter else '') +
-                         self.method[name](value[p:p_end + p + 1]) +
+                        (f'{name}{item}', ('(' if not shatter else '') +
+                         self.method[name](item) +
                          (')' if not shatter else '')))
                 for r in replacements:
                     value = value.replace(r[0], r[1], 1)
@@ -199,26 +218,11 @@ class ExpandActions(YLine):
         value = [x if isinstance(x, (list, tuple)) else [x] for x in value]
         return pairwise_list(*value)
 
-    @staticmethod
-    def __R(code):
-        try:
-            output = get_output(
-                f"R --slave -e \"cat(dscrutils::dscreval({repr(code[1:-1])}))\""
-            ).strip()
-        except Exception:
-            from .utils import install_package_interactive
-            from .version import __version__
-            install_package_interactive(
-                f'dscrutils@stephenslab/dsc/dscrutils>={__version__}',
-                'R_library')
-            try:
-                output = get_output(
-                    f"R --slave -e \"cat(dscrutils::dscreval({repr(code[1:-1])}))\""
-                ).strip()
-            except Exception:
-                raise ValueError(
-                    f"Failed to evaluate R expression ``{code[1:-1]}``")
-        return output
+    def __R(self, code):
+        code = code[1:-1]
+        if code not in self.r_values:
+            self.r_values.update(eval_R([code]))
+        return self.r_values[code]
 
     @staticmethod
     def __Python(code):
@@ -251,6 +255,73 @@ class ExpandActions(YLine):
             flatten_list([x.split() for x in out.strip().split("\n")]))
 
 
+def eval_R(codes, cache=True):
+    '''
+    Evaluate R expressions with `dscrutils::dscreval` in one R session.
+    Results are cached in DSC_CACHE by R version and expression text;
+    use `cache=False` to evaluate again and refresh cached values, eg for
+    expressions that depend on external files.
+    '''
+    import os, pickle, shlex, tempfile
+    from .syntax import DSC_CACHE
+    from .version import __version__
+    try:
+        r_version = get_output('R --version').split('\n')[0].strip()
+    except Exception:
+        raise ValueError(
+            f"Executable ``R`` is required to evaluate R expression ``{codes[0]}``"
+        )
+    cache_file = f'{DSC_CACHE}/R_eval.pkl'
+    values = dict()
+    if os.path.isfile(cache_file):
+        try:
+            values = pickle.load(open(cache_file, 'rb'))
+        except Exception:
+            values = dict()
+    todo = [
+        x for x in codes
+        if not cache or (r_version, __version__, x) not in values
+    ]
+    if todo:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = []
+            for idx, code in enumerate(todo):
+                files.append(os.path.join(tmpdir, f'{idx}.R'))
+                with open(files[-1], 'w') as f:
+                    f.write(code)
+            with open(os.path.join(tmpdir, 'eval.R'), 'w') as f:
+                f.write(R_EVAL_SCRIPT)
+            cmd = f"R --slave -f {shlex.quote(os.path.join(tmpdir, 'eval.R'))} --args " + \
+                ' '.join([shlex.quote(x) for x in files])
+            try:
+                get_output(cmd)
+            except Exception:
+                from .utils import install_package_interactive
+                install_package_interactive(
+                    f'dscrutils@stephenslab/dsc/dscrutils>={__version__}',
+                    'R_library')
+                try:
+                    get_output(cmd)
+                except Exception:
+                    raise ValueError(
+                        f"Failed to evaluate R expression ``{todo[0]}``")
+            for code, fn in zip(todo, files):
+                if not os.path.isfile(fn + '.out'):
+                    msg = open(fn + '.err').read().strip() if os.path.isfile(
+                        fn + '.err') else ''
+                    raise ValueError(
+                        f"Failed to evaluate R expression ``{code}``" +
+                        (f": {msg}" if msg else ''))
+                values[(r_version, __version__,
+                        code)] = open(fn + '.out').read().strip()
+        try:
+            os.makedirs(DSC_CACHE, exist_ok=True)
+            pickle.dump(values, open(cache_file, 'wb'))
+        except Exception:
+            pass
+    return dict([(x, values[(r_version, __version__, x)]) for x in codes])
+
+
 class CastData(YLine):
     def __init__(self):
         YLine.__init__(self)
@@ -458,18 +529,36 @@ class EntryFormatter:
     '''
     Run format transformation to DSC entries
     '''
-    def __init__(self):
-        pass
+    def __init__(self, r_cache=True):
+        self.r_cache = r_cache
+        self.volatile = False
 
     def __call__(self, data, variables):
+        expand_vars = ExpandVars(variables)
+        # Evaluate all R expressions in one R session
+        r_codes = uniq_list([
+            x[1:-1] for value in self.__Values(data)
+            for x in ExpandActions.locate(expand_vars(value), 'R')
+        ])
+        expand_actions = ExpandActions(
+            eval_R(r_codes, cache=self.r_cache) if r_codes else None)
         actions = [
-            ExpandVars(variables),
-            ExpandActions(),
+            expand_vars, expand_actions,
             Str2List(),
             CastData(),
             CheckFile()
         ]
-        return self.__Transform(data, actions)
+        res = self.__Transform(data, actions)
+        self.volatile = expand_actions.volatile
+        return res
+
+    def __Values(self, cfg):
+        '''Iterate over string entries to be transformed'''
+        for value in cfg.values():
+            if isinstance(value, Mapping):
+                yield from self.__Values(value)
+            elif isinstance(value, str):
+                yield value.strip().strip(',')
 
     def __Transform(self, cfg, actions):
         '''Apply actions to items'''
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Parse throughput of the single pass parser against the regex parser.
+
+Usage: python -m dsc.parser.benchmark [number of parameter lines]
+"""
+
+import sys
+import timeit
+
+from .parser import _Parser, _LineParser
+
+
+def make_block(n_params):
+    """A DSC module block with `n_params` parameter lines."""
+    lines = ['simulate:', '  @CONF:', '    R_libs: MASS', '    exec_path: bin']
+    for i in range(n_params):
+        if i % 5 == 0:
+            lines.append(f'  # parameter {i}')
+        lines.append(f'  p{i}: {i}, {i + 0.5}, R(seq(1, {i + 1}))')
+    lines.extend(['  @ALIAS:', '    x: p0', '  $data: x'])
+    return '\n'.join(lines)
+
+
+def benchmark(n_params=1000, repeat=3):
+    text = make_block(n_params)
+    assert _Parser(text)() == _LineParser(text)()
+    res = dict()
+    for name, parser in [('regex', _Parser), ('single_pass', _LineParser)]:
+        secs = min(
+            timeit.repeat(lambda: parser(text)(), number=1, repeat=repeat))
+        res[name] = (secs, n_params / secs)
+    return res
+
+
+if __name__ == '__main__':
+    n_params = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for name, (secs, rate) in benchmark(n_params).items():
+        print(f'{name}: {secs:.4f} seconds, {rate:.0f} lines per second')
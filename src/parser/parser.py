@@ -2,6 +2,7 @@
 
 import functools
 import logging
+from collections import OrderedDict
 
 from ._nodes import Root, Section, Simple
 
@@ -12,6 +13,8 @@ from .exceptions import (
 from .patterns import (
     COMMENT, BLANK_LINE, DASHES, LIST, SIMPLE, SECTION,
     LIST_ITEM, NULL, TRUE, FALSE, FLOAT, INT, STR,
+    COMMENT_LINE, BLANK_ONLY_LINE, DASHES_LINE, SECTION_LINE, SIMPLE_LINE,
+    LIST_ITEM_LINE,
 )
 
 logger = logging.getLogger(__name__)
@@ -39,6 +42,10 @@ def log_callback(wrapped_function):
         """Helper to log an escaped version of the given message to DEBUG"""
         logger.debug(message.encode('unicode_escape').decode())
 
+    if not logger.isEnabledFor(logging.DEBUG):
+        # no per-callback overhead unless debugging is on at import time
+        return wrapped_function
+
     @functools.wraps(wrapped_function)
     def _wrapper(parser, match, **kwargs):
         func_name = wrapped_function.__name__
@@ -224,8 +231,9 @@ class _Parser(object):
             return match
 
         raise NoMatchException(
-            'None of the known patterns match for {}'
-            ''.format(self.source[self.pos:])
+            'None of the known patterns match at line {} for {}'
+            ''.format(self.source.count('\n', 0, self.pos) + 1,
+                      self.source[self.pos:])
         )
 
     def __call__(self):
@@ -240,8 +248,87 @@ class _Parser(object):
         return self.root()
 
 
+class _LineParser(object):
+    """Single pass parser for the subset of the grammar used in DSC blocks:
+    sections, simple key value pairs, comments and blank lines.
+
+    Lines are classified one at a time with patterns anchored to the line,
+    and the tree is built as nested OrderedDict with a stack of open sections,
+    producing the same result as `_Parser`. Input it cannot classify (lists,
+    or values continued across lines) raises NoMatchException so the caller
+    can fall back to `_Parser`.
+    """
+    def __init__(self, source):
+        self.source = source
+
+    @staticmethod
+    def read_from_tag(string):
+        # same conversion as `_Parser.read_from_tag` given WHITE_LIST
+        match = INT.match(string)
+        if match and match.group() == string:
+            return int(string)
+        match = FLOAT.match(string)
+        if match and match.group() == string:
+            return float(string)
+        match = STR.match(string)
+        if match and match.group() == string:
+            return string
+        error_message = 'Unable to determine type for "{}"'
+        raise NoTypeException(error_message.format(string))
+
+    def __call__(self):
+        root = OrderedDict()
+        # stack of (level, container or None for simple values)
+        stack = [(-1, root)]
+        lines = self.source.split('\n')
+        # the last line can only be a simple entry if not ended with newline
+        last = len(lines) - 1 if lines[-1] else len(lines)
+        if not lines[-1]:
+            lines.pop()
+        for idx, line in enumerate(lines):
+            if idx < last:
+                if COMMENT_LINE.fullmatch(line) or \
+                   BLANK_ONLY_LINE.fullmatch(line) or \
+                   DASHES_LINE.fullmatch(line):
+                    continue
+            if LIST_ITEM_LINE.match(line) or (
+                    line.endswith(' ') and line.rstrip(' ').endswith(':')):
+                # lists, or values that may continue on the next line
+                raise NoMatchException(line)
+            match = SIMPLE_LINE.fullmatch(line)
+            is_section = False
+            if match is None and idx < last:
+                match = SECTION_LINE.fullmatch(line)
+                is_section = True
+            if match is None:
+                raise NoMatchException(line)
+            level = len(match.group('indent'))
+            while stack[-1][0] >= level:
+                stack.pop()
+            parent = stack[-1][1]
+            if parent is None:
+                raise ValueError(
+                    'Possible indentation error at line {}: ``{}``'.format(
+                        idx + 1, line.strip()))
+            key = self.read_from_tag(match.group('variable'))
+            if key in parent:
+                raise ValueError(
+                    'Duplicate key is not allowed: ``{}`` (line {})'.format(
+                        key, idx + 1))
+            if is_section:
+                parent[key] = OrderedDict()
+                stack.append((level, parent[key]))
+            else:
+                parent[key] = self.read_from_tag(match.group('value'))
+                stack.append((level, None))
+        return root
+
+
 def parse_string(string):
     # import re
     # parser = _Parser(re.sub(r'\\\s*\n', '', string))
-    parser = _Parser(string)
-    return parser()
+    try:
+        return _LineParser(string)()
+    except NoMatchException:
+        # input beyond what the line parser handles, eg lists
+        return _Parser(string)()
@@ -51,3 +51,12 @@ FALSE = re.compile(_FALSE)
 FLOAT = re.compile(_FLOAT)
 INT = re.compile(_INT)
 STR = re.compile(_STR)
+
+# line rules for the single pass parser, to be matched against one line
+# without its trailing newline
+COMMENT_LINE = re.compile(r" *#.*")
+BLANK_ONLY_LINE = re.compile(r"[ \t]*")
+DASHES_LINE = re.compile(r"---")
+SECTION_LINE = re.compile(_INDENT + _VAR + _INLINE_COMMENT)
+SIMPLE_LINE = re.compile(_INDENT + _VAR + _BLANK + _VALUE + _INLINE_COMMENT)
+LIST_ITEM_LINE = re.compile(_BLANK + r"-" + _BLANK)
@@ -70,9 +70,22 @@ class BasePlug:
     def load_env(self, depends_other, depends_self):
         return ''
 
+    def get_memory_lease(self, module):
+        '''Wait for memory required by `module` to run, see `dsc_io.acquire_memory`'''
+        return ''
+
     def get_input(self, params, lib):
         return ''
 
+    def get_seed(self, seed_option):
+        '''
+        Seed of an instance of a module without input from other modules, as
+        an expression in its SoS step, see `get_input`
+        '''
+        if seed_option == 'REPLICATE':
+            return '_DSC_REPLICATE'
+        return 'DSC_STEP_ID_ + _index + _DSC_REPLICATE'
+
     def get_output(self, params):
         return ''
 
@@ -144,6 +157,10 @@ class Shell(BasePlug):
             res += '\nRANDOM=$(($DSC_REPLICATE + $[DSC_STEP_ID_] + $[_index]))'
         return res
 
+    def get_seed(self, seed_option):
+        # seed option is not applied, see `get_input`
+        return 'DSC_STEP_ID_ + _index + _DSC_REPLICATE'
+
     def get_output(self, params):
         '''
         FIXME: assume for now that shell output produces one single file
@@ -234,6 +251,9 @@ class Shell(BasePlug):
             res += '\n' + '\n'.join(sorted(self.tempfile))
         return res
 
+    def get_memory_lease(self, module):
+        return f'if [ -n "$DSC_MEM_LIMIT" ]; then dsc-io --acquire-memory {module} $$; fi'
+
     def get_return(self, output_vars):
         if output_vars is None:
             return "\ttouch $[_output]"
@@ -247,7 +267,17 @@ class Shell(BasePlug):
                 res[key] = container[val]
         res['DSC_DEBUG'] = dict()
         res['DSC_DEBUG']['replicate'] = 0
-        return f"\ncat >> $[_output] << EOF\n{dict2yaml(res)}\nEOF"
+        # resource usage of the shell and the commands it has run;
+        # `times` has to run in current shell, not in a subshell
+        res['DSC_DEBUG']['time'] = '$SECONDS'
+        for key in ['cpu_time', 'read_bytes', 'write_bytes']:
+            res['DSC_DEBUG'][key] = f'$DSC_{key.upper()}'
+        usage = 'times > $[_output].times\n' \
+            'DSC_CPU_TIME=$(awk \'{for (i = 1; i <= NF; i++) {split($i, t, "m"); s += t[1] * 60 + substr(t[2], 1, length(t[2]) - 1)}} END {print s}\' $[_output].times)\n' \
+            'rm -f $[_output].times\n' \
+            'DSC_READ_BYTES=$(awk \'/^rchar/ {print $2}\' /proc/$$/io 2> /dev/null || true)\n' \
+            'DSC_WRITE_BYTES=$(awk \'/^wchar/ {print $2}\' /proc/$$/io 2> /dev/null || true)'
+        return f"\n{usage}\ncat >> $[_output] << EOF\n{dict2yaml(res)}\nEOF"
 
     @staticmethod
     def add_try(content, n_output):
@@ -296,6 +326,9 @@ class RPlug(BasePlug):
                 self.get_var(lhs),
                 f'paste0(${{_output[0]:nr}}, ".{lhs}.{rhs}")'))
 
+    def get_memory_lease(self, module):
+        return f"if (Sys.getenv('DSC_MEM_LIMIT') != '') system2('dsc-io', c('--acquire-memory', '{module}', Sys.getpid()))"
+
     def load_env(self, depends_other, depends_self):
         '''
         depends_other: [(name, var, ext), (name, var, ext), ...]
@@ -313,7 +346,7 @@ class RPlug(BasePlug):
             if any([x[1] is None for x in depends[k]])
         ]
         assign_idx = [(i, k) for i, k in enumerate(depends.keys()) if any([
-            x[1].split('.')[-1] in ['rds', 'pkl', 'yml'] for x in depends[k]
+            x[1].split('.')[-1] in ['rds', 'pkl', 'yml', 'h5'] for x in depends[k]
             if x[1] is not None
         ])]
         loader = 'dscrutils:::read_dsc'
@@ -323,7 +356,7 @@ class RPlug(BasePlug):
         for i, k in assign_idx:
             for j in depends[k]:
                 if j[1] is not None and j[1].split('.')[-1] in [
-                        'rds', 'pkl', 'yml'
+                        'rds', 'pkl', 'yml', 'h5'
                 ]:
                     assign_in.append(
                         f'{self.identifier}${j[0]} <- {loader}("${{_input[{i}]:n}}.{j[1]}")'
@@ -504,17 +537,21 @@ class PyPlug(BasePlug):
             if any([x[1] is None for x in depends[k]])
         ]
         assign_idx = [(i, k) for i, k in enumerate(depends.keys()) if any([
-            x[1].split('.')[-1] in ['rds', 'pkl', 'yml'] for x in depends[k]
+            x[1].split('.')[-1] in ['rds', 'pkl', 'yml', 'h5'] for x in depends[k]
             if x[1] is not None
         ])]
+        # only variables used by this module are read from upstream output
+        # which matters for formats supporting partial loads eg HDF5
+        load_vars = sorted(
+            set([x[0] for k in depends for x in depends[k] if x[1] is None]))
         # load files
-        res += '\nfrom dsc.dsc_io import load_dsc as __load_dsc__, source_dirs as __source_dirs__'
-        load_in = f'\n{self.identifier} = __load_dsc__([${{paths([_input[i] for i in {load_idx}]):r,}}])'
+        res += '\nfrom dsc.dsc_io import load_dsc as __load_dsc__, source_dirs as __source_dirs__, resource_usage as __resource_usage__'
+        load_in = f'\n{self.identifier} = __load_dsc__([${{paths([_input[i] for i in {load_idx}]):r,}}], variables = {repr(load_vars)})'
         assign_in = ['\n']
         for i, k in assign_idx:
             for j in depends[k]:
                 if j[1] is not None and j[1].split('.')[-1] in [
-                        'rds', 'pkl', 'yml'
+                        'rds', 'pkl', 'yml', 'h5'
                 ]:
                     assign_in.append(
                         f'{self.identifier}[{repr(j[0])}] = __load_dsc__("${{_input[{i}]:n}}.{j[1]}")'
@@ -540,6 +577,9 @@ class PyPlug(BasePlug):
             res += '\n' + '\n'.join(sorted(self.tempfile))
         return res
 
+    def get_memory_lease(self, module):
+        return f"import os\nfrom dsc.dsc_io import acquire_memory as __acquire_memory__\n__acquire_memory__('{module}', os.getpid())"
+
     def get_input(self, params, lib, seed_option):
         # import from lib_path
         res = '__source_dirs__([{}])'.format(','.join(
@@ -569,13 +609,20 @@ class PyPlug(BasePlug):
 
     def get_return(self, output_vars):
         if output_vars is None:
+            if self.output_ext == 'h5':
+                return '\tfrom dsc.hdf5io import save as __save_h5__; __save_h5__(0, ${_output:r})'
             return '\timport pickle; pickle.dump(0, open(${_output:r}, "wb"))'
         if len(output_vars) == 0:
             return ''
-        res = '\npickle.dump({{{}}}, open(${{_output:r}}, "wb"))'.\
+        if self.output_ext == 'h5':
+            saver = '\nfrom dsc.hdf5io import save as __save_h5__\n__save_h5__({{{}}}, ${{_output:r}})'
+        else:
+            saver = '\npickle.dump({{{}}}, open(${{_output:r}}, "wb"))'
+        res = saver.\
           format(', '.join(['"{0}": {1}'.format(x, output_vars[x]) for x in output_vars] + \
                            [f"'DSC_DEBUG': dict([('time', timeit.default_timer() - TIC_{self.identifier[4:]}), " \
-                            "('script', inspect.getsource(inspect.getmodule(inspect.currentframe()))), ('replicate', DSC_REPLICATE), ('seed', DSC_SEED)])"]))
+                            "('script', inspect.getsource(inspect.getmodule(inspect.currentframe()))), ('replicate', DSC_REPLICATE), ('seed', DSC_SEED)] " \
+                            "+ list(__resource_usage__().items()))"]))
         # res += '\nfrom os import _exit; _exit(0)'
         return res.strip()
 
@@ -4,10 +4,13 @@ __copyright__ = "Copyright 2016, Stephens lab"
 __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
 import os, re, pickle
-import pandas as pd, numpy as np
-from .utils import uniq_list, case_insensitive_uniq_list, flatten_list, filter_sublist, FormatError, DBError, logger
-from .yhat_sqldf import sqldf
+from .utils import uniq_list, case_insensitive_uniq_list, flatten_list, filter_sublist, FormatError, DBError, logger, \
+    LazyImport, profiler
 from .line import parse_filter
+from .dsc_io import DSC_PROFILE
+
+pd = LazyImport('pandas')
+np = LazyImport('numpy')
 
 # keywords for SQLite
 # https://www.sqlite.org/lang_keywords.html
@@ -50,6 +53,7 @@ class Query_Processor:
         self.db = db
         self.targets = uniq_list(' '.join(targets).split())
         self.raw_condition = condition
+        profiler.start('query_load')
         with open(os.path.expanduser(db), 'rb') as f:
             self.data = pickle.load(f)
         # table: msg map
@@ -69,24 +73,29 @@ class Query_Processor:
         self.output_checklist = dict(valid={}, invalid={})
         # 1. Check overlapping groups and fix the case when some module in the group has some parameter but others do not
         # changes will be applied to self.data
+        profiler.start('query_1_groups')
         self.groups.update(self.get_grouped_tables(groups))
         self.check_overlapping_groups()
         self.add_na_group_parameters()
         # 2. Get query targets and conditions
+        profiler.start('query_2_targets')
         self.target_tables = self.get_table_fields(self.targets)
         self.check_output_variables()
         self.condition, self.condition_tables = parse_filter(
             condition, groups=self.groups)
         # 3. only keep tables that do exist in database
+        profiler.start('query_3_tables')
         self.target_tables = self.filter_tables(self.target_tables)
         self.condition_tables = self.filter_tables(self.condition_tables)
         # 4. identify and extract which part of each pipeline are involved
         # based on tables in target / condition
         # input pipelines (from data) are:
         # [('rnorm', 'mean', 'MSE'), ('rnorm', 'median', 'MSE'), ... ('rt', 'winsor', 'MSE')]
+        profiler.start('query_4_pipelines')
         self.pipelines, self.target_tables, self.condition_tables = self.filter_pipelines(
             self.data['.pipelines'])
         # 5. make select / from / where clause
+        profiler.start('query_5_clauses')
         select_clauses = self.get_select_clause()
         from_clauses = self.get_from_clause()
         where_clauses = self.get_where_clause()
@@ -95,13 +104,18 @@ class Query_Processor:
             for x in list(zip(*[select_clauses, from_clauses, where_clauses]))
         ])
         # 6. run queries
+        profiler.start('query_6_run')
         self.output_tables = self.run_queries()
         # 7. merge table
+        profiler.start('query_7_merge')
         self.output_table = self.merge_tables()
         # 8. fillna
+        profiler.start('query_8_fillna')
         self.fillna()
         # 9. finally show warnings
+        profiler.start('query_9_warn')
         self.warn()
+        profiler.stop()
 
     @staticmethod
     def legalize_name(name, kw=False):
@@ -133,7 +147,7 @@ class Query_Processor:
             raise DBError(
                 f"``{x}`` does not define a module or a group of modules in current DSC benchmark."
             )
-        if y == 'DSC_TIME':
+        if y in DSC_PROFILE:
             return
         k = list(self.data.keys())[keys_lower.index(x.lower())]
         y_low = y.lower()
@@ -641,6 +655,7 @@ class Query_Processor:
         return self.data
 
     def run_queries(self):
+        from .yhat_sqldf import sqldf
         if len(self.queries) == 0:
             raise DBError("Incompatible targets ``{}``{}".\
                           format(', '.join(self.targets),
@@ -28,3 +28,5 @@ DSC_PYMODULE = LazyRegex(r'(^from|^import)(.*?)', re.VERBOSE)
 DSC_RESERVED_MODULE = LazyRegex(r'^default$|_\d+$|^pipeline_|_$', re.VERBOSE)
 
 DSC_CACHE = '.dsc'
+# global cache of modules marked as cached, if not set by --global-cache
+DSC_GLOBAL_CACHE = '~/.cache/dsc'
@@ -4,7 +4,7 @@ __copyright__ = "Copyright 2016, Stephens lab"
 __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
 
-import sys, os, re, yaml, itertools, collections, sympy
+import sys, os, re, yaml, itertools, collections, importlib
 from itertools import cycle, chain, islice
 from fnmatch import fnmatch
 from difflib import SequenceMatcher
@@ -17,7 +17,6 @@ try:
 except ImportError:
     from hashlib import md5 as xxh
 from .constant import HTML_CSS, HTML_JS
-from sos.__main__ import AnswerMachine
 
 class Logger:
     def __init__(self):
@@ -110,7 +109,107 @@ class DBError(Exception):
         self.args = (msg, )
 
 
-Expr_mul = sympy.Expr.__mul__
+class LazyImport:
+    '''
+    Module placeholder that is only imported on first attribute access,
+    so that heavy dependencies do not slow down command line startup.
+    eg. `pd = LazyImport('pandas')` in place of `import pandas as pd`
+    '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr in ('_name', '_module'):
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+class Profiler:
+    '''
+    Wall time and memory of consecutive phases of a command, eg
+    `profiler.start('parse')` ends the current phase, if any, and starts
+    phase "parse"; `profiler.stop()` ends it. Memory is the resident size of
+    current process at the end of the phase and its peak so far, in bytes.
+    With `cprofile`, statistics of each phase are also collected by `cProfile`.
+    Nothing is done unless `enable()` is called. Results are saved under
+    `prefix`, which is set by the command once known.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.prefix = None
+        self.phases = []
+        self._current = None
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        self.cprofile = cprofile
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        import time
+        self.stop()
+        stats = None
+        if self.cprofile:
+            import cProfile
+            stats = cProfile.Profile()
+            stats.enable()
+        self._current = (name, time.perf_counter(), stats)
+
+    def stop(self):
+        if self._current is None:
+            return
+        import time, resource
+        name, tic, stats = self._current
+        elapsed = time.perf_counter() - tic
+        self._current = None
+        if stats is not None:
+            stats.disable()
+        # current and peak resident size from the same source
+        try:
+            status = dict([x.split(':', 1) for x in open('/proc/self/status') if ':' in x])
+            memory = int(status['VmRSS'].split()[0]) * 1024
+            peak = int(status['VmHWM'].split()[0]) * 1024
+        except Exception:
+            memory = None
+            # in kilobytes except on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        if memory is not None:
+            peak = max(peak, memory)
+        self.phases.append((dict([('phase', name), ('time', elapsed), ('memory', memory), ('peak_memory', peak)]), stats))
+
+    def save(self):
+        '''
+        Save phases to `<prefix>.profile.json`, and statistics of each phase
+        to `<prefix>.<phase>.prof` to be loaded by `pstats`; then report them
+        '''
+        if not self.enabled or self.prefix is None:
+            return
+        import json
+        self.stop()
+        phases = [x[0] for x in self.phases]
+        with open(f'{self.prefix}.profile.json', 'w') as f:
+            json.dump(phases, f, indent=2)
+        for item, stats in self.phases:
+            if stats is not None:
+                stats.dump_stats(f"{self.prefix}.{item['phase']}.prof")
+        width = max([len(x['phase']) for x in phases] + [5])
+        lines = [f"{'phase'.ljust(width)}  {'time (s)':>10}  {'memory (M)':>10}  {'peak (M)':>10}"]
+        for x in phases:
+            memory = 'NA' if x['memory'] is None else f"{x['memory'] / 1048576:.1f}"
+            lines.append(f"{x['phase'].ljust(width)}  {x['time']:>10.3f}  {memory:>10}  {x['peak_memory'] / 1048576:>10.1f}")
+        print('\n'.join(lines))
+        logger.info(f'Profile saved to ``{self.prefix}.profile.json``' +
+                    (f' and ``{self.prefix}.<phase>.prof``' if self.cprofile else ''))
+
+
+profiler = Profiler()
+sympy = LazyImport('sympy')
+Expr_mul = None
 
 
 def mymul(a, b):
@@ -123,11 +222,16 @@ def mymul(a, b):
         return (Expr_mul(a, b))
 
 
-sympy.Expr.__mul__ = mymul
+def patch_sympy():
+    global Expr_mul
+    if Expr_mul is None:
+        Expr_mul = sympy.Expr.__mul__
+        sympy.Expr.__mul__ = mymul
 
 
 def non_commutative_symexpand(expr_string):
     from sympy.parsing.sympy_parser import parse_expr
+    patch_sympy()
     parsed_expr = parse_expr(expr_string, evaluate=False)
     new_locals = {
         sym.name: sympy.Symbol(sym.name, commutative=False)
@@ -139,6 +243,7 @@ def non_commutative_symexpand(expr_string):
 def bool_symexpand(expr_string):
     from sympy.parsing.sympy_parser import parse_expr
     from sympy.logic.boolalg import to_dnf
+    patch_sympy()
     parsed_expr = parse_expr(expr_string, evaluate=False)
     new_locals = {
         sym.name: sympy.Symbol(sym.name)
@@ -393,7 +498,8 @@ def recursive_items(dictionary):
 
 
 def dict2str(value):
-    res = yaml.safe_dump(strip_dict(value, into_list=True))
+    res = yaml.dump(strip_dict(value, into_list=True),
+                    Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
     # pattern = re.compile(r'!!python/(.*?)\s')
     # for m in re.finditer(pattern, res):
     #     res = res.replace(m.group(1), '', 1)
@@ -450,6 +556,86 @@ def sos_hash_output(values, jobs=1):
     return [xxh(value).hexdigest() for value in values]
 
 
+FILTER_OPERATORS = {
+    '==': lambda x, y: x == y,
+    '!=': lambda x, y: x != y,
+    '>': lambda x, y: x > y,
+    '<': lambda x, y: x < y,
+    '>=': lambda x, y: x >= y,
+    '<=': lambda x, y: x <= y,
+    'in': lambda x, y: x in y
+}
+
+
+def filter_mask(params, conditions):
+    '''
+    Evaluate compiled @FILTER `conditions` over the cartesian product of
+    `params`, a list of (name, values) whose last parameter varies slowest.
+    `conditions` are OR-ed lists of AND-ed (negate, lhs, operator, rhs,
+    rhs_is_parameter) as made by `DSC_Module.compile_filter`.
+
+    Each condition is evaluated only once per distinct value (or pair of
+    values when comparing two parameters), then broadcast over the grid.
+    Returns a boolean mask of shape (len(values_N), ..., len(values_1)).
+    '''
+    import numpy as np
+    params = list(reversed(params))
+    shape = tuple(len(v) for k, v in params)
+    axis = dict([(k, i) for i, (k, v) in enumerate(params)])
+    values = dict(params)
+
+    def evaluate(lhs, op, rhs, rhs_is_param):
+        op = FILTER_OPERATORS[op]
+        if not rhs_is_param:
+            rhs = eval(rhs, dict(values))
+            res = np.array([bool(op(x, rhs)) for x in values[lhs]],
+                           dtype=bool)
+            dims = [axis[lhs]]
+        else:
+            res = np.array([[bool(op(x, y)) for y in values[rhs]]
+                            for x in values[lhs]],
+                           dtype=bool).reshape(len(values[lhs]),
+                                               len(values[rhs]))
+            dims = [axis[lhs], axis[rhs]]
+            if dims[0] == dims[1]:
+                res = np.diagonal(res).copy()
+                dims = dims[:1]
+            elif dims[0] > dims[1]:
+                res = res.T
+                dims = sorted(dims)
+        view = [1] * len(shape)
+        for d in dims:
+            view[d] = shape[d]
+        return res.reshape(view)
+
+    mask = np.zeros([1] * len(shape), dtype=bool)
+    for and_list in conditions:
+        item = np.ones([1] * len(shape), dtype=bool)
+        for negate, lhs, op, rhs, rhs_is_param in and_list:
+            res = evaluate(lhs, op, rhs, rhs_is_param)
+            item = item & (~res if negate else res)
+        mask = mask | item
+    return np.broadcast_to(mask, shape)
+
+
+def sos_filter_product(params, conditions):
+    '''
+    Parameter combinations satisfying compiled @FILTER `conditions`, in the
+    same order as `[(_a,_b) for _b in b for _a in a if ...]` with
+    `params = [('a', a), ('b', b)]`. Single parameter values are not put in
+    tuples.
+    '''
+    import numpy as np
+    mask = filter_mask(params, conditions)
+    idx = np.unravel_index(np.flatnonzero(mask), mask.shape)
+    columns = [[v[i] for i in index.tolist()]
+               for (k, v), index in zip(reversed(params), idx)]
+    columns.reverse()
+    if len(columns) == 1:
+        return columns[0]
+    return list(zip(*columns))
+
+
 def chunks(l, n):
     """Yield successive n-sized chunks from l."""
     return [l[i:i + n] for i in range(0, len(l), n)]
@@ -584,6 +770,7 @@ def install_package(lib, libtype, dryrun=False, autoinstall=False):
 
 
 def install_package_interactive(lib, libtype, required=True):
+    from sos.__main__ import AnswerMachine
     am = AnswerMachine()
     if libtype == 'R_library':
         from sos.targets_r import R_library as target_check
@@ -861,23 +1048,37 @@ def is_sublist(sub, lst):
 
 
 def filter_sublist(lists, ordered=True):
-    '''remove lists who are sublist of other lists'''
+    '''
+    remove lists who are sublist of other lists
+
+    Instead of comparing every pair of lists, for ordered sublists all proper
+    contiguous slices of every list are collected in a set to look up lists
+    against; for unordered ones, lists containing all elements of a list are
+    found by intersecting an index of lists by element.
+    '''
     lists = uniq_list(lists)
-    max_lists = []
-    for x in lists:
-        include = True
+    if ordered:
+        slices = set()
         for y in lists:
-            if x == y:
-                continue
-            if ordered:
-                if is_sublist(x, y):
-                    include = False
-                    break
-            else:
-                if all([xx in y for xx in x]):
-                    include = False
-                    break
-        if include:
+            if len(y):
+                slices.add(tuple())
+            for i in range(len(y)):
+                for j in range(i + 1, len(y) + 1):
+                    if j - i < len(y):
+                        slices.add(tuple(y[i:j]))
+        return [x for x in lists if tuple(x) not in slices]
+    index = dict()
+    for idx, y in enumerate(lists):
+        for item in y:
+            index.setdefault(item, set()).add(idx)
+    max_lists = []
+    for idx, x in enumerate(lists):
+        if len(x) == 0:
+            candidates = set(range(len(lists)))
+        else:
+            candidates = set.intersection(*[index[item] for item in x])
+        candidates.discard(idx)
+        if not any(lists[i] != x for i in candidates):
             max_lists.append(x)
     return max_lists
 
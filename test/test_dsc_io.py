@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from dsc import hdf5io
+from dsc import dsc_io
+from dsc.dsc_io import load_dsc, fetch_dsc, log_event, load_events, \
+    store_cache, fetch_cache, evict_cache, detach_output, get_module_cache_key
+from dsc.dsc_database import get_cache_key
+
+
+class TestFetchDSC(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(6):
+            data = {
+                'x': np.arange(5) * i,
+                'score': i / 2,
+                'method': f'm{i}',
+                'stats': {'mean': float(i), 'sd': 1.0},
+                'df': pd.DataFrame({'a': [i, i + 1]}),
+                'ragged': list(range(i)),
+                'DSC_DEBUG': {'time': 0.5 + i, 'replicate': 1, 'seed': i, 'script': ''}
+            }
+            fn = os.path.join(self.temp_dir, f'out_{i}')
+            # both output formats in the same batch
+            if i % 2:
+                pickle.dump(data, open(fn + '.pkl', 'wb'))
+                self.files.append(fn + '.pkl')
+            else:
+                hdf5io.save(data, fn + '.h5')
+                self.files.append(fn + '.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def loop(self, variable):
+        return [load_dsc(fn)[variable] for fn in self.files]
+
+    def testFetch(self):
+        '''fetch_dsc matches loading files one by one with load_dsc'''
+        for jobs in [1, 2]:
+            res = fetch_dsc(self.files, 'x', jobs=jobs, progress=False)
+            np.testing.assert_array_equal(res, np.stack(self.loop('x')))
+            res = fetch_dsc(self.files, 'score', jobs=jobs, progress=False)
+            np.testing.assert_array_equal(res, np.array(self.loop('score')))
+            res = fetch_dsc(self.files, 'method', jobs=jobs, progress=False)
+            self.assertEqual(list(res), self.loop('method'))
+            res = fetch_dsc(self.files, 'stats', jobs=jobs, progress=False)
+            self.assertEqual(list(res.index), self.files)
+            self.assertEqual(res.to_dict('records'), self.loop('stats'))
+            res = fetch_dsc(self.files, 'df', jobs=jobs, progress=False)
+            pd.testing.assert_frame_equal(res, pd.concat(self.loop('df'), keys=self.files))
+            res = fetch_dsc(self.files, 'ragged', jobs=jobs, progress=False)
+            self.assertEqual(res.dtype, object)
+            self.assertEqual(list(res), self.loop('ragged'))
+
+    def testFetchNames(self):
+        '''files can be given without extension, as reported by dsc-query'''
+        names = [os.path.splitext(x)[0] for x in self.files]
+        np.testing.assert_array_equal(fetch_dsc(names, 'score', progress=False),
+                                      fetch_dsc(self.files, 'score', progress=False))
+        np.testing.assert_array_equal(fetch_dsc(names, 'DSC_TIME', progress=False),
+                                      [0.5 + i for i in range(6)])
+        np.testing.assert_array_equal(fetch_dsc(names, 'DSC_OUTPUT_SIZE', progress=False),
+                                      [os.path.getsize(x) for x in self.files])
+        self.assertEqual(len(fetch_dsc([], 'score', progress=False)), 0)
+        self.assertRaises(ValueError, fetch_dsc, names, 'missing', jobs=1, progress=False)
+        self.assertRaises(ValueError, fetch_dsc, [names[0] + '_missing'], 'score', progress=False)
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testLogEvent(self):
+        '''events of the latest run are loaded, and logging never fails'''
+        fn = os.path.join(self.temp_dir, 'res.events.jsonl')
+        log_event(fn, 'run_started', to_run=2)
+        log_event(fn, 'finished', module='a')
+        log_event(fn, 'run_started', to_run=1)
+        log_event(fn, 'started', module='b')
+        with open(fn, 'a') as f:
+            f.write('{"event": "fini')
+        res = load_events(fn)
+        self.assertEqual([x['event'] for x in res], ['run_started', 'started'])
+        self.assertEqual(res[0]['to_run'], 1)
+        self.assertEqual(res[1]['module'], 'b')
+        # eg output folder of the submitting host on a remote host
+        log_event(os.path.join(self.temp_dir, 'missing', 'res.events.jsonl'), 'started')
+        self.assertEqual(load_events(os.path.join(self.temp_dir, 'missing', 'res.events.jsonl')), [])
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def output(self, name, content):
+        fn = os.path.join(self.temp_dir, 'bench', name)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, 'w') as f:
+            f.write(content)
+        return fn
+
+    def testCacheKey(self):
+        '''cache keys change with parameters, code and upstream modules'''
+        name = 'median:98b37c9a:normal:a9f57519'
+        module_ids = {'median': 1, 'normal': 2, 'other': 3}
+        key = get_cache_key(name, module_ids, 'pkl')
+        self.assertEqual(len(key), 40)
+        self.assertEqual(key, get_cache_key(name, dict(module_ids), 'pkl'))
+        # parameters of the module and of upstream modules
+        self.assertNotEqual(key, get_cache_key('median:98b37c9b:normal:a9f57519', module_ids, 'pkl'))
+        self.assertNotEqual(key, get_cache_key('median:98b37c9a:normal:a9f57510', module_ids, 'pkl'))
+        # code of the module and of upstream modules
+        self.assertNotEqual(key, get_cache_key(name, dict(module_ids, median=4), 'pkl'))
+        self.assertNotEqual(key, get_cache_key(name, dict(module_ids, normal=4), 'pkl'))
+        # but not modules elsewhere in the benchmark
+        self.assertEqual(key, get_cache_key(name, dict(module_ids, other=4), 'pkl'))
+        self.assertNotEqual(key, get_cache_key(name, module_ids, 'rds'))
+
+    def testStoreFetch(self):
+        '''output is stored in the cache, and fetched from it in another benchmark'''
+        key = get_cache_key('normal:a9f57519', {'normal': 1}, 'pkl')
+        output = self.output('normal_1.pkl', 'content')
+        self.assertFalse(fetch_cache(self.cache_dir, key, output))
+        store_cache(self.cache_dir, key, output)
+        cached = os.path.join(self.cache_dir, key[:2], key + '.pkl')
+        self.assertTrue(os.path.isfile(cached))
+        self.assertFalse(any(x.endswith('.tmp') for x in os.listdir(os.path.dirname(cached))))
+        target = os.path.join(self.temp_dir, 'other', 'normal', 'normal_3.pkl')
+        self.assertTrue(fetch_cache(self.cache_dir, key, target))
+        self.assertEqual(open(target).read(), 'content')
+        self.assertFalse(fetch_cache(self.cache_dir, key[::-1], target))
+        # existing entries are kept, and missing output is not stored
+        detach_output(output)
+        store_cache(self.cache_dir, key, self.output('normal_1.pkl', 'changed'))
+        self.assertEqual(open(cached).read(), 'content')
+        store_cache(self.cache_dir, key[::-1], output + '.missing')
+        self.assertEqual(os.listdir(self.cache_dir), [key[:2]])
+
+    def testDetachOutput(self):
+        '''re-running a module does not modify cached output linked to it'''
+        output = self.output('normal_1.pkl', 'content')
+        detach_output(output)
+        self.assertTrue(os.path.isfile(output))
+        with mock.patch('fcntl.ioctl', side_effect=OSError):
+            store_cache(self.cache_dir, 'ab' * 20, output)
+        detach_output(output)
+        self.assertFalse(os.path.isfile(output))
+        self.assertEqual(open(dsc_io._cache_file(self.cache_dir, 'ab' * 20, output)).read(), 'content')
+
+    def testLinkFile(self):
+        '''output is reflinked, else hard linked, else copied'''
+        source = self.output('source', 'content')
+        target = os.path.join(self.temp_dir, 'target')
+        with mock.patch('fcntl.ioctl') as ioctl, mock.patch('os.link') as link:
+            dsc_io._link_file(source, target)
+            self.assertEqual(ioctl.call_args[0][1], 0x40049409)
+            link.assert_not_called()
+        os.remove(target)
+        with mock.patch('fcntl.ioctl', side_effect=OSError):
+            dsc_io._link_file(source, target)
+        self.assertEqual(os.stat(target).st_nlink, 2)
+        self.assertTrue(os.path.samefile(source, target))
+        os.remove(target)
+        # eg across devices
+        with mock.patch('fcntl.ioctl', side_effect=OSError), \
+             mock.patch('os.link', side_effect=OSError) as link:
+            dsc_io._link_file(source, target)
+            link.assert_called_once_with(source, target)
+        self.assertEqual(os.stat(target).st_nlink, 1)
+        self.assertEqual(open(target).read(), 'content')
+        # evicted from the cache meanwhile
+        self.assertRaises(FileNotFoundError, dsc_io._link_file, source + '.missing', target)
+
+    def testEvictSize(self):
+        '''least recently used files are evicted first'''
+        now = time.time()
+        keys = []
+        for i in range(4):
+            keys.append(get_cache_key(f'normal:{i}', {'normal': 1}, 'pkl'))
+            output = self.output(f'normal_{i}.pkl', 'x' * 100)
+            store_cache(self.cache_dir, keys[-1], output)
+            os.utime(dsc_io._cache_file(self.cache_dir, keys[-1], output), (now - 100 + i, now - 100 + i))
+        # fetching a file makes it the most recently used
+        self.assertTrue(fetch_cache(self.cache_dir, keys[0], os.path.join(self.temp_dir, 'x.pkl')))
+        self.assertEqual(evict_cache(self.cache_dir, limit=1000), 400)
+        self.assertEqual(evict_cache(self.cache_dir, limit=250), 200)
+        cached = [dsc_io._cache_file(self.cache_dir, k, 'x.pkl') for k in keys]
+        self.assertEqual([os.path.isfile(x) for x in cached], [True, False, False, True])
+        # empty folders are removed
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(set([keys[0][:2], keys[3][:2]])))
+        self.assertEqual(evict_cache(self.cache_dir, limit=0), 0)
+        self.assertEqual(evict_cache(os.path.join(self.temp_dir, 'missing'), limit=0), 0)
+
+    def testModuleCacheKey(self):
+        '''keys of modules marked as cached change with code, parameters and seed'''
+        params = [('n', 100), ('mu', 0.5)]
+        key = get_module_cache_key('sig', params, 1, 'pkl')
+        self.assertEqual(key, get_module_cache_key('sig', list(params), 1, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig2', params, 1, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig', [('n', 100), ('mu', 0.6)], 1, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig', [('n', 100), ('mu', '0.5')], 1, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig', [('n', 100)], 1, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig', params, 2, 'pkl'))
+        self.assertNotEqual(key, get_module_cache_key('sig', params, 1, 'rds'))
+
+    def testEvictAge(self):
+        '''files unused for `max_age` are evicted, then the least recently used'''
+        now = time.time()
+        cached = []
+        for i, age in enumerate([10, 1000, 20, 2000]):
+            output = self.output(f'normal_{i}.pkl', 'x' * 100)
+            store_cache(self.cache_dir, f'{i:02d}' * 20, output)
+            cached.append(dsc_io._cache_file(self.cache_dir, f'{i:02d}' * 20, output))
+            os.utime(cached[-1], (now - age, now - age))
+        self.assertEqual(evict_cache(self.cache_dir, max_age=500), 200)
+        self.assertEqual([os.path.isfile(x) for x in cached], [True, False, True, False])
+        self.assertEqual(evict_cache(self.cache_dir, limit=150, max_age=500), 100)
+        self.assertEqual([os.path.isfile(x) for x in cached], [True, False, False, False])
+        self.assertEqual(evict_cache(self.cache_dir), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
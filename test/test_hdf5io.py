@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import tables
+
+from dsc import hdf5io
+from dsc.dsc_io import load_dsc
+from dsc.dsc_parser import DSC_Script
+
+text0 = '''
+DSC:
+    run: simulate
+simulate: Python(x = numpy.random.normal(0, 1, n))
+    n: 10
+    $x: x
+    @CONF: output_format = h5
+'''
+
+
+def module_output():
+    '''Output of a module instance, in the variety of types modules return'''
+    return {
+        'x': np.arange(1000, dtype=float),
+        'n': 10,
+        'pi': 3.14,
+        'flag': True,
+        'name': 'normal',
+        'unicode': 'μ = 0, σ² = 1',
+        'short': [1, 2, 3],
+        'nested': {'a': 1, 'b': {'c': 'd', 'e': [0.5, 1.5]}},
+        'DSC_DEBUG': {'time': 0.1, 'replicate': 1, 'seed': 12, 'script': 'x = 1\n' * 10000}
+    }
+
+
+class TestHDF5IO(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def save(self, data, name='data.h5', **kwargs):
+        fn = os.path.join(self.temp_dir, name)
+        hdf5io.save(data, fn, **kwargs)
+        return fn
+
+    def testOutputFormat(self):
+        '''Python modules can write HDF5 output'''
+        res = DSC_Script(text0)
+        self.assertEqual(res.modules['simulate'].plugin.output_ext, 'h5')
+
+    def testLoadDSC(self):
+        '''module output round trip through HDF5'''
+        data = module_output()
+        fn = self.save(data)
+        res = load_dsc(fn)
+        self.assertEqual(sorted(res.keys()), sorted(data.keys()))
+        np.testing.assert_array_equal(res['x'], data['x'])
+        for k in ['n', 'pi', 'flag', 'name', 'unicode', 'short', 'nested']:
+            self.assertEqual(res[k], data[k])
+        self.assertEqual(res['DSC_DEBUG'], data['DSC_DEBUG'])
+        # DSC_DEBUG entries are Python native, eg for seeds of downstream modules
+        self.assertIs(type(res['DSC_DEBUG']['seed']), int)
+
+    def testLoadDSCVariables(self):
+        '''only requested variables are read from HDF5 output'''
+        fn = self.save(module_output())
+        res = load_dsc(fn, variables=['n', 'unicode'])
+        self.assertEqual(sorted(res.keys()), ['DSC_DEBUG', 'n', 'unicode'])
+        self.assertEqual(res['unicode'], 'μ = 0, σ² = 1')
+        res = load_dsc(fn, variables={'x': hdf5io.aslice[10:20]})
+        np.testing.assert_array_equal(res['x'], np.arange(10, 20, dtype=float))
+        self.assertEqual(load_dsc(fn, variables=['missing']).keys(), {'DSC_DEBUG'})
+
+    def testChunkshape(self):
+        '''chunks span rows, and are about CHUNK_BYTES'''
+        self.assertEqual(hdf5io._get_chunkshape((100000, 10), 8), (13107, 10))
+        self.assertEqual(hdf5io._get_chunkshape((10, 10), 8), (10, 10))
+        # rows larger than a chunk are split
+        chunk = hdf5io._get_chunkshape((10, 1000000), 8)
+        self.assertEqual(chunk[0], 1)
+        self.assertLessEqual(np.prod(chunk) * 8, hdf5io.CHUNK_BYTES)
+        chunk = hdf5io._get_chunkshape((4, 1000, 1000), 8)
+        self.assertEqual(chunk[2], 1000)
+        self.assertLessEqual(np.prod(chunk) * 8, hdf5io.CHUNK_BYTES)
+
+    def testCompression(self):
+        '''large arrays are chunked and compressed, small ones are not'''
+        x = np.arange(200000, dtype=float).reshape(20000, 10)
+        fn = self.save({'x': x, 'y': np.arange(10)})
+        with tables.open_file(fn) as f:
+            self.assertEqual(f.root.x.chunkshape, hdf5io._get_chunkshape(x.shape, 8))
+            self.assertEqual(f.root.x.filters.complib, 'blosc')
+            self.assertEqual(f.root.x.filters.complevel, hdf5io.COMPRESSION_LEVEL)
+            self.assertIsNone(f.root.y.chunkshape)
+        np.testing.assert_array_equal(hdf5io.load(fn)['x'], x)
+        np.testing.assert_array_equal(hdf5io.load(fn, '/x', sel=hdf5io.aslice[5:9]), x[5:9])
+        fn = self.save({'x': x}, name='zlib.h5', compression=('zlib', 1))
+        with tables.open_file(fn) as f:
+            self.assertEqual(f.root.x.filters.complib, 'zlib')
+        np.testing.assert_array_equal(hdf5io.load(fn)['x'], x)
+        fn = self.save({'x': x}, name='level.h5', level=1)
+        with tables.open_file(fn) as f:
+            self.assertEqual(f.root.x.filters.complib, 'blosc')
+            self.assertEqual(f.root.x.filters.complevel, 1)
+        fn = self.save({'x': x}, name='zlib_level.h5', compression='zlib', level=9)
+        with tables.open_file(fn) as f:
+            self.assertEqual(f.root.x.filters.complevel, 9)
+        np.testing.assert_array_equal(hdf5io.load(fn)['x'], x)
+
+    def testBloscThreads(self):
+        '''blosc uses as many threads as CPUs available unless specified'''
+        with mock.patch('dsc.hdf5io.tables.open_file', wraps=tables.open_file) as open_file:
+            self.save({'x': 1}, nthreads=3)
+            self.assertEqual(open_file.call_args[1]['max_blosc_threads'], 3)
+            self.save({'x': 1})
+            self.assertEqual(open_file.call_args[1]['max_blosc_threads'],
+                             len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count())
+            self.save({'x': 1}, nthreads=0)
+            self.assertEqual(open_file.call_args[1]['max_blosc_threads'], 1)
+
+    def testLazyLoad(self):
+        '''entries are read on access, and arrays as far as they are sliced'''
+        data = module_output()
+        data['big'] = np.arange(200000, dtype=float).reshape(20000, 10)
+        data['small'] = np.arange(10)
+        data['bytes'] = b'raw'
+        fn = self.save(data)
+        with hdf5io.lazy_load(fn) as res:
+            self.assertEqual(sorted(res), sorted(data))
+            self.assertEqual(len(res), len(data))
+            self.assertIn('nested', res)
+            self.assertNotIn('DSC_IO_UNPACK', res)
+            # plain dictionaries are browsed lazily
+            self.assertIsInstance(res['nested'], hdf5io.LazyGroup)
+            self.assertIsInstance(res['nested']['b'], hdf5io.LazyGroup)
+            self.assertEqual(res['nested']['b']['c'], 'd')
+            self.assertEqual(res['nested']['b']['e'], [0.5, 1.5])
+            self.assertEqual(res.load('nested'), data['nested'])
+            # compressed arrays are sliced on disk
+            self.assertIsInstance(res['big'], hdf5io.LazyArray)
+            self.assertEqual(res['big'].shape, (20000, 10))
+            self.assertEqual(res['big'].dtype, np.dtype(float))
+            self.assertEqual(len(res['big']), 20000)
+            np.testing.assert_array_equal(res['big'][5:9, 2], data['big'][5:9, 2])
+            np.testing.assert_array_equal(np.asarray(res['big']), data['big'])
+            np.testing.assert_array_equal(res.load('big'), data['big'])
+            np.testing.assert_array_equal(res.load('big', hdf5io.aslice[:3]), data['big'][:3])
+            # uncompressed arrays are memory mapped
+            self.assertIsInstance(res['small'], np.memmap)
+            np.testing.assert_array_equal(res['small'], data['small'])
+            # string attributes are decoded as by `load`
+            self.assertEqual(res['name'], 'normal')
+            self.assertEqual(res['unicode'], data['unicode'])
+            self.assertEqual(res['bytes'], hdf5io.load(fn, '/bytes'))
+            self.assertIsInstance(res['bytes'], str)
+            self.assertEqual(res['n'], 10)
+            self.assertEqual(res['DSC_DEBUG']['script'], data['DSC_DEBUG']['script'])
+            self.assertRaises(KeyError, res.__getitem__, 'missing')
+        with hdf5io.lazy_load(fn, mmap=False) as res:
+            self.assertIsInstance(res['small'], hdf5io.LazyArray)
+            np.testing.assert_array_equal(res['small'][:], data['small'])
+
+    def assertRoundTrip(self, data, res):
+        '''`res` is `data`, down to the types of entries'''
+        self.assertIs(type(res), type(data))
+        if isinstance(data, dict):
+            self.assertEqual(list(res.keys()), list(data.keys()))
+            for k in data:
+                self.assertRoundTrip(data[k], res[k])
+        elif isinstance(data, (list, tuple)):
+            self.assertEqual(len(res), len(data))
+            for x, y in zip(data, res):
+                self.assertRoundTrip(x, y)
+        elif isinstance(data, np.ndarray):
+            self.assertEqual(res.dtype, data.dtype)
+            self.assertEqual(res.shape, data.shape)
+            np.testing.assert_array_equal(res, data)
+        else:
+            self.assertEqual(res, data)
+
+    def testLongSequences(self):
+        '''long lists are stored natively when they can, and always round trip'''
+        n = 300
+        cases = {
+            'int': (list(range(n)), b'scalar'),
+            'float': (tuple([x / 3 for x in range(n)]), b'scalar'),
+            'bool': ([x % 2 == 0 for x in range(n)], b'scalar'),
+            'str': ([f'x{i}' for i in range(n)], b'scalar'),
+            'unicode': ([f'μ{i}σ²' for i in range(n)], b'scalar'),
+            'npscalar': ([np.float32(x) for x in range(n)], b'npscalar'),
+            'array': ([np.arange(4) + x for x in range(n)], b'array'),
+            'ragged': ([np.arange(x % 7) * 1.5 for x in range(n)], b'ragged'),
+            # pickled
+            '0d': ([np.array(x) for x in range(n)], None),
+            'mixed': ([x if x % 2 else str(x) for x in range(n)], None),
+            'null': ([f'x{i}\x00' for i in range(n)], None),
+            'bigint': ([2**70 + x for x in range(n)], None),
+            'nested': ([{'a': x} for x in range(n)], None),
+        }
+        data = dict([(k, v[0]) for k, v in cases.items()])
+        fn = self.save(data)
+        res = hdf5io.load(fn)
+        for k in cases:
+            self.assertRoundTrip(data[k], res[k])
+        with tables.open_file(fn) as f:
+            for k, (value, kind) in cases.items():
+                node = getattr(f.root, k)
+                self.assertEqual(node._v_attrs['seqkind'] if 'seqkind' in node._v_attrs else None, kind)
+        # stacked arrays can be sliced
+        np.testing.assert_array_equal(hdf5io.load(fn, '/array', sel=hdf5io.aslice[2:4]),
+                                      np.stack(data['array'][2:4]))
+
+    def testLargeDicts(self):
+        '''dicts above the dicttable threshold round trip'''
+        n = 300
+        data = {
+            'scalars': dict([(f'k{i}', i / 2) for i in range(n)]),
+            'unicode': dict([(f'μ{i}', f'σ{i}') for i in range(n)]),
+            'int_keys': dict([(i, [i, i + 1]) for i in range(n)]),
+            'nested': dict([(f'k{i}', {'v': i, 'w': dict([(f'j{j}', j) for j in range(n)])})
+                            for i in range(3)]),
+            'ragged': dict([(f'k{i}', list(range(i % 5))) for i in range(n)])
+        }
+        data['nested'].update(dict([(f'x{i}', i) for i in range(n)]))
+        fn = self.save(data)
+        res = hdf5io.load(fn)
+        for k in ['scalars', 'int_keys', 'ragged']:
+            self.assertRoundTrip(data[k], res[k])
+        # scalars in nested dicts are attributes, loaded as numpy types
+        self.assertEqual(res['unicode'], data['unicode'])
+        self.assertEqual(res['nested'], data['nested'])
+        with tables.open_file(fn) as f:
+            self.assertTrue(f.root.scalars._v_title.startswith('dicttable:'))
+            self.assertTrue(f.root.nested._v_title.startswith('dicttable:'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,19 @@
 # Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
 # Distributed under the terms of the MIT License.
 
+import glob
+import os
+import shlex
+import shutil
 import subprocess
+import tempfile
 import unittest
+from unittest import mock
 
-from dsc.dsc_parser import DSC_Script
-from dsc.utils import FormatError
+from dsc.dsc_parser import DSC_Script, DSC_Module, load_dsc_script, remote_config_parser
+from dsc.utils import FormatError, sos_filter_product, filter_sublist
+from dsc.line import EntryFormatter, eval_R
+from dsc.parser.parser import _Parser, parse_string
 
 text0 = '''
 DSC:
@@ -480,6 +488,49 @@ simulate, t: R(), R()
         res = DSC_Script(text)
         self.assertEqual(res.modules['simulate'].dump()['input_filter'], '(_n in (100,200,300))')
 
+    def testFilterProduct(self):
+        n = [100, 200, 300, 400, 500]
+        k = [0, 1]
+        s = ['a', 'b']
+        ft = DSC_Module.compile_filter(['(n <= 300 and k = 0) or (n > k and not s = "a")'])
+        self.assertEqual(
+            sos_filter_product([('n', n), ('k', k), ('s', s)], ft),
+            [(_n, _k, _s) for _s in s for _k in k for _n in n
+             if (_n <= 300 and _k == 0) or (_n > _k and not _s == "a")])
+        ft = DSC_Module.compile_filter(['n in [100,200,300]'])
+        self.assertEqual(sos_filter_product([('n', n)], ft), [100, 200, 300])
+
+    def testLineParser(self):
+        text = '''
+simulate:
+    # parameters
+    n: 100, 200
+    @CONF: R_libs = MASS
+    @ALIAS:
+        x: n
+    name: "a#b" # comment
+    1: 2.5
+    $out: x
+DSC:
+    run: simulate
+'''
+        self.assertEqual(parse_string(text), _Parser(text)())
+        # fall back to regex parser for lists
+        text = 'a:\n  - 1\n  - 2\n'
+        self.assertEqual(parse_string(text), {'a': [1, 2]})
+        # duplicate keys and indentation errors are reported with line number
+        self.assertRaisesRegex(ValueError, 'line 3', parse_string,
+                               'a:\n  x: 1\n  x: 2')
+        self.assertRaisesRegex(ValueError, 'line 2', parse_string,
+                               'x: 1\n  y: 2')
+
+    def testFilterSublist(self):
+        lists = [('a', 'b', 'c'), ('b', 'c'), ('a', 'c'), ('a', 'b', 'c'), ('c', 'd')]
+        self.assertEqual(filter_sublist(lists),
+                         [('a', 'b', 'c'), ('a', 'c'), ('c', 'd')])
+        self.assertEqual(filter_sublist(lists, ordered=False),
+                         [('a', 'b', 'c'), ('c', 'd')])
+
     def testParameterModuleConflict(self):
         # parameter name conflict with output
         text = text0 + '''
@@ -555,6 +606,222 @@ simulate: Python()
         res = DSC_Script(text)
         self.assertEqual(res.modules['simulate'].dump()['input']['K'], ["'TRUE'", "'FALSE'", "'NULL'"])
 
+    def testScriptCache(self):
+        '''parsed scripts are cached once per script, and requirements checked on load'''
+        cwd = os.getcwd()
+        temp_dir = tempfile.mkdtemp()
+        os.chdir(temp_dir)
+        try:
+            with open('t.dsc', 'w') as f:
+                f.write(text0 + '''
+simulate: Python(x = n)
+    n: 1, 2
+    $x: x
+''')
+            script, pipelines = load_dsc_script('t.dsc', output='a')
+            self.assertEqual(len(glob.glob('.dsc/t.*.script.pkl')), 1)
+            with mock.patch.object(DSC_Script, 'check_requirements') as check:
+                res = load_dsc_script('t.dsc', output='a')
+                check.assert_called_once_with(False)
+            self.assertEqual(res[0].modules['simulate'].dump()['input'], {'n': [1, 2]})
+            self.assertEqual(len(res[1]), len(pipelines))
+            # parses with other options replace the cached one
+            load_dsc_script('t.dsc', output='b')
+            self.assertEqual(len(glob.glob('.dsc/t.*.script.pkl')), 1)
+            self.assertEqual(load_dsc_script('t.dsc', output='b')[0].runtime.output, 'b')
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(temp_dir)
+
+    def testScriptCacheActions(self):
+        '''scripts with Python() or Shell() entries are parsed on each run'''
+        cwd = os.getcwd()
+        temp_dir = tempfile.mkdtemp()
+        os.chdir(temp_dir)
+        try:
+            os.mkdir('data')
+            open('data/1.csv', 'w').close()
+            with open('t.dsc', 'w') as f:
+                f.write(text0 + '''
+simulate: Python(x = n)
+    n: Shell(ls data | wc -l)
+    $x: x
+''')
+            res = load_dsc_script('t.dsc', output='a')[0]
+            self.assertEqual(res.modules['simulate'].dump()['input'], {'n': [1]})
+            self.assertEqual(glob.glob('.dsc/t.*.script.pkl'), [])
+            open('data/2.csv', 'w').close()
+            res = load_dsc_script('t.dsc', output='a')[0]
+            self.assertEqual(res.modules['simulate'].dump()['input'], {'n': [2]})
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(temp_dir)
+
+
+class TestEvalR(unittest.TestCase):
+    '''R expressions are evaluated by a mock R session writing values of known expressions'''
+    values = {'1:3': '1,2,3', 'c(4,5)': '4,5', 'rnorm(1)': '0.5'}
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        self.sessions = []
+        patcher = mock.patch('dsc.line.get_output', side_effect=self.run_R)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+
+    def run_R(self, cmd, **kwargs):
+        if cmd == 'R --version':
+            return 'R version 4.1.0 (2021-05-18) -- "Camp Pontanezen"\n'
+        args = shlex.split(cmd)
+        files = args[args.index('--args') + 1:]
+        self.sessions.append([open(fn).read() for fn in files])
+        for fn in files:
+            code = open(fn).read()
+            if code in self.values:
+                with open(fn + '.out', 'w') as f:
+                    f.write(self.values[code])
+            elif code.startswith('stop'):
+                with open(fn + '.err', 'w') as f:
+                    f.write('object not found')
+        return ''
+
+    def testBatch(self):
+        '''all R expressions of a script are evaluated in one R session'''
+        data = {'simulate': {'n': 'R(1:3)', 'm': 'R{c(4,5)}', 'k': 'R(1:3)', 'x': '1'}}
+        res = EntryFormatter()(data, None)
+        self.assertEqual(self.sessions, [['1:3', 'c(4,5)']])
+        self.assertEqual(res['simulate']['n'], [(1, 2, 3)])
+        self.assertEqual(res['simulate']['k'], [(1, 2, 3)])
+        self.assertEqual(res['simulate']['m'], [4, 5])
+        self.assertEqual(res['simulate']['x'], [1])
+
+    def testCache(self):
+        '''values are cached, and evaluated again only if not cached or on refresh'''
+        self.assertEqual(eval_R(['1:3', 'rnorm(1)']), {'1:3': '1,2,3', 'rnorm(1)': '0.5'})
+        self.assertTrue(os.path.isfile('.dsc/R_eval.pkl'))
+        self.assertEqual(eval_R(['rnorm(1)']), {'rnorm(1)': '0.5'})
+        self.assertEqual(len(self.sessions), 1)
+        # only expressions not in cache are evaluated
+        self.assertEqual(eval_R(['rnorm(1)', 'c(4,5)']), {'rnorm(1)': '0.5', 'c(4,5)': '4,5'})
+        self.assertEqual(self.sessions[1], ['c(4,5)'])
+        # refresh
+        self.values = dict(self.values, **{'rnorm(1)': '-1.2'})
+        self.assertEqual(eval_R(['rnorm(1)']), {'rnorm(1)': '0.5'})
+        self.assertEqual(eval_R(['rnorm(1)'], cache=False), {'rnorm(1)': '-1.2'})
+        self.assertEqual(self.sessions[2], ['rnorm(1)'])
+        self.assertEqual(eval_R(['rnorm(1)', '1:3']), {'rnorm(1)': '-1.2', '1:3': '1,2,3'})
+        self.assertEqual(len(self.sessions), 3)
+        # EntryFormatter refreshes too
+        EntryFormatter(r_cache=False)({'simulate': {'n': 'R(1:3)'}}, None)
+        self.assertEqual(self.sessions[3], ['1:3'])
+
+    def testError(self):
+        '''error messages of R are reported'''
+        with self.assertRaises(ValueError) as context:
+            eval_R(['1:3', 'stop("x")'])
+        self.assertIn('``stop("x")``: object not found', str(context.exception))
+        with self.assertRaises(ValueError) as context:
+            eval_R(['undefined()'])
+        self.assertTrue(str(context.exception).endswith('``undefined()``'))
+        # nothing is cached for failed evaluations
+        self.assertFalse(os.path.isfile('.dsc/R_eval.pkl'))
+
+    def testRequirements(self):
+        '''dscrutils is installed if R fails, and R is required'''
+        with mock.patch('dsc.line.get_output', side_effect=[
+                'R version 4.1.0', RuntimeError, RuntimeError]), \
+             mock.patch('dsc.utils.install_package_interactive') as install:
+            self.assertRaises(ValueError, eval_R, ['1:3'])
+            self.assertEqual(install.call_args[0][1], 'R_library')
+        with mock.patch('dsc.line.get_output', side_effect=RuntimeError):
+            self.assertRaises(ValueError, eval_R, ['1:3'])
+
+
+host0 = '''
+DSC:
+  midway2:
+    queue_type: pbs
+    status_check_interval: 30
+    max_running_jobs: 30
+    task_template: |
+      #!/bin/bash
+      #SBATCH --time={walltime}
+      #SBATCH --mem={mem//10**9}G
+    submit_cmd: sbatch {job_file}
+    status_cmd: squeue --job {job_id}
+    kill_cmd: scancel {job_id}
+
+default:
+  queue: midway2
+  instances_per_node: 4
+  instances_per_job: auto
+  time_per_instance: auto
+  mem_per_instance: auto
+  time_per_job: 1h
+
+simulate:
+  instances_per_job: 200
+
+score:
+  queue: midway2.local
+'''
+
+
+class TestRemoteConfig(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.host = os.path.join(self.temp_dir, 'midway2.yml')
+        with open(self.host, 'w') as f:
+            f.write(host0)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testAutoPacking(self):
+        '''jobs are sized from runtime and peak memory of previous runs'''
+        runtime = {'simulate': [10, 100], 'analyze': [600, 1200], 'score': [1]}
+        memory = {'simulate': 1E9, 'analyze': 3E9, 'plot': 5E8}
+        conf = remote_config_parser(self.host, runtime, memory)
+        # 50% more time and memory than the largest seen
+        self.assertEqual(conf['simulate']['walltime'], '00:02:30')
+        self.assertEqual(conf['simulate']['mem'], '1500M')
+        self.assertEqual(conf['simulate']['trunk_size'], 200)
+        # modules following default configuration are sized on their own
+        self.assertEqual(conf['analyze']['walltime'], '00:30:00')
+        self.assertEqual(conf['analyze']['mem'], '4500M')
+        self.assertEqual(conf['analyze']['trunk_size'], 8)
+        self.assertEqual(conf['plot']['mem'], '750M')
+        self.assertEqual(conf['plot']['walltime'], '5m')
+        # local jobs are not packed
+        self.assertEqual(conf['score']['queue'], 'midway2.local')
+        self.assertNotIn('mem', conf['score'])
+        # without history, defaults apply
+        self.assertEqual(conf['default']['walltime'], '5m')
+        self.assertEqual(conf['default']['mem'], '2G')
+        self.assertEqual(conf['default']['trunk_size'], 48)
+        conf = remote_config_parser(self.host)
+        self.assertEqual(conf['simulate']['mem'], '2G')
+        self.assertEqual(conf['simulate']['walltime'], '5m')
+        self.assertNotIn('analyze', conf)
+
+    def testFixedPacking(self):
+        '''configured values are kept whatever the history'''
+        with open(self.host, 'w') as f:
+            f.write(host0.replace('instances_per_job: auto', 'instances_per_job: 20')\
+                    .replace('time_per_instance: auto', 'time_per_instance: 10m')\
+                    .replace('mem_per_instance: auto', 'mem_per_instance: 3G'))
+        conf = remote_config_parser(self.host, {'analyze': [600]}, {'analyze': 3E9})
+        self.assertNotIn('analyze', conf)
+        self.assertEqual(conf['simulate']['mem'], '3G')
+        self.assertEqual(conf['simulate']['walltime'], '10m')
+        self.assertEqual(conf['default']['trunk_size'], 20)
+
 
 if __name__ == '__main__':
     #suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestParser)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from dsc.dsc_io import load_events, load_io_db, log_event
+from dsc.dsc_database import summarize_events, get_module_output, predict_runtime, \
+    check_signature_index, update_signature_index
+from dsc.dsc_translator import DSC_Translator
+
+text = '''
+simulate: Python(x = numpy.random.normal(n, 1, 10))
+  n: 1, 2
+  $x: x
+
+shift: Python(y = x + p)
+  x: $x
+  p: 0, 1
+  $y: y
+
+scale: Python(y = x * p)
+  x: $x
+  p: 2
+  $y: y
+
+analyze: Python(m = numpy.mean(y))
+  y: $y
+  $m: m
+
+DSC:
+  define:
+    transform: shift, scale
+  run: simulate * transform * analyze
+  output: res
+'''
+
+
+def run_cmd(cmd, stderr=subprocess.DEVNULL):
+    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=stderr,
+                          shell=True, check=True).stdout.decode()
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        with open('t.dsc', 'w') as f:
+            f.write(text)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.temp_dir)
+
+    def plan(self):
+        '''Instances to run and cached of each module, from `dsc --plan`'''
+        res = dict()
+        for line in run_cmd('dsc t.dsc --plan').splitlines():
+            line = line.split()
+            if line and line[0] in ['simulate', 'shift', 'scale', 'analyze']:
+                res[line[0]] = (int(line[3]), int(line[2]))
+        return res
+
+    def run_dsc(self):
+        '''Instances run of each module'''
+        run_cmd('dsc t.dsc')
+        res = summarize_events(load_events('.dsc/res.events.jsonl')).modules
+        return dict([(k, res[k].finished) for k in res if k != 'res'])
+
+    def testUpstreamChange(self):
+        '''instances downstream of ones to run are to run'''
+        self.assertEqual(self.plan(), {'simulate': (2, 0), 'shift': (4, 0), 'scale': (2, 0), 'analyze': (6, 0)})
+        self.run_dsc()
+        self.assertEqual(self.plan(), {'simulate': (0, 2), 'shift': (0, 4), 'scale': (0, 2), 'analyze': (0, 6)})
+        # new parameter value for shift, which re-runs shift and what follows it
+        with open('t.dsc', 'w') as f:
+            f.write(text.replace('p: 0, 1', 'p: 0, 1, 5'))
+        plan = self.plan()
+        self.assertEqual(plan, {'simulate': (0, 2), 'shift': (6, 0), 'scale': (0, 2), 'analyze': (6, 2)})
+        res = self.run_dsc()
+        self.assertEqual(res, dict([(k, v[0]) for k, v in plan.items()]))
+
+    def testCriticalPath(self):
+        '''steps downstream of outdated output count in the critical path'''
+        io_db = {
+            '1': {'a': {'input': [], 'output': ['a1', 'a2'], 'depends': []},
+                  'b': {'input': ['a1', 'a2'], 'output': ['b1', 'b2', 'b3', 'b4'], 'depends': [('a', 1)]}},
+            '2': {'a': ('1', 'a'),
+                  'c': {'input': ['a1', 'a2'], 'output': ['c1', 'c2'], 'depends': [('a', 1)]}}
+        }
+        outputs = get_module_output(io_db)
+        for files in outputs.values():
+            for fn in files:
+                open(fn, 'w').close()
+        # a2 is missing so is to run, and so are b2, b4 and c2 that take it as input
+        os.remove('a2')
+        history = {
+            'a': {'a1': (0, 1, '1', None), 'a2': (0, 1, '1', None)},
+            'b': dict([(f'b{i}', (0, 5, '2', None)) for i in range(1, 5)]),
+            'c': dict([(f'c{i}', (0, 2, '3', None)) for i in range(1, 3)])
+        }
+        module_ids = {'a': 1, 'b': 2, 'c': 3}
+        runtime = predict_runtime(history, outputs, module_ids, io_db)
+        self.assertEqual(runtime, {'a1': 0, 'a2': 1, 'b1': 0, 'b2': 5, 'b3': 0, 'b4': 5, 'c1': 0, 'c2': 2})
+        steps = [('a', 1), ('b', 1), ('c', 2)]
+        self.assertEqual(DSC_Translator.get_critical_path(io_db, steps, runtime),
+                         {('a', 1): 1, ('b', 1): 11, ('c', 2): 3})
+
+    def testSignatureIndex(self):
+        '''the index tells output is up-to-date only if no file or step ID has changed'''
+        outputs = {'a': ['out/a1', 'out/a2'], 'b': ['out/b1']}
+        os.mkdir('out')
+        for files in outputs.values():
+            for fn in files:
+                with open(fn, 'w') as f:
+                    f.write(fn)
+        module_ids = {'a': 1, 'b': 2}
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+        update_signature_index('.dsc/res.signatures.pkl', outputs, module_ids)
+        self.assertTrue(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', outputs, {'a': 1, 'b': 3}))
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl',
+                                               dict(outputs, b=['out/b1', 'out/b2']), module_ids))
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', dict(outputs, c=[]), module_ids))
+        # touched output file, even within the same second
+        stat = os.stat('out/a2')
+        os.utime('out/a2', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+        update_signature_index('.dsc/res.signatures.pkl', outputs, module_ids)
+        # output of the same time and another size
+        with open('out/b1', 'a') as f:
+            f.write('x')
+        os.utime('out/b1', ns=(stat.st_atime_ns, os.stat('.dsc/res.signatures.pkl').st_mtime_ns))
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+        update_signature_index('.dsc/res.signatures.pkl', outputs, module_ids)
+        self.assertTrue(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+        with open('.dsc/res.signatures.pkl', 'w') as f:
+            f.write('corrupted')
+        self.assertFalse(check_signature_index('.dsc/res.signatures.pkl', outputs, module_ids))
+
+    def testStrictFastPath(self):
+        '''"-s strict" skips SoS when nothing has changed, and falls back otherwise'''
+        def run(option = ''):
+            return run_cmd(f'dsc t.dsc {option}', stderr=subprocess.STDOUT)
+        fast = 'All module instances are up-to-date'
+        self.assertNotIn(fast, run())
+        self.assertIn(fast, run())
+        self.assertIn(fast, run('-s strict'))
+        # "lenient" neither uses nor updates the index
+        self.assertNotIn(fast, run('-s lenient'))
+        self.assertIn(fast, run())
+        outputs = get_module_output(load_io_db('.dsc/res.io.pkl'))
+        fn = outputs['analyze'][0]
+        stat = os.stat(fn)
+        os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertNotIn(fast, run())
+        self.assertIn(fast, run())
+
+    def testStatus(self):
+        '''"--status" does not need a DSC script, with other options anywhere'''
+        os.mkdir('.dsc')
+        log_event('.dsc/res.events.jsonl', 'run_started', output='res', jobs=2, to_run={'simulate': 2})
+        log_event('.dsc/res.events.jsonl', 'finished', module='simulate', time=1.5)
+        for cmd in ['dsc --status res', 'dsc --status res -v 2', 'dsc -v 2 --status res',
+                    'dsc --status=res/', 'dsc t.dsc --status res']:
+            out = run_cmd(cmd)
+            self.assertIn('Run on', out, cmd)
+            self.assertIn('simulate', out, cmd)
+        self.assertRaises(subprocess.CalledProcessError, run_cmd, 'dsc --status other')
+
+    def testProfile(self):
+        '''"--profile" saves time and memory of each phase, and cProfile statistics'''
+        run_cmd('dsc t.dsc --profile cprofile')
+        phases = json.load(open('.dsc/res.profile.json'))
+        self.assertEqual([x['phase'] for x in phases],
+                         ['parse', 'pipeline', 'translation', 'deploy', 'build', 'schedule', 'run', 'history'])
+        for x in phases:
+            self.assertGreaterEqual(x['time'], 0)
+            self.assertGreaterEqual(x['peak_memory'], x['memory'])
+            self.assertGreater(pstats.Stats(f".dsc/res.{x['phase']}.prof").total_calls, 0)
+        # cached parse and plan, without cProfile
+        for fn in os.listdir('.dsc'):
+            if fn.endswith('.prof'):
+                os.remove(os.path.join('.dsc', fn))
+        run_cmd('dsc t.dsc --plan --profile time')
+        phases = json.load(open('.dsc/res.profile.json'))
+        self.assertEqual([x['phase'] for x in phases], ['parse', 'translation', 'deploy', 'plan'])
+        self.assertFalse(any(fn.endswith('.prof') for fn in os.listdir('.dsc')))
+
+
+if __name__ == '__main__':
+    unittest.main()
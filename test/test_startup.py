@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import subprocess
+import sys
+import unittest
+
+# Modules on the command line startup path, with heavy dependencies
+# they should not import
+STARTUP_MODULES = {
+    'dsc.__main__': ['numpy', 'pandas', 'sympy', 'sqlalchemy', 'sos', 'msgpack'],
+    'dsc.__query__': ['numpy', 'pandas', 'sympy', 'sqlalchemy', 'sos', 'msgpack'],
+    'dsc.dsc_io': ['pandas', 'sympy', 'sqlalchemy', 'sos'],
+    'dsc.dsc_parser': ['pandas', 'sympy', 'sqlalchemy'],
+}
+
+
+def imported_modules(module):
+    '''Names of all modules loaded after importing `module` in a new interpreter'''
+    out = subprocess.run([sys.executable, '-c', f'import sys, {module}; print("\\n".join(sys.modules))'],
+                         stdout=subprocess.PIPE,
+                         check=True).stdout.decode()
+    return set(out.split())
+
+# Budget of cumulative import time in seconds of these modules, well above
+# their own import time but below that of the heavy dependencies
+IMPORT_TIME_BUDGET = 0.25
+
+
+def import_time(module):
+    '''Cumulative import time in seconds of `module`, as reported by `python -X importtime`'''
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         stderr=subprocess.PIPE,
+                         check=True).stderr.decode()
+    for line in out.splitlines():
+        # import time: self [us] | cumulative | imported package
+        item = line.split(':', 1)[-1].split('|')
+        if len(item) == 3 and item[2].strip() == module:
+            return int(item[1]) / 1E6
+    raise ValueError(f'Import time of {module} is not reported')
+
+
+class TestStartup(unittest.TestCase):
+    def testHeavyImports(self):
+        for module, heavy in STARTUP_MODULES.items():
+            res = imported_modules(module)
+            self.assertIn(module, res)
+            for item in heavy:
+                self.assertNotIn(item, res,
+                                 f'{module} should not import {item}')
+
+    def testImportTime(self):
+        for module in ['dsc.__main__', 'dsc.__query__']:
+            # best of a few runs, as timings vary on busy machines
+            res = min([import_time(module) for i in range(3)])
+            self.assertLess(res, IMPORT_TIME_BUDGET,
+                            f'{module} takes {res:.3f}s to import')
+
+
+if __name__ == '__main__':
+    unittest.main()